@@ -1,7 +1,11 @@
-from urllib2 import Request, urlopen, URLError, quote
+from urllib2 import URLError, quote
 import base64
 import xml.etree.ElementTree as etree
 
+import connections
+import metrics
+import tracing
+
 def indent(elem, level=0):
     """Indents an etree element so printing that element is actually human-readable"""
     i = "\n" + level*"  "
@@ -99,19 +103,34 @@ class Error(object):
         return "Error in '%s': %s" % (self.source, self.description)
 
 class USPSRequest(object):
+    # Set to send the request to another server (e.g. a standin.StandinServer) with the same paths
+    base_url = None
+
     def __init__(self, credentials, url):
         self.credentials = credentials
         self.url = url
         
     def Send(self):
-        root = self._get_xml()
-        request_text = etree.tostring(root)
+        operation = self.__class__.__name__
+        with metrics.request('usps', operation), tracing.span('usps.%s' % operation, carrier='usps', operation=operation, packages=len(getattr(self, 'packages', ()))):
+            return self._Send()
+
+    def _Send(self):
+        with tracing.span('marshal'):
+            root = self._get_xml()
+            request_text = etree.tostring(root)
+            full_url = '%s%s' % (connections.rebase(self.url, self.base_url), quote(request_text))
 
         try:
-            full_url = '%s%s' % (self.url, quote(request_text))
-            request = Request(full_url)
-            response_text = urlopen(request).read()
-            response = self._ParseResponse(response_text)
+            metrics.payload('request', len(full_url))
+            with tracing.span('network', request_bytes=len(full_url)) as span:
+                response_text = connections.pools.request(full_url)
+                span.set(reply_bytes=len(response_text))
+            metrics.payload('reply', len(response_text))
+            with tracing.span('unmarshal'):
+                response = self._ParseResponse(response_text)
+            if isinstance(response, Error):
+                metrics.error('USPSError', response.number)
         except URLError, e:
             if hasattr(e, 'reason'):
                 print 'Could not reach the server, reason: %s' % e.reason
@@ -0,0 +1,261 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import sys
+import copy
+import time
+import socket
+import httplib
+import threading
+import Queue
+from collections import OrderedDict
+from urllib2 import URLError, HTTPError
+
+from suds.transport import TransportError
+
+from shipping import address_key, readdress
+from connections import NotSent
+
+# Operations that are safe to send twice, so any transient failure is retried
+RETRYABLE = ( 'rate', 'validate' )
+
+def is_transient(error):
+    """True for failures worth retrying: dropped connections, timeouts and 5xx answers"""
+    if isinstance(error, HTTPError):
+        return error.code >= 500
+    if isinstance(error, TransportError):
+        return error.httpcode is None or error.httpcode >= 500
+    return isinstance(error, ( URLError, socket.error, httplib.HTTPException ))
+
+def is_unsent(error):
+    """True only for failures where the request provably never reached the carrier, e.g. a refused connection"""
+    return isinstance(error, NotSent)
+
+class Job(object):
+    """One carrier call, e.g. Job('ups', ups_api, (packages, shipper, recipient, '03', '02', False))"""
+    def __init__(self, carrier, api, args, kwargs=None, operation='label', reference=None):
+        self.carrier = carrier
+        self.api = api
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.operation = operation
+        self.reference = reference
+
+    def __call__(self):
+        return getattr(self.api, self.operation)(*self.args, **self.kwargs)
+
+class Result(object):
+    def __init__(self, job, response=None, error=None, attempts=1, elapsed=0):
+        self.job = job
+        self.response = response
+        self.error = error
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+class _Done(object):
+    def __init__(self, total, exc_info=None):
+        self.total = total
+        self.exc_info = exc_info
+
+class LabelBatch(object):
+    """Runs a stream of label jobs for any mix of carriers and yields results as they finish.
+
+        batch = LabelBatch(concurrency={ 'ups': 8, 'fedex': 4 })
+        for result in batch.run(jobs):
+            if result.ok:
+                save(result.job.reference, result.response)
+
+    Each carrier gets its own workers, so a slow carrier doesn't hold up the
+    others. Failures are retried up to `retries` times with exponential
+    backoff; anything else is reported on the result. Jobs for the operations
+    in `retryable` retry any transient failure, while the rest (e.g. labels,
+    which a timed out request may already have bought) only retry requests
+    that never reached the carrier. Jobs are read from the iterable only as
+    workers free up, so a run of thousands of labels doesn't have to be built
+    up front, and reading stops when the caller stops iterating over run().
+    progress, if given, is called with stats() after every finished job.
+    """
+    def __init__(self, concurrency=None, default_concurrency=4, retries=2, backoff=0.5, progress=None, retryable=RETRYABLE):
+        self.concurrency = concurrency or {}
+        self.default_concurrency = default_concurrency
+        self.retries = retries
+        self.retryable = retryable
+        self.backoff = backoff
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.started = None
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self._carrier_stats = dict()
+
+    def run(self, jobs):
+        self._reset()
+        self.started = time.time()
+        results = Queue.Queue()
+        # Set however run() ends, including the caller breaking out early, so the feeder and workers wind down
+        stop = threading.Event()
+        feeder = threading.Thread(target=self._feed, args=(jobs, results, stop))
+        feeder.daemon = True
+        feeder.start()
+
+        try:
+            done = None
+            finished = 0
+            while done is None or finished < done.total:
+                result = results.get()
+                if isinstance(result, _Done):
+                    done = result
+                    continue
+                finished += 1
+                self._record(result)
+                yield result
+
+            if done.exc_info:
+                raise done.exc_info[0], done.exc_info[1], done.exc_info[2]
+        finally:
+            stop.set()
+
+    def _feed(self, jobs, results, stop):
+        queues = dict()
+        total = 0
+        exc_info = None
+        try:
+            for job in jobs:
+                if stop.is_set():
+                    break
+                if job.carrier not in queues:
+                    queues[job.carrier] = self._start_workers(job.carrier, results, stop)
+                with self._lock:
+                    self.submitted += 1
+                    self._carrier(job.carrier)['submitted'] += 1
+                total += 1
+                # Blocks while the carrier's workers are busy, which keeps the backlog bounded
+                if not self._put(queues[job.carrier], job, stop):
+                    break
+        except Exception:
+            logger.exception('Reading batch jobs failed')
+            exc_info = sys.exc_info()
+        for carrier, queue in queues.items():
+            for i in range(self.concurrency.get(carrier, self.default_concurrency)):
+                self._put(queue, None, stop)
+        results.put(_Done(total, exc_info))
+
+    def _put(self, queue, item, stop):
+        # False if the run stopped before there was room
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _start_workers(self, carrier, results, stop):
+        workers = self.concurrency.get(carrier, self.default_concurrency)
+        queue = Queue.Queue(maxsize=workers * 2)
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, args=(queue, results, stop))
+            thread.daemon = True
+            thread.start()
+        return queue
+
+    def _work(self, queue, results, stop):
+        while not stop.is_set():
+            try:
+                job = queue.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+            if job is None:
+                return
+            results.put(self._attempt(job, stop))
+
+    def _attempt(self, job, stop):
+        start = time.time()
+        retry = is_transient if job.operation in self.retryable else is_unsent
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return Result(job, response=job(), attempts=attempt, elapsed=time.time() - start)
+            except Exception, e:
+                if attempt > self.retries or not retry(e) or stop.is_set():
+                    logger.info('%s %s failed after %d attempt(s): %s', job.carrier, job.operation, attempt, e)
+                    return Result(job, error=e, attempts=attempt, elapsed=time.time() - start)
+                with self._lock:
+                    self.retried += 1
+                    self._carrier(job.carrier)['retried'] += 1
+                stop.wait(self.backoff * 2 ** (attempt - 1))
+
+    def _record(self, result):
+        with self._lock:
+            counts = self._carrier(result.job.carrier)
+            if result.ok:
+                self.succeeded += 1
+                counts['succeeded'] += 1
+            else:
+                self.failed += 1
+                counts['failed'] += 1
+        if self.progress:
+            self.progress(self.stats())
+
+    def _carrier(self, carrier):
+        return self._carrier_stats.setdefault(carrier, { 'submitted': 0, 'succeeded': 0, 'failed': 0, 'retried': 0 })
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.time() - self.started if self.started else 0
+            finished = self.succeeded + self.failed
+            return {
+                'submitted': self.submitted,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'retried': self.retried,
+                'pending': self.submitted - finished,
+                'elapsed': elapsed,
+                'per_second': finished / elapsed if elapsed else 0.0,
+                'carriers': dict( (carrier, dict(counts)) for carrier, counts in self._carrier_stats.items() ),
+            }
+
+def validate_addresses(api, addresses, concurrency=8, retries=2, backoff=0.5, carrier='ups'):
+    """Validates many addresses with api.validate (e.g. a UPS object), once per distinct address.
+
+        for address, result in zip(addresses, validate_addresses(ups_api, addresses)):
+            if not result.ok:
+                print 'Could not validate %r: %s' % (address, result.error)
+
+    Addresses are grouped by shipping.address_key and each group is validated
+    once, at most concurrency at a time, retrying transient failures the way
+    LabelBatch does. Returns one Result per address in the order given; its
+    job holds that address and its index as reference. Addresses in the same
+    group get their own copies of the group's response, with their own names
+    and contact details on its candidates, or share its error.
+    """
+    addresses = list(addresses)
+    keys = [ address_key(address) for address in addresses ]
+    jobs = OrderedDict()
+    for key, address in zip(keys, addresses):
+        if key not in jobs:
+            jobs[key] = Job(carrier, api, ( address, ), operation='validate', reference=key)
+
+    runner = LabelBatch(concurrency={ carrier: concurrency }, retries=retries, backoff=backoff)
+    finished = dict( (result.job.reference, result) for result in runner.run(jobs.values()) )
+    logger.info('Validated %d addresses with %d %s calls', len(addresses), len(jobs), carrier)
+
+    results = list()
+    for i, ( key, address ) in enumerate(zip(keys, addresses)):
+        shared = finished[key]
+        job = Job(carrier, api, ( address, ), operation='validate', reference=i)
+        response = shared.response
+        if response is not None:
+            response = readdress(copy.deepcopy(response), address)
+        results.append(Result(job, response, shared.error, shared.attempts, shared.elapsed))
+    return results
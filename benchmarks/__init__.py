@@ -0,0 +1,28 @@
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; memory just isn't reported there
+    resource = None
+
+def measure(fn, min_time=0.5):
+    """Calls fn repeatedly for at least min_time seconds and returns the calls per second"""
+    fn()
+    count = 0
+    start = time.time()
+    while True:
+        fn()
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return count / elapsed
+
+def peak_memory_kb():
+    """The most memory the process has held so far, in KB, or None where that can't be read"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, OS X bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
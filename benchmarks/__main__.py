@@ -0,0 +1,75 @@
+# Runs the offline benchmark suite (benchmarks/suite.py) and reports operations
+# per second and memory for every case, e.g.
+#
+#   python -m benchmarks --output before.json
+#   ... change something ...
+#   python -m benchmarks --output after.json --compare before.json
+#   python -m benchmarks --stage parse --match ups
+#
+# peak_kb is the process's peak memory after the case and grew_kb how much the
+# case raised it, so cases that build large documents stand out. retained is
+# the number of objects still alive after the case that weren't before it.
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+
+from benchmarks import measure, peak_memory_kb, suite
+
+def run(stages=None, match=None, min_time=0.5):
+    results = dict()
+    for name, operations, fn in suite.cases(stages):
+        if match and match not in name:
+            continue
+        gc.collect()
+        objects = len(gc.get_objects())
+        peak = peak_memory_kb()
+        rate = measure(fn, min_time) * operations
+        gc.collect()
+        results[name] = {
+            'ops_per_sec': rate,
+            'peak_kb': peak_memory_kb(),
+            'grew_kb': peak_memory_kb() - peak if peak is not None else None,
+            'retained': len(gc.get_objects()) - objects,
+        }
+    return results
+
+def report(results, previous=None):
+    for name in sorted(results):
+        result = results[name]
+        line = '%-55s %12.1f ops/sec  %8s KB peak  %6s KB grew  %7d retained' % (name, result['ops_per_sec'], result['peak_kb'], result['grew_kb'], result['retained'])
+        if previous and name in previous:
+            line += '  %.2fx' % (result['ops_per_sec'] / previous[name]['ops_per_sec'])
+        print line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Offline benchmarks for every carrier code path')
+    parser.add_argument('--stage', action='append', choices=[ stage for stage, make in suite.STAGES ], help='only run this stage (repeatable)')
+    parser.add_argument('--match', help='only run cases whose name contains this')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds to spend on each case')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    results = run(args.stage, args.match, args.min_time)
+    report(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'min_time': args.min_time,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
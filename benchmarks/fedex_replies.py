@@ -0,0 +1,50 @@
+# Reply-side cost of Fedex.rate and Fedex.label: suds unmarshalling the whole
+# reply against fedex_xml reading only the fields the library uses, over the
+# recorded replies in wsdl/fedex.
+#
+#   python -m benchmarks.fedex_replies
+import os
+import glob
+
+from suds.client import SoapClient
+
+from benchmarks import measure
+import fedex
+import fedex_xml
+
+FEDEX_DIR = os.path.join(os.path.dirname(__file__), '..', 'wsdl', 'fedex')
+
+REPLIES = [
+    ( 'RateReply', 'RateService_v9.wsdl', 'getRates', fedex_xml.RATE_REPLY ),
+    ( 'ProcessShipmentReply', 'ShipService_v9.wsdl', 'processShipment', fedex_xml.SHIP_REPLY ),
+]
+
+def run():
+    api = fedex.Fedex({}, debug=False)
+    results = dict()
+    for name, wsdl, operation, projection in REPLIES:
+        client = api.create_client(wsdl)
+        method = getattr(client.service, operation).method
+        soap = SoapClient(client, method)
+        replies = []
+        for path in sorted(glob.glob(os.path.join(FEDEX_DIR, '%s_*.txt' % name))):
+            with open(path) as f:
+                replies.append(f.read())
+
+        def with_suds():
+            for reply in replies:
+                soap.succeeded(method.binding.input, reply)
+
+        def with_projection():
+            for reply in replies:
+                projection.parse(reply)
+
+        results['%s/suds' % name] = measure(with_suds) * len(replies)
+        results['%s/fedex_xml' % name] = measure(with_projection) * len(replies)
+    return results
+
+if __name__ == '__main__':
+    results = run()
+    for name, wsdl, operation, projection in REPLIES:
+        suds_rate, fast_rate = results['%s/suds' % name], results['%s/fedex_xml' % name]
+        print '%-22s suds %8.1f replies/sec   fedex_xml %8.1f replies/sec  (%.1fx)' % (name, suds_rate, fast_rate, fast_rate / suds_rate)
@@ -0,0 +1,52 @@
+# Request-side cost of Fedex.rate and Fedex.label: the suds factory and
+# marshaller against the fedex_xml templates. Nothing is sent; the transport
+# stops each call at the point it would go on the wire.
+#
+#   python -m benchmarks.fedex_requests
+from suds.transport import Transport
+
+from benchmarks import measure
+from shipping import Address
+import fedex
+
+class Sent(Exception):
+    pass
+
+class StopTransport(Transport):
+    def send(self, request):
+        raise Sent()
+
+    def __deepcopy__(self, memo):
+        return StopTransport()
+
+CREDENTIALS = { 'key': 'key', 'password': 'password', 'account_number': '510087020', 'meter_number': '118511895' }
+SHIPPER = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='4085366000', email='shipping@example.com', is_residence=False)
+RECIPIENT = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US', phone='4089961010', email='receiving@example.com')
+
+def call(fn):
+    def run():
+        try:
+            fn()
+        except Sent:
+            pass
+    return run
+
+def run(package_counts=(1, 10, 50)):
+    results = dict()
+    for fast in (False, True):
+        api = fedex.Fedex(CREDENTIALS, debug=False, transport=StopTransport(), fast_requests=fast)
+        serializer = 'fedex_xml' if fast else 'suds'
+        for count in package_counts:
+            packages = [ fedex.Package(20 * 16, 12, 12, 12, value=100, require_signature=(i % 2 == 0)) for i in range(count) ]
+            results['rate/%s/%d' % (serializer, count)] = measure(call(lambda: api.rate(packages, 'YOUR_PACKAGING', SHIPPER, RECIPIENT)))
+            results['label/%s/%d' % (serializer, count)] = measure(call(lambda: api.label(packages, 'YOUR_PACKAGING', 'FEDEX_GROUND', SHIPPER, RECIPIENT, email_alert=True)))
+    return results
+
+if __name__ == '__main__':
+    results = run()
+    for name in sorted(results):
+        operation, serializer, count = name.split('/')
+        line = '%-6s %-10s %3s packages %10.1f requests/sec' % (operation, serializer, count, results[name])
+        if serializer == 'fedex_xml':
+            line += '  (%.1fx)' % (results[name] / results['%s/suds/%s' % (operation, count)])
+        print line
@@ -0,0 +1,80 @@
+# Cost of the shipping models at import scale: building Address, Package and
+# fedex.Package objects, the memory each one holds, and deduplicating
+# addresses the way UPS.validate does with its candidates.
+#
+#   python -m benchmarks.models [count]
+import gc
+import sys
+import subprocess
+
+from benchmarks import measure, peak_memory_kb
+from shipping import Address, Package
+import fedex
+
+ADDRESS_ARGS = ( 'Apple', '1 Infinite Loop', 'Cupertino', 'CA', '95014-2083', 'US' )
+ADDRESS_KWARGS = { 'address2': 'Bldg 4', 'phone': '(408) 996-1010', 'email': 'orders@example.com' }
+
+def addresses(count):
+    return [ Address('Order %d' % i, '%d Main St' % (i % 1000), 'San Jose', 'CA', 95110 + i % 50, 'US', phone='408-555-%04d' % (i % 10000)) for i in xrange(count) ]
+
+def object_size(obj):
+    """Bytes held by obj itself and its attribute dict, if it has one; attribute values aren't counted"""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+# Distinct field values, as in a real import
+IMPORTS = {
+    'Address': lambda i: Address('Order %d' % i, '%d Main St' % i, 'San Jose', 'CA', 95110, 'US'),
+    'Package': lambda i: Package(320 + i, 12, 12, 12, reference='R%d' % i),
+}
+
+def retained_kb(name, count):
+    """Peak memory growth while count objects are alive, in KB per thousand objects"""
+    gc.collect()
+    before = peak_memory_kb()
+    objects = [ IMPORTS[name](i) for i in xrange(count) ]
+    after = peak_memory_kb()
+    del objects
+    if before is None:
+        return None
+    return (after - before) * 1000.0 / count
+
+def import_kb(name, count):
+    # The peak only ever goes up, so each import is measured in a fresh interpreter
+    output = subprocess.check_output([ sys.executable, '-m', 'benchmarks.models', '--import', name, str(count) ])
+    return float(output) if output.strip() != 'None' else None
+
+def run(count=100000, min_time=0.5):
+    results = dict()
+    results['Address/construct'] = measure(lambda: Address(*ADDRESS_ARGS, **ADDRESS_KWARGS), min_time)
+    results['Package/construct'] = measure(lambda: Package(320, 12, 12, 12, value=100, reference='R1'), min_time)
+    results['fedex.Package/construct'] = measure(lambda: fedex.Package(320, 12, 12, 12, value=100), min_time)
+
+    results['Address/bytes'] = object_size(Address(*ADDRESS_ARGS, **ADDRESS_KWARGS))
+    results['Package/bytes'] = object_size(Package(320, 12, 12, 12))
+    results['fedex.Package/bytes'] = object_size(fedex.Package(320, 12, 12, 12))
+
+    for name in IMPORTS:
+        results['%s/import_kb_per_1000' % name] = import_kb(name, count)
+
+    candidates = addresses(200)
+    def dedup():
+        seen = set()
+        unique = list()
+        for a in candidates:
+            if a not in seen:
+                seen.add(a)
+                unique.append(a)
+    results['Address/dedup_200'] = measure(dedup, min_time)
+    return results
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == [ '--import' ]:
+        print retained_kb(sys.argv[2], int(sys.argv[3]))
+        sys.exit()
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    results = run(count)
+    for name in sorted(results):
+        print '%-32s %12.1f' % (name, results[name] or 0)
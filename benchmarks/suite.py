@@ -0,0 +1,221 @@
+# Offline benchmarks for every carrier code path, split by stage:
+#
+#   client     parsing a WSDL, and cloning an already parsed client
+#   build      filling in request objects (_create_shipment, add_packages, _get_xml, _GetBody)
+#   serialize  turning built requests into the bytes that would be sent
+#   parse      reading the sample replies in wsdl/<carrier>
+#   decode     base64-decoding label images
+#
+# Nothing goes over the network. Run it through python -m benchmarks.
+import os
+import re
+import glob
+import base64
+from urllib2 import quote
+import xml.etree.ElementTree as etree
+
+from suds.client import SoapClient
+from suds.cache import NoCache
+from suds.plugin import PluginContainer
+
+from shipping import Address, Package
+import clients
+import sinks
+import ups
+import fedex
+import fedex_xml
+import endicia
+import USPS
+
+WSDL_DIR = os.path.join(os.path.dirname(__file__), '..', 'wsdl')
+
+UPS_CREDENTIALS = { 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }
+FEDEX_CREDENTIALS = { 'key': 'key', 'password': 'password', 'account_number': '510087020', 'meter_number': '118511895' }
+ENDICIA_CREDENTIALS = { 'partner_id': 'p', 'account_id': '123456', 'passphrase': 'secret' }
+
+SHIPPER = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='4085366000', email='shipping@example.com')
+RECIPIENT = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US', phone='4089961010', email='receiving@example.com')
+
+PACKAGE_COUNTS = ( 1, 50 )
+
+def fixture(carrier, name):
+    with open(os.path.join(WSDL_DIR, carrier, name)) as f:
+        return f.read()
+
+def fixtures(carrier, pattern):
+    return [ fixture(carrier, os.path.basename(path)) for path in sorted(glob.glob(os.path.join(WSDL_DIR, carrier, pattern))) ]
+
+def packages(count):
+    return [ Package(20, 12, 12, 12, value=100, require_signature=(i % 2 == 0), reference='R%d' % i) for i in range(count) ]
+
+def fedex_packages(count):
+    return [ fedex.Package(20 * 16, 12, 12, 12, value=100, require_signature=(i % 2 == 0)) for i in range(count) ]
+
+def marshal(client, operation, args, kwargs):
+    """Everything suds does to a built request before handing it to the transport"""
+    method = getattr(client.service, operation).method
+    envelope = method.binding.input.get_message(method, args, kwargs)
+    PluginContainer(client.options.plugins).message.marshalled(envelope=envelope.root())
+    return envelope.plain().encode('utf-8')
+
+class Captured(Exception):
+    pass
+
+class CaptureService(object):
+    """Stands in for client.service and keeps the arguments of the first call"""
+    def __getattr__(self, operation):
+        def call(*args, **kwargs):
+            self.args, self.kwargs = args, kwargs
+            raise Captured()
+        return call
+
+def captured(client, build):
+    service, client.service = client.service, CaptureService()
+    try:
+        build()
+    except Captured:
+        pass
+    capture, client.service = client.service, service
+    return capture.args, capture.kwargs
+
+def replies(client, operation, texts):
+    method = getattr(client.service, operation).method
+    soap = SoapClient(client, method)
+    def parse():
+        for text in texts:
+            soap.succeeded(method.binding.input, text)
+    return parse
+
+def projected(projection, texts):
+    def parse():
+        for text in texts:
+            projection.parse(text)
+    return parse
+
+def images(texts, pattern):
+    return [ m.group(1) for text in texts for m in re.finditer(pattern, text, re.S) ]
+
+def decoded(encoded):
+    def decode():
+        for text in encoded:
+            sinks.decode(text)
+    return decode
+
+def client_cases():
+    ups_api = ups.UPS(UPS_CREDENTIALS)
+    fedex_api = fedex.Fedex(FEDEX_CREDENTIALS)
+    endicia_api = endicia.Endicia(ENDICIA_CREDENTIALS)
+    wsdls = [
+        ( 'ups', ups_api.wsdlURL('RateWS.wsdl'), [ ups.FixRequestNamespacePlug() ] ),
+        ( 'fedex', fedex_api.create_client('RateService_v9.wsdl').wsdl.url, [] ),
+        ( 'endicia', endicia_api.wsdl_url, [] ),
+    ]
+    for carrier, url, plugins in wsdls:
+        # NoCache keeps suds' own on-disk cache out of it, so this is a real parse
+        yield 'client/%s/parse' % carrier, 1, lambda url=url, plugins=plugins: clients.ClientCache().get(url, plugins=plugins, cache=NoCache())
+    yield 'client/ups/clone', 1, lambda: ups_api._get_client('RateWS.wsdl')
+    yield 'client/fedex/clone', 1, lambda: fedex_api.create_client('RateService_v9.wsdl')
+    yield 'client/endicia/clone', 1, lambda: clients.cache.get(endicia_api.wsdl_url, endicia_api.location)
+
+def build_cases():
+    ups_api = ups.UPS(UPS_CREDENTIALS)
+    fedex_api = fedex.Fedex(FEDEX_CREDENTIALS)
+    ups_client = ups_api._get_client('RateWS.wsdl')
+    fedex_client = fedex_api.create_client('RateService_v9.wsdl')
+    for count in PACKAGE_COUNTS:
+        items = packages(count)
+        yield 'build/ups/_create_shipment/%d' % count, 1, lambda items=items: ups_api._create_shipment(ups_client, items, SHIPPER, RECIPIENT, ups.PACKAGES[0][0], namespace='ns2', create_reference_number=False)
+        fedex_items = fedex_packages(count)
+        yield 'build/fedex/add_packages/%d' % count, 1, lambda items=fedex_items: fedex_api.add_packages(fedex_client, fedex_client.factory.create('RequestedShipment'), None, 'YOUR_PACKAGING', items)
+        usps_packages = [ USPS.Package(SHIPPER, RECIPIENT, 5, 8, 12, 12, 12) for i in range(count) ]
+        yield 'build/usps/RateRequest._GetBody/%d' % count, 1, lambda usps_packages=usps_packages: USPS.RateRequest('user', usps_packages)._GetBody()
+    package = endicia.Package(endicia.Package.shipment_types[0], 20, endicia.Package.shapes[1], 12, 12, 12, description='Widgets', value=100)
+    request = endicia.LabelRequest('p', '123456', 'secret', package, SHIPPER, RECIPIENT)
+    yield 'build/endicia/LabelRequest._get_xml', 1, request._get_xml
+
+def serialize_cases():
+    ups_api = ups.UPS(UPS_CREDENTIALS)
+    fedex_api = fedex.Fedex(FEDEX_CREDENTIALS)
+    ups_client = ups_api._get_client('RateWS.wsdl')
+    fedex_client = fedex_api.create_client('RateService_v9.wsdl')
+    for count in PACKAGE_COUNTS:
+        items = packages(count)
+        request = ups_client.factory.create('ns0:RequestType')
+        request.RequestOption = 'Shop'
+        classification = ups_client.factory.create('ns2:CodeDescriptionType')
+        classification.Code = '00'
+        shipment = ups_api._create_shipment(ups_client, items, SHIPPER, RECIPIENT, ups.PACKAGES[0][0], namespace='ns2', create_reference_number=False)
+        kwargs = { 'CustomerClassification': classification, 'Shipment': shipment }
+        yield 'serialize/ups/rate/%d' % count, 1, lambda kwargs=kwargs: marshal(ups_client, 'ProcessRate', (request,), kwargs)
+
+        fedex_items = fedex_packages(count)
+        args, kwargs = captured(fedex_client, lambda: fedex_api._suds_rate(fedex_client, fedex_items, 'YOUR_PACKAGING', SHIPPER, RECIPIENT))
+        yield 'serialize/fedex/rate/%d' % count, 1, lambda args=args, kwargs=kwargs: marshal(fedex_client, 'getRates', args, kwargs)
+        # fedex_xml builds and serializes in one step
+        yield 'serialize/fedex_xml/rate/%d' % count, 1, lambda items=fedex_items: fedex_xml.rate_request(FEDEX_CREDENTIALS, items, 'YOUR_PACKAGING', SHIPPER, RECIPIENT, fedex_api._normalized_country_code)
+
+        root = USPS.RateRequest('user', [ USPS.Package(SHIPPER, RECIPIENT, 5, 8, 12, 12, 12) for i in range(count) ])._GetBody()
+        yield 'serialize/usps/rate/%d' % count, 1, lambda root=root: quote(etree.tostring(root))
+    package = endicia.Package(endicia.Package.shipment_types[0], 20, endicia.Package.shapes[1], 12, 12, 12, description='Widgets', value=100)
+    root = endicia.LabelRequest('p', '123456', 'secret', package, SHIPPER, RECIPIENT)._get_xml()
+    yield 'serialize/endicia/label', 1, lambda: quote(etree.tostring(root))
+
+def parse_cases():
+    ups_api = ups.UPS(UPS_CREDENTIALS)
+    fedex_api = fedex.Fedex(FEDEX_CREDENTIALS)
+
+    for name, wsdl, operation, projection in ( ( 'RateResponse', 'RateWS.wsdl', 'ProcessRate', ups.RATE_REPLY ),
+            ( 'ShipmentResponse', 'Ship.wsdl', 'ProcessShipment', ups.SHIP_REPLY ), ( 'XAVResponse', 'XAV.wsdl', 'ProcessXAV', ups.XAV_REPLY ) ):
+        texts = fixtures('ups', '%s_*.txt' % name)
+        yield 'parse/ups/%s/suds' % name, len(texts), replies(ups_api._get_client(wsdl), operation, texts)
+        yield 'parse/ups/%s/projection' % name, len(texts), projected(projection, texts)
+
+    for name, wsdl, operation, projection in ( ( 'RateReply', 'RateService_v9.wsdl', 'getRates', fedex_xml.RATE_REPLY ),
+            ( 'ProcessShipmentReply', 'ShipService_v9.wsdl', 'processShipment', fedex_xml.SHIP_REPLY ) ):
+        texts = fixtures('fedex', '%s_*.txt' % name)
+        yield 'parse/fedex/%s/suds' % name, len(texts), replies(fedex_api.create_client(wsdl), operation, texts)
+        yield 'parse/fedex/%s/projection' % name, len(texts), projected(projection, texts)
+
+    texts = fixtures('endicia', 'CalculatePostageRatesResponse_*.txt')
+    def endicia_rates():
+        for text in texts:
+            endicia._rate_reply(text)
+    yield 'parse/endicia/CalculatePostageRatesResponse', len(texts), endicia_rates
+    texts = fixtures('endicia', 'LabelRequestResponse_*.txt')
+    def endicia_labels():
+        for text in texts:
+            root = etree.fromstring(text)
+            endicia.LabelResponse(root, 'www.envmgr.com/LabelService')
+    yield 'parse/endicia/LabelRequestResponse', len(texts), endicia_labels
+
+    usps_packages = [ USPS.Package(SHIPPER, RECIPIENT, 5, 8, 12, 12, 12) for i in range(3) ]
+    texts = fixtures('usps', 'RateV2Response_*.txt')
+    def usps_rates():
+        for text in texts:
+            USPS.RateRequest('user', usps_packages)._ParseResponse(text)
+    yield 'parse/usps/RateV2Response', len(texts), usps_rates
+
+def decode_cases():
+    labels = [
+        ( 'ups', images(fixtures('ups', 'ShipmentResponse_*.txt'), r'<ship:GraphicImage>(.*?)</ship:GraphicImage>') ),
+        ( 'fedex', images(fixtures('fedex', 'ProcessShipmentReply_*.txt'), r'<v9:Image>(.*?)</v9:Image>') ),
+        ( 'endicia', images(fixtures('endicia', 'LabelRequestResponse_*.txt'), r'<(?:Base64LabelImage|Image PartNumber="\d+")>(.*?)</') ),
+    ]
+    for carrier, encoded in labels:
+        yield 'decode/%s/b64decode' % carrier, len(encoded), lambda encoded=encoded: [ base64.b64decode(text) for text in encoded ]
+        yield 'decode/%s/sinks' % carrier, len(encoded), decoded(encoded)
+
+STAGES = [
+    ( 'client', client_cases ),
+    ( 'build', build_cases ),
+    ( 'serialize', serialize_cases ),
+    ( 'parse', parse_cases ),
+    ( 'decode', decode_cases ),
+]
+
+def cases(stages=None):
+    """Yields (name, operations per call, fn) for the named stages, or all of them"""
+    for stage, make in STAGES:
+        if stages is None or stage in stages:
+            for case in make():
+                yield case
@@ -0,0 +1,51 @@
+# Reply-side cost of UPS.rate, UPS.label and UPS.validate: suds unmarshalling
+# the whole reply against reading only the fields the library uses with a
+# projection, over the sample replies in wsdl/ups. Both sides include building
+# the response dicts.
+#
+#   python -m benchmarks.ups_replies
+import os
+import glob
+
+from suds.client import SoapClient
+
+from benchmarks import measure
+import ups
+
+UPS_DIR = os.path.join(os.path.dirname(__file__), '..', 'wsdl', 'ups')
+
+REPLIES = [
+    ( 'RateResponse', 'RateWS.wsdl', 'ProcessRate', ups.RATE_REPLY, lambda api, reply: api._rate_response(reply) ),
+    ( 'ShipmentResponse', 'Ship.wsdl', 'ProcessShipment', ups.SHIP_REPLY, lambda api, reply: api._label_response(reply, 'GIF', None) ),
+    ( 'XAVResponse', 'XAV.wsdl', 'ProcessXAV', ups.XAV_REPLY, lambda api, reply: api._validate_response(reply) ),
+]
+
+def run():
+    api = ups.UPS({ 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' })
+    results = dict()
+    for name, wsdl, operation, projection, read in REPLIES:
+        with api._client(wsdl) as client:
+            method = getattr(client.service, operation).method
+            soap = SoapClient(client, method)
+            replies = []
+            for path in sorted(glob.glob(os.path.join(UPS_DIR, '%s_*.txt' % name))):
+                with open(path) as f:
+                    replies.append(f.read())
+
+            def with_suds():
+                for reply in replies:
+                    read(api, soap.succeeded(method.binding.input, reply))
+
+            def with_projection():
+                for reply in replies:
+                    read(api, projection.parse(reply))
+
+            results['%s/suds' % name] = measure(with_suds) * len(replies)
+            results['%s/projection' % name] = measure(with_projection) * len(replies)
+    return results
+
+if __name__ == '__main__':
+    results = run()
+    for name, wsdl, operation, projection, read in REPLIES:
+        suds_rate, fast_rate = results['%s/suds' % name], results['%s/projection' % name]
+        print '%-18s suds %8.1f replies/sec   projection %8.1f replies/sec  (%.1fx)' % (name, suds_rate, fast_rate, fast_rate / suds_rate)
@@ -0,0 +1,101 @@
+# Marshal cost of UPS.rate and UPS.label for growing shipments, with the
+# namespace fix that walked the whole body twice against the one that only
+# renames the operation's Request element. Nothing is sent; the transport
+# stops each call at the point it would go on the wire.
+#
+#   python -m benchmarks.ups_requests
+from suds.transport import Transport
+from suds.plugin import MessagePlugin
+from suds.sax.parser import Parser
+
+from benchmarks import measure
+from shipping import Address, Package, Product
+import clients
+import ups
+
+class Sent(Exception):
+    pass
+
+class StopTransport(Transport):
+    def __init__(self, sent=None):
+        Transport.__init__(self)
+        self.sent = [] if sent is None else sent
+
+    def send(self, request):
+        self.sent.append(request.message)
+        raise Sent()
+
+    def __deepcopy__(self, memo):
+        return StopTransport(self.sent)
+
+def recurse_element(element, search, replace):
+    if search == element.qname():
+        element.rename(replace)
+    if element.isempty != True:
+        for x in element.getChildren():
+            recurse_element(x, search, replace)
+
+class TreeWalkPlug(MessagePlugin):
+    """The namespace fix UPS requests used to go through"""
+    def marshalled(self, context):
+        element = context.envelope.getChild('Body')
+        recurse_element(element, 'ns1:Request', 'ns0:Request')
+        recurse_element(element, 'ns2:Request', 'ns1:Request')
+        return context
+
+CREDENTIALS = { 'username': 'username', 'password': 'password', 'access_license': 'license', 'shipper_number': '123456' }
+SHIPPER = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='4085366000', email='shipping@example.com')
+RECIPIENT = Address('Someone', '1 Rue de Rivoli', 'Paris', '', '75001', 'FR', phone='0140205050', email='someone@example.com')
+
+class Context(object):
+    def __init__(self, envelope):
+        self.envelope = envelope
+
+def call(fn):
+    def run():
+        try:
+            fn()
+        except Sent:
+            pass
+    return run
+
+def run(package_counts=(1, 50, 500)):
+    results = dict()
+    envelopes = dict()
+    for plugin in (TreeWalkPlug, ups.FixRequestNamespacePlug):
+        clients.cache.clear()
+        clients.pools.clear()
+        original, ups.FixRequestNamespacePlug = ups.FixRequestNamespacePlug, plugin
+        try:
+            transport = StopTransport()
+            api = ups.UPS(CREDENTIALS, transport=transport)
+            for count in package_counts:
+                packages = [ Package(32, 10, 10, 10, value=10, reference='R%d' % i) for i in range(count) ]
+                customs = [ Product(value=5, quantity=1, description='Widget %d' % i, country='US') for i in range(count) ]
+                rate = call(lambda: api.rate(packages, ups.PACKAGES[0][0], SHIPPER, SHIPPER))
+                label = call(lambda: api.label(packages, SHIPPER, RECIPIENT, '65', ups.PACKAGES[0][0], False, create_commercial_invoice=True, customs_info=customs))
+                results['rate/%s/%d' % (plugin.__name__, count)] = measure(rate)
+                results['label/%s/%d' % (plugin.__name__, count)] = measure(label)
+                del transport.sent[:]
+                rate()
+                envelopes.setdefault(count, set()).add(transport.sent[-1])
+                # The namespace fix on its own, over an already marshalled label envelope
+                label()
+                envelope = Parser().parse(string=transport.sent[-1]).root()
+                results['fix/%s/%d' % (plugin.__name__, count)] = measure(lambda: plugin().marshalled(Context(envelope)))
+        finally:
+            ups.FixRequestNamespacePlug = original
+            clients.cache.clear()
+            clients.pools.clear()
+    # The invoice date and nothing else changes between runs, so rate envelopes must match exactly
+    assert all(len(sent) == 1 for sent in envelopes.values()), 'namespace fixes produced different envelopes'
+    return results
+
+if __name__ == '__main__':
+    results = run()
+    for name in sorted(results):
+        operation, plugin, count = name.split('/')
+        line = '%-6s %-24s %4s packages %10.2f calls/sec' % (operation, plugin, count, results[name])
+        if plugin == 'FixRequestNamespacePlug':
+            line += '  (%.2fx)' % (results[name] / results['%s/TreeWalkPlug/%s' % (operation, count)])
+        print line
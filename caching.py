@@ -0,0 +1,235 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import copy
+import time
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from shipping import Address, address_key, readdress, CONTACT_FIELDS
+from iso_country_codes import country_code
+
+class TTLCache(object):
+    """A thread-safe, size-bounded LRU cache whose entries expire after ttl seconds"""
+    def __init__(self, maxsize=10000, ttl=900):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            # Re-inserting moves the entry to the most recently used end
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return { 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries) }
+
+def _number(value):
+    try:
+        return round(float(value), 4)
+    except (TypeError, ValueError):
+        return value
+
+def canonical(value):
+    """Reduces rate request arguments to a hashable form: only where each address is, and every package by its key()"""
+    if isinstance(value, Address):
+        return ( value.zip.upper(), country_code(value.country).upper(), bool(value.is_residence) )
+    if isinstance(value, ( list, tuple )):
+        return tuple( canonical(v) for v in value )
+    if hasattr(value, 'key'):
+        # Packages, with numbers compared by value so 12, 12.0 and '12' match
+        return tuple( _number(v) for v in value.key() )
+    return value
+
+class RateCache(object):
+    """Caches rate responses per carrier, keyed on the canonical form of the request.
+
+    Keys are built from the arguments passed to rate() rather than from the
+    SOAP envelope, so request fields such as FedEx's ShipTimestamp don't make
+    identical requests miss. Carriers pass fetch() an account token naming the
+    account and endpoint they quote with, since negotiated rates differ between
+    accounts. ttls maps carrier names to seconds.
+    """
+    def __init__(self, maxsize=10000, ttls=None, default_ttl=900):
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self._cache = TTLCache(maxsize, default_ttl)
+        self._lock = threading.Lock()
+        self._carrier_stats = dict()
+
+    def key(self, carrier, account, *args, **kwargs):
+        return ( carrier, account, canonical(args), tuple(sorted( (k, canonical(v)) for k, v in kwargs.items() )) )
+
+    def fetch(self, carrier, rate, *args, **kwargs):
+        """Returns the cached response for these arguments, or calls rate(*args, **kwargs) and caches it.
+        The account keyword argument isn't passed to rate(), only kept in the key."""
+        account = kwargs.pop('account', None)
+        key = self.key(carrier, account, *args, **kwargs)
+        response = self._cache.get(key)
+        self._count(carrier, 'hits' if response is not None else 'misses')
+        if response is None:
+            response = rate(*args, **kwargs)
+            self._cache.put(key, response, self.ttls.get(carrier, self.default_ttl))
+        # Callers get their own copy so they can't change what's cached
+        return copy.deepcopy(response)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        with self._lock:
+            stats['carriers'] = copy.deepcopy(self._carrier_stats)
+        return stats
+
+    def _count(self, carrier, name):
+        with self._lock:
+            counts = self._carrier_stats.setdefault(carrier, { 'hits': 0, 'misses': 0 })
+            counts[name] += 1
+
+ADDRESS_FIELDS = ( 'name', 'address1', 'city', 'state', 'zip', 'country', 'address2', 'phone', 'email', 'is_residence', 'company_name' )
+
+def _dump_result(result):
+    data = dict(result)
+    data['candidates'] = [ dict( (name, getattr(a, name)) for name in ADDRESS_FIELDS ) for a in result.get('candidates', []) ]
+    return json.dumps(data)
+
+def _load_result(text):
+    result = json.loads(text)
+    candidates = list()
+    for fields in result.get('candidates', []):
+        address = Address(fields.pop('name'), fields.pop('address1'), fields.pop('city'), fields.pop('state'), fields.pop('zip'), fields.pop('country'))
+        for name, value in fields.items():
+            setattr(address, name, value)
+        candidates.append(address)
+    result['candidates'] = candidates
+    return result
+
+class AddressCache(object):
+    """Caches address validation results, keyed on shipping.address_key.
+
+    Candidates are kept without names or contact details, since the key leaves
+    them out; whatever comes back from the cache gets the requesting address's.
+    Results are kept in memory in a TTLCache. When path is given they are also
+    written to a sqlite database there, so they outlive the process; entries
+    found there are copied back into memory. The database is trimmed to
+    persistent_maxsize entries, dropping the ones closest to expiring.
+    """
+    def __init__(self, maxsize=10000, ttl=30 * 24 * 3600, path=None, persistent_maxsize=1000000):
+        self.ttl = ttl
+        self.path = path
+        self.persistent_maxsize = persistent_maxsize
+        self._memory = TTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._db = None
+        self._puts = 0
+        self.persistent_hits = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                self._db.execute('CREATE TABLE IF NOT EXISTS addresses (key TEXT PRIMARY KEY, expires REAL NOT NULL, result TEXT NOT NULL)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS addresses_expires ON addresses (expires)')
+            self._trim()
+
+    def key(self, address):
+        return u'|'.join(address_key(address))
+
+    def get(self, address):
+        key = self.key(address)
+        result = self._memory.get(key)
+        if result is None and self._db is not None:
+            now = time.time()
+            with self._lock:
+                row = self._db.execute('SELECT expires, result FROM addresses WHERE key = ?', ( key, )).fetchone()
+            if row is not None and row[0] > now:
+                result = _load_result(row[1])
+                self._memory.put(key, result, row[0] - now)
+                with self._lock:
+                    self.persistent_hits += 1
+        if result is None:
+            return None
+        # Callers get their own copy so they can't change what's cached
+        return readdress(copy.deepcopy(result), address)
+
+    def put(self, address, result):
+        key = self.key(address)
+        result = copy.deepcopy(result)
+        for candidate in result.get('candidates', []):
+            for name in CONTACT_FIELDS:
+                setattr(candidate, name, '')
+        self._memory.put(key, result)
+        if self._db is not None:
+            text = _dump_result(result)
+            with self._lock:
+                with self._db:
+                    self._db.execute('INSERT OR REPLACE INTO addresses VALUES (?, ?, ?)', ( key, time.time() + self.ttl, text ))
+                self._puts += 1
+                trim = self._puts % 100 == 0
+            if trim:
+                self._trim()
+
+    def fetch(self, validate, address):
+        """Returns the cached result for address, or calls validate(address) and caches it"""
+        result = self.get(address)
+        if result is None:
+            result = validate(address)
+            self.put(address, result)
+            readdress(result, address)
+        return result
+
+    def clear(self):
+        self._memory.clear()
+        if self._db is not None:
+            with self._lock:
+                with self._db:
+                    self._db.execute('DELETE FROM addresses')
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        stats = self._memory.stats()
+        with self._lock:
+            stats['persistent_hits'] = self.persistent_hits
+            if self._db is not None:
+                stats['persistent_size'] = self._db.execute('SELECT COUNT(*) FROM addresses').fetchone()[0]
+        return stats
+
+    def _trim(self):
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM addresses WHERE expires <= ?', ( time.time(), ))
+                self._db.execute('DELETE FROM addresses WHERE key IN (SELECT key FROM addresses ORDER BY expires DESC LIMIT -1 OFFSET ?)', ( self.persistent_maxsize, ))
@@ -0,0 +1,269 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import time
+import hashlib
+import threading
+import Queue
+import urllib
+import urlparse
+from collections import OrderedDict
+from contextlib import contextmanager
+from StringIO import StringIO
+from suds.client import Client
+from suds.cache import ObjectCache
+from suds.transport import Transport, Reply, TransportError
+from suds.transport.http import HttpTransport
+
+import connections
+import metrics
+import tracing
+
+# Bump whenever the layout of the on-disk cache changes
+CACHE_VERSION = 1
+
+class ClientPoolTimeout(Exception):
+    pass
+
+class ClientCache(object):
+    """Parses each WSDL once per process and hands out clones of the parsed client.
+
+    Cloning a suds client shares the parsed WSDL and schema objects but gives
+    every caller its own options, so callers may safely set headers or options
+    on the client they get back.
+
+    When cache_dir is set, the parsed WSDL objects of local WSDL files are also
+    pickled under cache_dir so new processes can skip parsing. Entries live in a
+    directory named after the hash of the WSDL and schema files, so editing any
+    of them invalidates the cache.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._clients = dict()
+        # One lock per key being parsed, so parsing one WSDL doesn't hold up callers of another
+        self._parsing = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, wsdl_url, location=None, **options):
+        """Returns a ready client for wsdl_url pointing at location.
+
+        Clients are keyed by WSDL, endpoint location and options (e.g. plugins),
+        with objects in the options told apart by their class.
+        """
+        key = ( wsdl_url, location, _options_key(options) )
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.hits += 1
+                return client.clone()
+            parsing = self._parsing.setdefault(key, threading.Lock())
+
+        with parsing:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is not None:
+                    # Another thread parsed it while this one waited
+                    self.hits += 1
+                    return client.clone()
+                self.misses += 1
+            logger.debug('Parsing WSDL %s', wsdl_url)
+            options.update(self._disk_cache_options(wsdl_url))
+            # Lets tracing.call() split each call into marshal, network and unmarshal spans, and records payload sizes
+            options['plugins'] = list(options.get('plugins', [])) + [ tracing.PhasePlugin(), metrics.PayloadPlugin() ]
+            client = Client(wsdl_url, **options)
+            if location:
+                client.set_options(location=location)
+            with self._lock:
+                self._clients[key] = client
+                self._parsing.pop(key, None)
+
+        return client.clone()
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return { 'hits': self.hits, 'misses': self.misses, 'size': len(self._clients) }
+
+    def _disk_cache_options(self, wsdl_url):
+        url = urlparse.urlparse(wsdl_url)
+        if not self.cache_dir or url.scheme != 'file':
+            return {}
+
+        location = os.path.join(self.cache_dir, 'v%d' % CACHE_VERSION, wsdl_digest(urllib.url2pathname(url.path)))
+        return { 'cache': ObjectCache(location, days=0), 'cachingpolicy': 1 }
+
+def _options_key(value):
+    # Plugins and caches are usually new objects on every call, so they're compared by class
+    if isinstance(value, dict):
+        return tuple(sorted( (name, _options_key(v)) for name, v in value.items() ))
+    if isinstance(value, ( list, tuple )):
+        return tuple( _options_key(v) for v in value )
+    if value is None or isinstance(value, ( basestring, bool, int, long, float )):
+        return value
+    return type(value)
+
+def wsdl_digest(wsdl_path):
+    """Hashes a WSDL file along with the schemas and WSDLs next to it that it may import"""
+    digest = hashlib.sha1()
+    wsdl_dir = os.path.dirname(wsdl_path)
+    names = [ n for n in os.listdir(wsdl_dir) if os.path.splitext(n)[1] in ( '.wsdl', '.xsd' ) ]
+    for name in [ os.path.basename(wsdl_path) ] + sorted(names):
+        digest.update(name)
+        with open(os.path.join(wsdl_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+class ClientPool(object):
+    """A bounded pool of prepared clients with checkout/checkin semantics.
+
+    factory is called to build a new client whenever the pool is empty and
+    fewer than maxsize clients exist; otherwise checkout waits up to timeout
+    seconds for another thread to check a client back in.
+    """
+    def __init__(self, factory, maxsize=8, timeout=30):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.checkouts = 0
+        self.waits = 0
+
+    def checkout(self):
+        try:
+            client = self._idle.get_nowait()
+        except Queue.Empty:
+            client = self._create()
+            if client is None:
+                client = self._wait()
+
+        with self._lock:
+            self.checkouts += 1
+        return client
+
+    def checkin(self, client):
+        self._idle.put(client)
+
+    @contextmanager
+    def client(self):
+        with tracing.span('client'):
+            client = self.checkout()
+        try:
+            yield client
+        finally:
+            self.checkin(client)
+
+    def stats(self):
+        with self._lock:
+            return { 'created': self.created, 'idle': self._idle.qsize(), 'checkouts': self.checkouts, 'waits': self.waits }
+
+    def _create(self):
+        with self._lock:
+            if self.created >= self.maxsize:
+                return None
+            self.created += 1
+
+        try:
+            return self.factory()
+        except:
+            with self._lock:
+                self.created -= 1
+            raise
+
+    def _wait(self):
+        with self._lock:
+            self.waits += 1
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except Queue.Empty:
+            raise ClientPoolTimeout('No client available after %s seconds' % self.timeout)
+
+class ClientPools(object):
+    """Keeps one ClientPool per key, e.g. (WSDL, location, credentials).
+
+    At most maxpools are kept; the least recently used one is dropped to make
+    room, and clients checked out of it stay usable until they're checked in.
+    """
+    def __init__(self, maxsize=8, timeout=30, maxpools=64):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.maxpools = maxpools
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        with self._lock:
+            pool = self._pools.pop(key, None)
+            if pool is None:
+                pool = ClientPool(factory, self.maxsize, self.timeout)
+            # Re-inserting moves the pool to the most recently used end
+            self._pools[key] = pool
+            while len(self._pools) > self.maxpools:
+                self._pools.popitem(last=False)
+        return pool
+
+    def __len__(self):
+        return len(self._pools)
+
+    def clear(self):
+        with self._lock:
+            self._pools.clear()
+
+class PooledTransport(Transport):
+    """A suds transport that sends SOAP requests over pooled keep-alive connections.
+
+    Uses connections.pools unless given its own ConnectionPools, e.g. one with
+    different limits or pointed at a local stand-in server. WSDL and schema
+    documents are still read with suds' urllib2 transport.
+    """
+    def __init__(self, pools=None):
+        Transport.__init__(self)
+        self.pools = pools
+
+    def open(self, request):
+        return HttpTransport().open(request)
+
+    def send(self, request):
+        pools = self.pools or connections.pools
+        status, reason, headers, body = pools.urlopen('POST', request.url, request.message, request.headers)
+        if status >= 300:
+            raise TransportError(reason, status, StringIO(body))
+        return Reply(status, headers.dict, body)
+
+    def stats(self):
+        return (self.pools or connections.pools).stats()
+
+    def __deepcopy__(self, memo=None):
+        # suds links a transport to a single client's options, so copies are
+        # new transports that share the same connection pools
+        return PooledTransport(self.pools)
+
+# Shared by every carrier in the process
+transport = PooledTransport()
+cache = ClientCache(os.environ.get('SHIPPING_WSDL_CACHE_DIR'))
+pools = ClientPools()
+
+def set_cache_dir(cache_dir):
+    """Sets where parsed WSDLs are stored on disk. None disables the on-disk cache."""
+    cache.cache_dir = cache_dir
+
+def warmup(*apis):
+    """Preloads the clients of the given carrier objects (e.g. UPS, Fedex instances).
+
+    Returns the seconds spent on each WSDL, keyed by carrier class name.
+    """
+    timings = dict()
+    start = time.time()
+    for api in apis:
+        timings[api.__class__.__name__] = api.warmup()
+    logger.info('Warmed up %d carriers in %.3fs', len(apis), time.time() - start)
+    return timings
@@ -0,0 +1,248 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+import errno
+import httplib
+import socket
+import threading
+import Queue
+import urlparse
+from StringIO import StringIO
+from contextlib import contextmanager
+from urllib2 import URLError, HTTPError
+
+class _Unsent(Exception):
+    """A reused connection turned out to be closed before the server saw the request"""
+    def __init__(self, error):
+        Exception.__init__(self, error)
+        self.error = error
+
+class NotSent(URLError):
+    """Connecting to the server failed, so the request never left and can safely be sent again"""
+
+_local = threading.local()
+
+@contextmanager
+def deadline(seconds):
+    """Requests this thread sends over pooled connections within the block give up
+    once seconds have passed, by capping their connect and read timeouts. Nested
+    deadlines keep the earlier one."""
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = time.time() + seconds
+    if previous is not None:
+        _local.deadline = min(_local.deadline, previous)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+def _capped(timeout):
+    # timeout, or less if this thread has a deadline sooner than that
+    at = getattr(_local, 'deadline', None)
+    if at is None:
+        return timeout
+    return max(min(timeout, at - time.time()), 0.001)
+
+def _expired():
+    at = getattr(_local, 'deadline', None)
+    return at is not None and at <= time.time()
+
+class ConnectionPool(object):
+    """Keeps up to maxsize idle keep-alive connections to a single host.
+
+    Threads that find the pool empty open a new connection instead of waiting;
+    connections beyond maxsize are closed when they are returned.
+    """
+    def __init__(self, scheme, host, port=None, maxsize=4, connect_timeout=10, read_timeout=60):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle = Queue.LifoQueue(maxsize)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.errors = 0
+
+    def urlopen(self, method, path, body=None, headers={}):
+        """Sends one request and returns (status, reason, headers, body)"""
+        if _expired():
+            self._count(errors=1)
+            raise NotSent(socket.timeout('Deadline passed before sending'))
+        conn = self._get_conn()
+        try:
+            result = self._send(conn, method, path, body, headers)
+        except _Unsent as e:
+            # The server closed the idle keep-alive connection, so send it once more on a new one
+            conn.close()
+            logger.debug('Retrying %s %s%s on a new connection after %r', method, self.host, path, e.error)
+            try:
+                result = self._send(conn, method, path, body, headers)
+            except (NotSent, socket.error, httplib.HTTPException):
+                conn.close()
+                self._count(errors=1)
+                raise
+        except NotSent:
+            self._count(errors=1)
+            raise
+        except (socket.error, httplib.HTTPException):
+            # Anything else may have reached the server, and sending it again could e.g. buy a label twice
+            conn.close()
+            self._count(errors=1)
+            raise
+
+        self._put_conn(conn)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': self.reused,
+                'errors': self.errors,
+                'idle': self._idle.qsize(),
+            }
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Queue.Empty:
+                break
+
+    def _send(self, conn, method, path, body, headers):
+        reused = conn.sock is not None
+        if reused:
+            self._count(requests=1, reused=1)
+        else:
+            conn.timeout = _capped(self.connect_timeout)
+            try:
+                conn.connect()
+            except socket.error as e:
+                conn.close()
+                raise NotSent(e)
+            self._count(requests=1, connections=1)
+
+        # Only a reused connection failing before the server could have read the request is _Unsent:
+        # the send failing, or the connection closing without a single byte of reply. Never a timeout.
+        try:
+            conn.sock.settimeout(_capped(self.read_timeout))
+            conn.request(method, path, body, headers)
+        except socket.error as e:
+            if reused and not isinstance(e, socket.timeout):
+                raise _Unsent(e)
+            raise
+        try:
+            response = conn.getresponse()
+        except httplib.BadStatusLine as e:
+            # Older httplibs give the empty line, newer ones say so
+            if reused and (e.line in ( '', "''" ) or e.line.startswith('No status line received')):
+                raise _Unsent(e)
+            raise
+        except socket.error as e:
+            if reused and not isinstance(e, socket.timeout) and e.errno in ( errno.ECONNRESET, errno.EPIPE ):
+                raise _Unsent(e)
+            raise
+        data = response.read()
+        if response.will_close:
+            conn.close()
+        return response.status, response.reason, response.msg, data
+
+    def _get_conn(self):
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            connection_class = httplib.HTTPSConnection if self.scheme == 'https' else httplib.HTTPConnection
+            return connection_class(self.host, self.port, timeout=self.connect_timeout)
+
+    def _put_conn(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except Queue.Full:
+            conn.close()
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+class ConnectionPools(object):
+    """Keeps one ConnectionPool per scheme, host and port"""
+    def __init__(self, maxsize=4, connect_timeout=10, read_timeout=60):
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._pools = dict()
+        self._lock = threading.Lock()
+
+    def get(self, scheme, host, port=None):
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(scheme, host, port, self.maxsize, self.connect_timeout, self.read_timeout)
+                self._pools[key] = pool
+        return pool
+
+    def urlopen(self, method, url, body=None, headers={}):
+        """Sends one request over a pooled connection and returns (status, reason, headers, body).
+
+        Raises urllib2.URLError when the server can't be reached, NotSent when
+        the request never left because connecting failed.
+        """
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        pool = self.get(parts.scheme, parts.hostname, parts.port)
+        try:
+            return pool.urlopen(method, path, body, headers)
+        except (socket.error, httplib.HTTPException) as e:
+            raise URLError(e)
+
+    def request(self, url, data=None, headers={}):
+        """Works like urllib2.urlopen(Request(url, data, headers)).read() over a pooled connection.
+
+        Raises urllib2.HTTPError for error statuses and urllib2.URLError when
+        the server can't be reached, so callers can keep their urllib2 handling.
+        """
+        headers = dict(headers)
+        method = 'GET'
+        if data is not None:
+            method = 'POST'
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+
+        status, reason, response_headers, body = self.urlopen(method, url, data, headers)
+        if status >= 400:
+            raise HTTPError(url, status, reason, response_headers, StringIO(body))
+        return body
+
+    def stats(self):
+        with self._lock:
+            pools = self._pools.items()
+        return dict( ('%s://%s%s' % (scheme, host, ':%s' % port if port else ''), pool.stats()) for (scheme, host, port), pool in pools )
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+def rebase(url, base_url):
+    """Swaps the scheme, host and port of url for base_url's, e.g. to send a carrier's requests to a stand-in server"""
+    if not base_url:
+        return url
+    base = urlparse.urlsplit(base_url)
+    parts = urlparse.urlsplit(url)
+    return urlparse.urlunsplit((base.scheme, base.netloc, parts.path, parts.query, parts.fragment))
+
+# Shared by every carrier in the process. Replace it to change pool size or timeouts.
+pools = ConnectionPools()
@@ -1,8 +1,13 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import os
+import copy
 import re
-from urllib2 import Request, urlopen, URLError, quote
+import time
+import urllib
+import urlparse
+from urllib2 import URLError, quote
 import base64
 import xml.etree.ElementTree as etree
 
@@ -10,24 +15,44 @@ import suds
 from suds.client import Client
 from suds.sax.element import Element
 
-from shipping import get_country_code
-
-def _normalize_country(country):
-    country_lookup = {
-        'united states': 'United States',
-        'us': 'United States',
-        'usa': 'United States',
-    }
-    
-    return country_lookup.get(country.lower(), country)
+from iso_country_codes import country_code
+import clients
+import connections
+import metrics
+import tracing
+
+LABEL_SERVICE_NS = 'www.envmgr.com/LabelService'
+
+def _rate_reply(text):
+    """Reads a CalculatePostageRates reply, skipping any elements it doesn't know"""
+    ns = '{%s}' % LABEL_SERVICE_NS
+    reply = etree.fromstring(text).find('.//%sPostageRatesResponse' % ns)
+    if reply is None:
+        raise EndiciaError('Unexpected CalculatePostageRates reply')
+    status = int(reply.findtext(ns + 'Status'))
+    if status != 0:
+        raise EndiciaError(reply.findtext(ns + 'ErrorMessage'), status)
+
+    response = { 'status': status, 'info': list() }
+    for details in reply.findall(ns + 'PostagePrice'):
+        response['info'].append({
+            'service': details.findtext('%sPostage/%sMailService' % (ns, ns)),
+            'package': details.findtext(ns + 'MailClass'),
+            'delivery_day': '',
+            'cost': float(details.get('TotalAmount')),
+        })
+    return response
 
 class EndiciaError(Exception):
-    pass
+    def __init__(self, message, code=None):
+        self.code = code
+        super(EndiciaError, self).__init__(message)
 
 class EndiciaWebError(EndiciaError):
     def __init__(self, fault, document):
         self.fault = fault
         self.document = document
+        self.code = fault.faultcode
         
         error_text = 'Endicia error {}: {}'.format(fault.faultcode, fault.faultstring)
         super(EndiciaWebError, self).__init__(error_text)
@@ -77,6 +102,24 @@ class Package(object):
         self.description = description
         self.value = str(value)
 
+    def key(self):
+        """Every field, in the order __init__ takes them. Equal packages have equal keys."""
+        return ( self.mail_class, self.weight_oz, self.shape, self.length, self.width, self.height, self.description, self.value )
+
+    def __eq__(self, other):
+        if not isinstance(other, Package):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __ne__(self, other):
+        if not isinstance(other, Package):
+            return NotImplemented
+        return self.key() != other.key()
+
+    def __hash__(self):
+        # Changing a field changes the hash, so don't change packages kept in sets or as dict keys
+        return hash(self.key())
+
     @property
     def weight_in_ozs(self):
         return self.weight_oz
@@ -110,13 +153,51 @@ class Package(object):
 
 
 class Endicia(object):
-    def __init__(self, credentials, debug=True):
-        self.wsdl_url = 'https://www.envmgr.com/LabelService/EwsLabelService.asmx?WSDL' if debug else 'https://LabelServer.Endicia.com/LabelService/EwsLabelService.asmx?WSDL'
+    def __init__(self, credentials, debug=True, transport=None, rate_cache=None, base_url=None):
+        this_dir = os.path.dirname(os.path.realpath(__file__))
+        wsdl_file_path = os.path.join(this_dir, 'wsdl', 'endicia', 'EwsLabelService.wsdl')
+        # Use os specific url to deal with windows drive letters
+        self.wsdl_url = urlparse.urljoin('file://', urllib.pathname2url(wsdl_file_path))
+        self.location = 'https://www.envmgr.com/LabelService/EwsLabelService.asmx' if debug else 'https://LabelServer.Endicia.com/LabelService/EwsLabelService.asmx'
+        # Sends every request to this server instead (e.g. a standin.StandinServer), keeping the Endicia paths
+        self.base_url = base_url
+        self.location = connections.rebase(self.location, base_url)
         self.credentials = credentials
         self.debug = debug
-        self.client = Client(self.wsdl_url)
+        self.transport = transport or clients.transport
+        self.rate_cache = rate_cache
+        self._client = None
+
+    @property
+    def client(self):
+        """The SOAP client is only needed for rate(), so it's built on first use"""
+        if self._client is None:
+            client = clients.cache.get(self.wsdl_url, self.location)
+            # Replies are read with ElementTree (see _rate_reply), so fields the bundled WSDL doesn't describe are ignored
+            client.set_options(transport=copy.deepcopy(self.transport), retxml=True)
+            self._client = client
+        return self._client
+
+    def warmup(self):
+        """Parses the bundled Endicia WSDL so the first rate() doesn't have to"""
+        start = time.time()
+        self.client
+        return { 'EwsLabelService.wsdl': time.time() - start }
 
     def rate(self, package, shipper, recipient, insurance='OFF', insurance_amount=0, delivery_confirmation=False, signature_confirmation=False):
+        args = (package, shipper, recipient, insurance, insurance_amount, delivery_confirmation, signature_confirmation)
+        # Only calls that reach Endicia are counted and timed, not cache hits
+        rate = metrics.measured('endicia', 'rate', self._rate)
+        with tracing.span('endicia.rate', carrier='endicia', operation='rate'):
+            if self.rate_cache is not None:
+                return self.rate_cache.fetch('endicia', rate, *args, account=self._rate_account())
+            return rate(*args)
+
+    def _rate_account(self):
+        # What a cached rate was quoted for: the account and the server, whose location also tells test from production
+        return ( self.credentials['partner_id'], self.credentials['account_id'], self.location )
+
+    def _rate(self, package, shipper, recipient, insurance='OFF', insurance_amount=0, delivery_confirmation=False, signature_confirmation=False):
         # Play nice with the other function signatures, which expect to take lists of packages.
         if not isinstance(package, Package):
 
@@ -126,99 +207,112 @@ class Endicia(object):
 
             package = package[0]
         
-        to_country_code = get_country_code(recipient.country)
+        with tracing.span('client'):
+            client = self.client
+
+        with tracing.span('build'):
+            to_country_code = country_code(recipient.country)
 
-        request = self.client.factory.create('PostageRatesRequest')
-        request.RequesterID = self.credentials['partner_id']
-        request.CertifiedIntermediary.AccountID = self.credentials['account_id']
-        request.CertifiedIntermediary.PassPhrase = self.credentials['passphrase']
+            request = client.factory.create('PostageRatesRequest')
+            request.RequesterID = self.credentials['partner_id']
+            request.CertifiedIntermediary.AccountID = self.credentials['account_id']
+            request.CertifiedIntermediary.PassPhrase = self.credentials['passphrase']
 
-        if package.shape:
-            request.MailpieceShape = package.shape
+            if package.shape:
+                request.MailpieceShape = package.shape
 
-        request.MailClass = 'Domestic' if to_country_code.upper() == 'US' else 'International'
-        request.WeightOz = package.weight_in_ozs
-        request.MailpieceDimensions.Length = package.length
-        request.MailpieceDimensions.Width = package.width
-        request.MailpieceDimensions.Height = package.height
+            request.MailClass = 'Domestic' if to_country_code.upper() == 'US' else 'International'
+            request.WeightOz = package.weight_in_ozs
+            request.MailpieceDimensions.Length = package.length
+            request.MailpieceDimensions.Width = package.width
+            request.MailpieceDimensions.Height = package.height
 
-        request.FromPostalCode = shipper.zip
-        request.ToPostalCode = recipient.zip
-        request.ToCountryCode = to_country_code
+            request.FromPostalCode = shipper.zip
+            request.ToPostalCode = recipient.zip
+            request.ToCountryCode = to_country_code
 
-        request.CODAmount = 0
-        request.InsuredValue = insurance_amount
-        request.RegisteredMailValue = package.value
+            request.CODAmount = 0
+            request.InsuredValue = insurance_amount
+            request.RegisteredMailValue = package.value
 
-        request.Services._InsuredMail = insurance
-        if delivery_confirmation:
-            request.Services._DeliveryConfirmation = 'ON'
-        if signature_confirmation:
-            request.Services._SignatureConfirmation = 'ON'
+            request.Services._InsuredMail = insurance
+            if delivery_confirmation:
+                request.Services._DeliveryConfirmation = 'ON'
+            if signature_confirmation:
+                request.Services._SignatureConfirmation = 'ON'
 
         try:
-            reply = self.client.service.CalculatePostageRates(request)
-            if reply.Status != 0:
-                raise EndiciaError(reply.ErrorMessage)
-            logger.debug(reply)
-
-            response = { 'status': reply.Status, 'info': list() }
-
-            for details in reply.PostagePrice:
-                response['info'].append({
-                    'service': details.Postage.MailService,
-                    'package': details.MailClass,
-                    'delivery_day': '',
-                    'cost': details._TotalAmount
-                })
-            return response
+            raw = tracing.call(client.service.CalculatePostageRates, request)
         except suds.WebFault as e:
             raise EndiciaWebError(e.fault, e.document)
+        logger.debug(raw)
+        with tracing.span('unmarshal', reader='etree'):
+            return _rate_reply(raw)
 
     def account_status(self, **kwargs):
         if "debug" not in kwargs:
             kwargs["debug"] = self.debug
 
-        return AccountStatusRequest(
+        request = AccountStatusRequest(
             self.credentials['partner_id'], self.credentials['account_id'], self.credentials['passphrase'], **kwargs
-        ).send()
+        )
+        request.base_url = self.base_url
+        return request.send()
 
     def label(self, package, shipper, recipient, **kwargs):
         if "debug" not in kwargs:
             kwargs["debug"] = self.debug
 
-        return LabelRequest(self.credentials['partner_id'],
+        request = LabelRequest(self.credentials['partner_id'],
             self.credentials['account_id'], self.credentials['passphrase'],
             package, shipper, recipient, **kwargs
-        ).send()
+        )
+        request.base_url = self.base_url
+        return request.send()
 
     def cancel(self, tracking_no, shipper, **kwargs):
         if "debug" not in kwargs:
             kwargs["debug"] = self.debug
 
-        return CarrierPickupCancelRequest(
+        request = CarrierPickupCancelRequest(
             self.credentials['account_id'], self.credentials['passphrase'],
             tracking_no, shipper, **kwargs
-        ).send()
+        )
+        request.base_url = self.base_url
+        return request.send()
 
 
 class EndiciaRequest(object):
+    # Set to send the request to another server (e.g. a standin.StandinServer) with the same paths
+    base_url = None
+
     def __init__(self, url, api, debug=False):
         self.debug = debug
         self.url = url
         self.api = api
         
     def send(self):
-        root = self._get_xml()
-        request_text = etree.tostring(root)
+        with metrics.request('endicia', self.url), tracing.span('endicia.%s' % self.url, carrier='endicia', operation=self.url):
+            return self._send()
+
+    def _send(self):
+        with tracing.span('marshal'):
+            root = self._get_xml()
+            request_text = etree.tostring(root)
 
         try:
             url_base = u'https://www.envmgr.com/LabelService/EwsLabelService.asmx' if self.debug else u'https://LabelServer.Endicia.com/LabelService/EwsLabelService.asmx'
-            full_url = u'%s/%s' % (url_base, self.url)
+            full_url = connections.rebase(u'%s/%s' % (url_base, self.url), self.base_url)
             data = '%s=%s' % (self.api, quote(request_text))
-            request = Request(full_url, data)
-            response_text = urlopen(request).read()
-            response = self.__parse_response(response_text)
+            metrics.payload('request', len(data))
+            with tracing.span('network', request_bytes=len(data)) as span:
+                response_text = connections.pools.request(full_url, data)
+                span.set(reply_bytes=len(response_text))
+            metrics.payload('reply', len(response_text))
+            with tracing.span('unmarshal'):
+                response = self.__parse_response(response_text)
+            if isinstance(response, Error):
+                metrics.error('EndiciaError', response.status)
         except URLError, e:
             if hasattr(e, 'reason'):
                 print 'Could not reach the server, reason: %s' % e.reason
@@ -370,7 +464,7 @@ class LabelRequest(EndiciaRequest):
                 etree.SubElement(customs_item, u'Value').text = item.value
 
                 if hasattr(item, "country_of_origin") and item.country_of_origin:
-                    etree.SubElement(customs_item, u'CountryOfOrigin').text = get_country_code(item.country_of_origin)
+                    etree.SubElement(customs_item, u'CountryOfOrigin').text = country_code(item.country_of_origin)
 
         # Customs signature
         if self.customs and self.customs.signature:
@@ -390,7 +484,7 @@ class LabelRequest(EndiciaRequest):
         info['City'] = address.city
         info['State'] = address.state
         info['PostalCode'] = address.zip
-        info['CountryCode'] = get_country_code(address.country.upper())
+        info['CountryCode'] = country_code(address.country.upper())
 
         if address.phone:
             info['Phone'] = re.sub(r'[^\d]+', '', address.phone) # Strip all non-digit characters.
@@ -416,12 +510,13 @@ class LabelResponse(object):
         self.postage_balance = root.findtext('{%s}PostageBalance' % namespace)
         encoded_image = root.findtext('{%s}Base64LabelImage' % namespace)
 
-        if encoded_image:
-            self.label = [base64.b64decode(encoded_image)]
-        else:
-            self.label = [
-                base64.b64decode(img.text) for img in root.find('{%s}Label' % namespace).findall('{%s}Image' % namespace)
-            ]
+        with tracing.span('decode'):
+            if encoded_image:
+                self.label = [base64.b64decode(encoded_image)]
+            else:
+                self.label = [
+                    base64.b64decode(img.text) for img in root.find('{%s}Label' % namespace).findall('{%s}Image' % namespace)
+                ]
 
         self.format = format
         
@@ -592,17 +687,24 @@ class RefundRequest(EndiciaRequest):
         self.passphrase = passphrase
         self.tracking_number = tracking_number
     
-    def send(self):
-        root = self._get_xml()
-        request_text = etree.tostring(root)
+    def _send(self):
+        with tracing.span('marshal'):
+            root = self._get_xml()
+            request_text = etree.tostring(root)
 
         try:
             url_base = u'https://www.envmgr.com/LabelService/EwsLabelService.asmx' if self.debug else u'https://LabelServer.Endicia.com/LabelService/EwsLabelService.asmx'
-            full_url = u'%s?method=RefundRequest' % url_base
+            full_url = connections.rebase(u'%s?method=RefundRequest' % url_base, self.base_url)
             data = 'XMLInput=%s' % quote(request_text)
-            request = Request(full_url, data)
-            response_text = urlopen(request).read()
-            response = self.__parse_response(response_text)
+            metrics.payload('request', len(data))
+            with tracing.span('network', request_bytes=len(data)) as span:
+                response_text = connections.pools.request(full_url, data)
+                span.set(reply_bytes=len(response_text))
+            metrics.payload('reply', len(response_text))
+            with tracing.span('unmarshal'):
+                response = self.__parse_response(response_text)
+            if isinstance(response, Error):
+                metrics.error('EndiciaError', response.status)
         except URLError, e:
             if hasattr(e, 'reason'):
                 print 'Could not reach the server, reason: %s' % e.reason
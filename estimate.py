@@ -0,0 +1,267 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import csv
+import math
+import mmap
+import bisect
+import struct
+import threading
+
+from iso_country_codes import country_code
+import metrics
+import tracing
+import zones as zone_tables
+import ups
+import fedex
+import endicia
+
+# Shipping cost estimates from tables on disk instead of a live carrier quote,
+# for when a quick answer matters more than an exact one (e.g. a cart page).
+# Each carrier has two files in the tables directory:
+#
+#   <carrier>.rates   the price of each service by weight break and zone, plus
+#                     the zone for each destination country
+#   <carrier>.zones   the zone from every origin ZIP3 to every destination ZIP3 (see zones)
+#
+# Both are memory-mapped read-only, so every worker process shares the one
+# copy in the page cache. write_rates() makes a rates file, and
+# compile_rates() makes one from a CSV price list.
+#
+# No tables ship with the package, since they come from each account's own
+# price lists and zone charts. Before estimating, fill TABLES_DIR (tables/
+# next to this file), or pass Estimator another directory, e.g.
+#
+#   estimate.compile_rates('ups_daily_rates.csv', os.path.join(estimate.TABLES_DIR, 'ups.rates'), 'ups', dim_divisor=139)
+#   zones.load_charts('ups_zone_charts/', os.path.join(estimate.TABLES_DIR, 'ups.zones'))
+#
+# Without a zones file only international shipments can be estimated.
+
+TABLES_DIR = zone_tables.TABLES_DIR
+
+ENDICIA_MAIL_SERVICES = {
+    'Priority': 'Priority Mail',
+    'Express': 'Express Mail',
+    'First': 'First-Class Mail',
+    'LibraryMail': 'Library Mail',
+    'MediaMail': 'Media Mail',
+    'ParcelPost': 'Parcel Post',
+    'ParcelSelect': 'Parcel Select',
+    'StandardMailClass': 'Standard Mail',
+    'ExpressMailInternational': 'Express Mail International',
+    'FirstClassMailInternational': 'First-Class Mail International',
+    'PriorityMailInternational': 'Priority Mail International',
+}
+
+# The services each carrier's tables can price, as (code, the name its rate replies use)
+SERVICES = {
+    'ups': list(ups.SERVICES),
+    'fedex': [ (s, s) for s in fedex.SERVICES ],
+    'endicia': [ (c, ENDICIA_MAIL_SERVICES[c]) for c in endicia.Package.shipment_types ],
+}
+
+RATES_MAGIC = 'SHIPRT01'
+# magic, services, zones, weight breaks, dimensional weight divisor, countries
+_RATES_HEADER = struct.Struct('<8sHHIHH')
+_COUNTRY = struct.Struct('<2sH')
+_PRICE = struct.Struct('<I')
+NOT_OFFERED = 0xffffffff
+
+class EstimateError(Exception):
+    pass
+
+def write_rates(path, carrier, prices, breaks, zones, countries=None, dim_divisor=0, names=None):
+    """Writes a rates file.
+
+    prices maps each service code to one row per weight break, each row a
+    price for every zone in zones (None where the service isn't offered).
+    breaks are the heaviest weight, in ounces, each row is for. countries maps
+    ISO codes to the zone international shipments there are priced at.
+    dim_divisor, if given, prices packages by dimensional weight (cubic
+    inches / dim_divisor pounds) where that's more than their weight.
+    """
+    known = dict(SERVICES[carrier])
+    names = dict(names or {})
+    for code in prices:
+        if code not in known:
+            raise ValueError('%s is not a %s service' % (code, carrier))
+    if list(breaks) != sorted(breaks):
+        raise ValueError('Weight breaks must be in ascending order')
+    countries = sorted((countries or {}).items())
+    services = [ code for code, name in SERVICES[carrier] if code in prices ]
+
+    text = u'\n'.join(u'%s\t%s' % (code, names.get(code, known[code])) for code in services).encode('utf-8')
+    parts = [ _RATES_HEADER.pack(RATES_MAGIC, len(services), len(zones), len(breaks), dim_divisor, len(countries)) ]
+    parts.append(struct.pack('<I', len(text)) + text)
+    parts.append(struct.pack('<%dH' % len(zones), *zones))
+    parts.append(struct.pack('<%dI' % len(breaks), *breaks))
+    parts.extend(_COUNTRY.pack(str(code), zone) for code, zone in countries)
+    for code in services:
+        rows = prices[code]
+        if len(rows) != len(breaks) or any(len(row) != len(zones) for row in rows):
+            raise ValueError('%s needs a price for every weight break and zone' % code)
+        cells = [ NOT_OFFERED if price is None else int(round(float(price) * 100)) for row in rows for price in row ]
+        parts.append(struct.pack('<%dI' % len(cells), *cells))
+    zone_tables._write(path, parts)
+
+def compile_rates(csv_path, path, carrier, countries=None, dim_divisor=0):
+    """Writes a rates file from a price list with a header row of service,ounces,<zone>,<zone>,...
+    and a row per service and weight break. Blank prices mean the service isn't offered there."""
+    with open(csv_path, 'rb') as f:
+        rows = list(csv.reader(f))
+    zones = [ int(zone) for zone in rows[0][2:] ]
+    breaks = sorted(set( int(row[1]) for row in rows[1:] ))
+    prices = dict()
+    for row in rows[1:]:
+        table = prices.setdefault(row[0], [ [ None ] * len(zones) for b in breaks ])
+        table[breaks.index(int(row[1]))] = [ price.strip() or None for price in row[2:] ]
+    write_rates(path, carrier, prices, breaks, zones, countries, dim_divisor)
+
+class RateTable(object):
+    """A memory-mapped rates file. Only the service names, zones, weight breaks and countries are read into memory."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(RATES_MAGIC)] != RATES_MAGIC:
+            self._map.close()
+            raise EstimateError('%s is not a rates file' % path)
+        magic, services, zones, breaks, self.dim_divisor, countries = _RATES_HEADER.unpack_from(self._map, 0)
+        offset = _RATES_HEADER.size
+        length, = struct.unpack_from('<I', self._map, offset)
+        offset += 4
+        self.services = [ tuple(line.split(u'\t', 1)) for line in self._map[offset:offset + length].decode('utf-8').split(u'\n') ] if services else []
+        offset += length
+        self.zones = dict( (zone, i) for i, zone in enumerate(struct.unpack_from('<%dH' % zones, self._map, offset)) )
+        offset += 2 * zones
+        self.breaks = list(struct.unpack_from('<%dI' % breaks, self._map, offset))
+        offset += 4 * breaks
+        self.countries = dict()
+        for i in range(countries):
+            code, zone = _COUNTRY.unpack_from(self._map, offset)
+            self.countries[code] = zone
+            offset += _COUNTRY.size
+        self._prices = offset
+        self._service_index = dict( (code, i) for i, (code, name) in enumerate(self.services) )
+
+    def price(self, service, zone, ounces):
+        """The price in cents of one package, or None if the service doesn't take it to that zone"""
+        b = bisect.bisect_left(self.breaks, ounces)
+        z = self.zones.get(zone)
+        if b == len(self.breaks) or z is None:
+            return None
+        cell = (self._service_index[service] * len(self.breaks) + b) * len(self.zones) + z
+        price, = _PRICE.unpack_from(self._map, self._prices + cell * _PRICE.size)
+        return None if price == NOT_OFFERED else price
+
+    def close(self):
+        self._map.close()
+
+def _ounces(package, dim_divisor):
+    # Endicia packages are weighed in ounces, the others in pounds
+    if hasattr(package, 'weight_oz'):
+        ounces = float(package.weight_oz)
+    else:
+        ounces = package.weight * 16.0
+    if dim_divisor:
+        try:
+            cubic_inches = float(package.length) * float(package.width) * float(package.height)
+        except (TypeError, ValueError):
+            cubic_inches = 0
+        ounces = max(ounces, math.ceil(cubic_inches / dim_divisor) * 16)
+    return int(math.ceil(ounces))
+
+class Estimator(object):
+    """Estimates shipping costs from the tables in directory, loading each carrier's the first time it's asked for.
+
+        estimate.shared.rate('ups', packages, shipper, recipient)
+
+    returns the same { 'status', 'info' } response as the carrier's rate(),
+    with 'estimate': True on it and on every quote.
+    """
+    def __init__(self, directory=TABLES_DIR):
+        self.directory = directory
+        self._tables = dict()
+        self._lock = threading.Lock()
+
+    def tables(self, carrier):
+        """(RateTable, zones.ZoneMatrix or None if the carrier has no zones file)"""
+        tables = self._tables.get(carrier)
+        if tables is None:
+            with self._lock:
+                tables = self._tables.get(carrier)
+                if tables is None:
+                    zones_path = os.path.join(self.directory, '%s.zones' % carrier)
+                    rates_path = os.path.join(self.directory, '%s.rates' % carrier)
+                    if not os.path.exists(rates_path):
+                        raise EstimateError('No %s rates table at %s; see estimate.py for making one with compile_rates() or write_rates()' % (carrier, rates_path))
+                    rates = RateTable(rates_path)
+                    zones = zone_tables.ZoneMatrix(zones_path) if os.path.exists(zones_path) else None
+                    tables = self._tables[carrier] = ( rates, zones )
+        return tables
+
+    def zone(self, carrier, shipper, recipient):
+        rates, zones = self.tables(carrier)
+        origin, destination = country_code(shipper.country).upper(), country_code(recipient.country).upper()
+        if origin == destination == 'US':
+            zone = zones.zone(shipper.zip, recipient.zip) if zones is not None else None
+        elif origin == 'US':
+            zone = rates.countries.get(destination)
+        else:
+            zone = None
+        if zone is None:
+            raise EstimateError('No %s zone from %s %s to %s %s' % (carrier, shipper.zip, origin, recipient.zip, destination))
+        return zone
+
+    def rate(self, carrier, packages, shipper, recipient, packaging_type=''):
+        if not isinstance(packages, (list, tuple)):
+            packages = [ packages ]
+        with metrics.request(carrier, 'estimate'), tracing.span('%s.estimate' % carrier, carrier=carrier, operation='estimate', packages=len(packages)):
+            rates, zones = self.tables(carrier)
+            zone = self.zone(carrier, shipper, recipient)
+            weights = [ _ounces(p, rates.dim_divisor) for p in packages ]
+
+            info = list()
+            for code, name in rates.services:
+                cost = 0
+                for ounces in weights:
+                    price = rates.price(code, zone, ounces)
+                    if price is None:
+                        break
+                    cost += price
+                else:
+                    info.append({
+                        'service': name,
+                        # Endicia replies put the mail class here
+                        'package': code if carrier == 'endicia' else packaging_type,
+                        'delivery_day': '',
+                        'cost': '%d.%02d' % divmod(cost, 100),
+                        'estimate': True,
+                    })
+            return { 'status': 'ESTIMATE', 'info': info, 'estimate': True }
+
+    def api(self, carrier):
+        """Something with the carrier API's rate() signature that estimates instead, e.g. for shop.rate_shop"""
+        return _CarrierEstimator(self, carrier)
+
+    def close(self):
+        with self._lock:
+            for rates, zones in self._tables.values():
+                rates.close()
+                if zones is not None:
+                    zones.close()
+            self._tables = dict()
+
+class _CarrierEstimator(object):
+    def __init__(self, estimator, carrier):
+        self.estimator = estimator
+        self.carrier = carrier
+
+    def rate(self, packages, *args):
+        # (packages, packaging_type, shipper, recipient) like UPS and Fedex, or (package, shipper, recipient) like Endicia
+        packaging_type = args[0] if len(args) > 2 else ''
+        shipper, recipient = args[-2:]
+        return self.estimator.rate(self.carrier, packages, shipper, recipient, packaging_type)
+
+# Shared by the whole process, reading the tables in TABLES_DIR
+shared = Estimator()
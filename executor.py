@@ -0,0 +1,145 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import sys
+import time
+import threading
+import Queue
+
+class TimeoutError(Exception):
+    pass
+
+class Future(object):
+    """The pending result of a call submitted to an Executor"""
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = list()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the call and returns its result, re-raising anything it raised"""
+        if not self._done.wait(timeout):
+            raise TimeoutError('Result not available after %s seconds' % timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError('Result not available after %s seconds' % timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, callback):
+        """Calls callback(future) once the call finishes, right away if it already has"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, list()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                logger.exception('Future callback failed')
+
+class Executor(object):
+    """Runs submitted calls on at most `workers` threads and hands back Futures.
+
+    Worker threads are started as work arrives and live for the rest of the
+    process, so the number of carrier requests in flight never exceeds workers.
+    """
+    def __init__(self, workers=16):
+        self.workers = workers
+        self._queue = Queue.Queue()
+        self._threads = list()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        with self._lock:
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return future
+
+    def map(self, fn, *iterables):
+        return [ self.submit(fn, *args) for args in zip(*iterables) ]
+
+    def _work(self):
+        while True:
+            future, fn, args, kwargs = self._queue.get()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException:
+                # Even SystemExit and KeyboardInterrupt end up on the future, so it finishes and the worker carries on
+                future.set_exc_info(sys.exc_info())
+
+def as_completed(futures, timeout=None):
+    """Yields futures as they finish. Raises TimeoutError if some haven't after timeout seconds."""
+    futures = list(futures)
+    finished = Queue.Queue()
+    pending = set(futures)
+    for future in pending:
+        future.add_done_callback(finished.put)
+
+    deadline = None if timeout is None else time.time() + timeout
+    while pending:
+        remaining = None if deadline is None else deadline - time.time()
+        try:
+            if remaining is not None and remaining <= 0:
+                raise Queue.Empty()
+            future = finished.get(timeout=remaining)
+        except Queue.Empty:
+            raise TimeoutError('%d of %d calls unfinished after %s seconds' % (len(pending), len(futures), timeout))
+        pending.discard(future)
+        yield future
+
+class AsyncCarrier(object):
+    """Wraps a carrier object so its operations return Futures instead of blocking.
+
+        ups_api = AsyncCarrier(UPS(credentials), executor)
+        futures = [ ups_api.rate(packages, packaging, shipper, r) for r in recipients ]
+        for future in as_completed(futures):
+            print future.result()
+
+    The results are the same structures the wrapped operations return. Works
+    with UPS, Fedex and Endicia objects and with USPS requests (Send).
+    """
+    operations = ( 'rate', 'validate', 'label', 'account_status', 'cancel', 'send', 'Send' )
+
+    def __init__(self, api, executor=None):
+        self.api = api
+        self.executor = executor or shared
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if name not in self.operations:
+            return attr
+
+        def submit(*args, **kwargs):
+            return self.executor.submit(attr, *args, **kwargs)
+        return submit
+
+# Shared by every caller that doesn't bring its own Executor
+shared = Executor(workers=32)
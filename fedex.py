@@ -2,8 +2,9 @@ import logging
 logger = logging.getLogger(__name__)
 
 import os
+import copy
+import time
 from datetime import datetime
-import binascii
 import suds
 from suds.client import Client
 from suds.sax.element import Element
@@ -11,6 +12,13 @@ import urllib
 import urlparse
 
 from shipping import Address
+from iso_country_codes import country_code
+import clients
+import connections
+import metrics
+import sinks
+import tracing
+import fedex_xml
 
 SERVICES = [
     'FEDEX_GROUND',
@@ -31,8 +39,17 @@ PACKAGES = [
     'YOUR_PACKAGING',
 ]
 
+LABEL_IMAGE_TYPE = 'PNG'
+
+WSDLS = [
+    'RateService_v9.wsdl',
+    'ShipService_v9.wsdl',
+]
+
 class FedexError(Exception):
-    pass
+    def __init__(self, message, code=None):
+        self.code = code
+        super(FedexError, self).__init__(message)
 
 class FedexWebError(FedexError):
     def __init__(self, fault, document):
@@ -40,24 +57,27 @@ class FedexWebError(FedexError):
         self.document = document
         
         fault = self.document.childAtPath('/Envelope/Body/Fault/detail/fault')
-        code = fault.childAtPath('/errorCode').getText()
+        self.code = fault.childAtPath('/errorCode').getText()
         reason = fault.childAtPath('/reason').getText()
         messages = fault.childrenAtPath('/details/ValidationFailureDetail/message')
         words = [ x.getText() for x in messages ]
         error_lines = '\n'.join(words)
         
-        error_text = 'FedEx error %s: %s Details:\n%s ' % (code, reason, error_lines)
+        error_text = 'FedEx error %s: %s Details:\n%s ' % (self.code, reason, error_lines)
         super(FedexError, self).__init__(error_text)
 
 class FedexShipError(FedexError):
     def __init__(self, reply):
         self.reply = reply
+        self.code = reply.Notifications[0].Code if reply.Notifications else None
         
         messages = [ 'FedEx error %s: %s' % (x.Code, x.LocalizedMessage if hasattr(x, 'LocalizedMessage') else x.Message) for x in reply.Notifications ]
         error_text = '\n'.join(messages)
         super(FedexError, self).__init__(error_text)
 
 class Package(object):
+    __slots__ = ( 'weight', 'length', 'width', 'height', 'value', 'require_signature', 'dry_ice_weight' )
+
     def __init__(self, weight_in_ozs, length, width, height, value=0, require_signature=False, dry_ice_weight_in_ozs=0.0):
         self.weight = weight_in_ozs / 16.0
         self.length = length
@@ -67,37 +87,77 @@ class Package(object):
         self.require_signature = require_signature
         self.dry_ice_weight = dry_ice_weight_in_ozs / 35.27397
 
+    def key(self):
+        """Every field, in __slots__ order. Equal packages have equal keys."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Package):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __ne__(self, other):
+        if not isinstance(other, Package):
+            return NotImplemented
+        return self.key() != other.key()
+
+    def __hash__(self):
+        # Changing a field changes the hash, so don't change packages kept in sets or as dict keys
+        return hash(self.key())
+
+    def __getstate__(self):
+        return self.key()
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
 class Fedex(object):
-    def __init__(self, credentials, debug=True):
+    def __init__(self, credentials, debug=True, transport=None, rate_cache=None, fast_requests=False, base_url=None):
         this_dir = os.path.dirname(os.path.realpath(__file__))
         self.wsdl_dir = os.path.join(this_dir, 'wsdl', 'fedex')
         self.credentials = credentials
         self.debug = debug
+        self.transport = transport or clients.transport
+        self.rate_cache = rate_cache
+        # Render rate and ship requests and read their replies with fedex_xml instead of suds
+        self.fast_requests = fast_requests
+        # Sends every request to this server instead (e.g. a standin.StandinServer)
+        self.base_url = base_url
 
     def _normalized_country_code(self, country):
-        country_lookup = {
-            'usa': 'US',
-            'united states': 'US',
-        }
-        return country_lookup.get(country.lower(), country)
+        return country_code(country)
     
     def create_client(self, wsdl_name):
         wsdl_file_path = os.path.join(self.wsdl_dir, wsdl_name)
         # Use os specific url to deal with windows drive letters "C://" makes 'C' look like a url type
         wsdl_file_url = urllib.pathname2url(wsdl_file_path)
         wsdl_url = urlparse.urljoin('file://', wsdl_file_url)
-        client = Client(wsdl_url)
         
         if self.debug:
             # For UPS, we have to do some fancy stuff to use the test environment
             # e.g. client.set_options(location='https://onlinetools.ups.com/webservices/Ship')
             # FedEx is nice and uses the test server automagically when you supply test
             # account information. Yay!
-            pass
+            location = None
         else:
-            client.set_options(location='https://gateway.fedex.com:443/web-services')
+            location = 'https://gateway.fedex.com:443/web-services'
+        if self.base_url:
+            location = connections.rebase('https://gateway.fedex.com:443/web-services', self.base_url)
         
+        # Parsing the WSDL is expensive, so every Fedex instance shares the parsed clients
+        client = clients.cache.get(wsdl_url, location)
+        client.set_options(transport=copy.deepcopy(self.transport))
         return client
+
+    def warmup(self):
+        """Parses every FedEx WSDL so the first rate or label doesn't have to"""
+        timings = dict()
+        for wsdl in WSDLS:
+            start = time.time()
+            self.create_client(wsdl)
+            timings[wsdl] = time.time() - start
+        return timings
     
     def get_auth(self, client):
         auth = client.factory.create('WebAuthenticationDetail')
@@ -174,28 +234,51 @@ class Fedex(object):
             shipment.TotalWeight.Value += p.weight
     
     def rate(self, packages, packaging_type, shipper, recipient):
-        client = self.create_client('RateService_v9.wsdl')
-        
-        auth, client_detail = self.get_auth(client)
-        client_detail.Region = 'US'
-        
-        trans = client.factory.create('TransactionDetail')
-        
-        version = client.factory.create('VersionId')
-        version.ServiceId = 'crs'
-        version.Major = '9'
-        version.Intermediate = '0'
-        version.Minor = '0'
-        
-        shipment = client.factory.create('RequestedShipment')
-        
-        self.add_shipper(shipment, shipper)
-        self.add_recipient(shipment, recipient)
-        service_type = None
-        self.add_packages(client, shipment, service_type, packaging_type, packages)
+        # Only calls that reach FedEx are counted and timed, not cache hits
+        rate = metrics.measured('fedex', 'rate', self._rate)
+        with tracing.span('fedex.rate', carrier='fedex', operation='rate', packages=len(packages)):
+            if self.rate_cache is not None:
+                return self.rate_cache.fetch('fedex', rate, packages, packaging_type, shipper, recipient, account=self._rate_account())
+            return rate(packages, packaging_type, shipper, recipient)
+
+    def _rate_account(self):
+        # What a cached rate was quoted for: the account, the credentials and the server
+        return ( self.credentials['account_number'], self.credentials['meter_number'], self.credentials['key'], self.debug, self.base_url )
+
+    def _suds_rate(self, client, packages, packaging_type, shipper, recipient):
+        with tracing.span('build'):
+            auth, client_detail = self.get_auth(client)
+            client_detail.Region = 'US'
+
+            trans = client.factory.create('TransactionDetail')
+
+            version = client.factory.create('VersionId')
+            version.ServiceId = 'crs'
+            version.Major = '9'
+            version.Intermediate = '0'
+            version.Minor = '0'
+
+            shipment = client.factory.create('RequestedShipment')
+
+            self.add_shipper(shipment, shipper)
+            self.add_recipient(shipment, recipient)
+            service_type = None
+            self.add_packages(client, shipment, service_type, packaging_type, packages)
+
+        return tracing.call(client.service.getRates, auth, client_detail, trans, version, ReturnTransitAndCommit=True, RequestedShipment=shipment)
+
+    def _rate(self, packages, packaging_type, shipper, recipient):
+        with tracing.span('client'):
+            client = self.create_client('RateService_v9.wsdl')
         
         try:
-            reply = client.service.getRates(auth, client_detail, trans, version, ReturnTransitAndCommit=True, RequestedShipment=shipment)
+            if self.fast_requests:
+                # fedex_xml builds and marshals in one step
+                with tracing.span('marshal'):
+                    envelope = fedex_xml.rate_request(self.credentials, packages, packaging_type, shipper, recipient, self._normalized_country_code, datetime.now())
+                reply = fedex_xml.send(client, 'getRates', envelope, fedex_xml.RATE_REPLY)
+            else:
+                reply = self._suds_rate(client, packages, packaging_type, shipper, recipient)
 
             if self.debug:
                 logger.info(reply)
@@ -206,7 +289,7 @@ class Fedex(object):
                 # Check to see if this is a 'Service not available error'
                 for notification in reply.Notifications:
                     if notification.Code == '556':
-                        raise FedexError(notification.Message)
+                        raise FedexError(notification.Message, notification.Code)
                 logger.info(reply)
                 
             response = { 'status': reply.HighestSeverity, 'info': list() }
@@ -228,60 +311,77 @@ class Fedex(object):
         except suds.WebFault as e:
             raise FedexWebError(e.fault, e.document)
 
-    def label(self, packages, packaging_type, service_type, shipper, recipient, email_alert=None, evening=False, payment=None, delivery_instructions=''):
-        client = self.create_client('ShipService_v9.wsdl')
-        
-        auth, client_detail = self.get_auth(client)
-        
-        trans = client.factory.create('TransactionDetail')
-        
-        version = client.factory.create('VersionId')
-        version.ServiceId = 'ship'
-        version.Major = '9'
-        version.Intermediate = '0'
-        version.Minor = '0'
-        
-        shipment = client.factory.create('RequestedShipment')
+    def _suds_label(self, client, packages, packaging_type, service_type, shipper, recipient, email_alert, evening, payment, delivery_instructions):
+        with tracing.span('build'):
+            auth, client_detail = self.get_auth(client)
 
-        shipment.CustomerSelectedActualRateType = 'PAYOR_ACCOUNT_SHIPMENT'
-        
-        if not payment:
-            payment = { 'type': 'SENDER', 'account': self.credentials['account_number'] }
-        shipment.ShippingChargesPayment.PaymentType = payment['type']
-        shipment.ShippingChargesPayment.Payor.AccountNumber = payment['account']
-        
-        self.add_shipper(shipment, shipper)
-        self.add_recipient(shipment, recipient)
-        
-        if email_alert:
-            shipment.SpecialServicesRequested.SpecialServiceTypes.append('EMAIL_NOTIFICATION')
-            shipment.SpecialServicesRequested.EMailNotificationDetail.AggregationType = 'PER_PACKAGE'
-            for type, email in [ ('SHIPPER', shipper.email), ('RECIPIENT', recipient.email) ]:
-                info = client.factory.create('EMailNotificationRecipient')
-                info.EMailNotificationRecipientType = type
-                info.EMailAddress = email
-                info.Format = 'HTML'
-                info.NotifyOnShipment = True
-                info.Localization.LanguageCode = 'EN'
-            
-                shipment.SpecialServicesRequested.EMailNotificationDetail.Recipients.append(info)
-        
-        if evening:
-            shipment.SpecialServicesRequested.SpecialServiceTypes.append('HOME_DELIVERY_PREMIUM')
-            shipment.SpecialServicesRequested.HomeDeliveryPremiumDetail.HomeDeliveryPremiumType = 'EVENING'
-        
-        shipment.DeliveryInstructions = delivery_instructions
-        
-        shipment.LabelSpecification.LabelFormatType = 'COMMON2D'
-        shipment.LabelSpecification.ImageType = 'PNG'
-        shipment.LabelSpecification.LabelStockType = 'PAPER_4X6'
-        shipment.LabelSpecification.LabelPrintingOrientation = 'BOTTOM_EDGE_OF_TEXT_FIRST'
-        shipment.ErrorLabelBehavior = 'STANDARD'
-        
-        self.add_packages(client, shipment, service_type, packaging_type, packages)
+            trans = client.factory.create('TransactionDetail')
+
+            version = client.factory.create('VersionId')
+            version.ServiceId = 'ship'
+            version.Major = '9'
+            version.Intermediate = '0'
+            version.Minor = '0'
+
+            shipment = client.factory.create('RequestedShipment')
+
+            shipment.CustomerSelectedActualRateType = 'PAYOR_ACCOUNT_SHIPMENT'
+
+            if not payment:
+                payment = { 'type': 'SENDER', 'account': self.credentials['account_number'] }
+            shipment.ShippingChargesPayment.PaymentType = payment['type']
+            shipment.ShippingChargesPayment.Payor.AccountNumber = payment['account']
+
+            self.add_shipper(shipment, shipper)
+            self.add_recipient(shipment, recipient)
+
+            if email_alert:
+                shipment.SpecialServicesRequested.SpecialServiceTypes.append('EMAIL_NOTIFICATION')
+                shipment.SpecialServicesRequested.EMailNotificationDetail.AggregationType = 'PER_PACKAGE'
+                for type, email in [ ('SHIPPER', shipper.email), ('RECIPIENT', recipient.email) ]:
+                    info = client.factory.create('EMailNotificationRecipient')
+                    info.EMailNotificationRecipientType = type
+                    info.EMailAddress = email
+                    info.Format = 'HTML'
+                    info.NotifyOnShipment = True
+                    info.Localization.LanguageCode = 'EN'
+
+                    shipment.SpecialServicesRequested.EMailNotificationDetail.Recipients.append(info)
+
+            if evening:
+                shipment.SpecialServicesRequested.SpecialServiceTypes.append('HOME_DELIVERY_PREMIUM')
+                shipment.SpecialServicesRequested.HomeDeliveryPremiumDetail.HomeDeliveryPremiumType = 'EVENING'
+
+            shipment.DeliveryInstructions = delivery_instructions
+
+            shipment.LabelSpecification.LabelFormatType = 'COMMON2D'
+            shipment.LabelSpecification.ImageType = LABEL_IMAGE_TYPE
+            shipment.LabelSpecification.LabelStockType = 'PAPER_4X6'
+            shipment.LabelSpecification.LabelPrintingOrientation = 'BOTTOM_EDGE_OF_TEXT_FIRST'
+            shipment.ErrorLabelBehavior = 'STANDARD'
+
+            self.add_packages(client, shipment, service_type, packaging_type, packages)
+
+        return tracing.call(client.service.processShipment, auth, client_detail, trans, version, shipment)
+
+    def label(self, packages, packaging_type, service_type, shipper, recipient, email_alert=None, evening=False, payment=None, delivery_instructions='', label_sink=None):
+        """label_sink, if given, receives the label images (see sinks.get_sink) and the response only references them"""
+        label_sink = sinks.get_sink(label_sink)
+        with metrics.request('fedex', 'label'), tracing.span('fedex.label', carrier='fedex', operation='label', packages=len(packages)):
+            return self._label(packages, packaging_type, service_type, shipper, recipient, email_alert, evening, payment, delivery_instructions, label_sink)
+
+    def _label(self, packages, packaging_type, service_type, shipper, recipient, email_alert, evening, payment, delivery_instructions, label_sink):
+        with tracing.span('client'):
+            client = self.create_client('ShipService_v9.wsdl')
         
         try:
-            self.reply = client.service.processShipment(auth, client_detail, trans, version, shipment)
+            if self.fast_requests:
+                with tracing.span('marshal'):
+                    envelope = fedex_xml.ship_request(self.credentials, packages, packaging_type, service_type, shipper, recipient, self._normalized_country_code,
+                        LABEL_IMAGE_TYPE, email_alert, evening, payment, delivery_instructions, datetime.now())
+                self.reply = fedex_xml.send(client, 'processShipment', envelope, fedex_xml.SHIP_REPLY)
+            else:
+                self.reply = self._suds_label(client, packages, packaging_type, service_type, shipper, recipient, email_alert, evening, payment, delivery_instructions)
             if self.debug:
                 logger.info(self.reply)
 
@@ -299,19 +399,27 @@ class Fedex(object):
                 }
             }
 
-            for i in range(len(packages)):
-                details = self.reply.CompletedShipmentDetail.CompletedPackageDetails[i]
-                cost = 0
-                try:
-                    cost = details.PackageRating.PackageRateDetails[0].NetCharge.Amount
-                except AttributeError as e:
-                    pass
-                info = {
-                    'tracking_number': details.TrackingIds[0].TrackingNumber,
-                    'cost': cost,
-                    'label': binascii.a2b_base64(details.Label.Parts[0].Image),
-                }
-                response['shipments'].append(info)
+            with tracing.span('decode', labels=len(packages)):
+                for i in range(len(packages)):
+                    details = self.reply.CompletedShipmentDetail.CompletedPackageDetails[i]
+                    cost = 0
+                    try:
+                        cost = details.PackageRating.PackageRateDetails[0].NetCharge.Amount
+                    except AttributeError as e:
+                        pass
+                    tracking_number = details.TrackingIds[0].TrackingNumber
+                    if label_sink:
+                        label = label_sink.write('label', tracking_number, LABEL_IMAGE_TYPE, details.Label.Parts[0].Image)
+                        # Drop the base64 text so self.reply doesn't keep every image alive either
+                        details.Label.Parts[0].Image = None
+                    else:
+                        label = sinks.decode(details.Label.Parts[0].Image)
+                    info = {
+                        'tracking_number': tracking_number,
+                        'cost': cost,
+                        'label': label,
+                    }
+                    response['shipments'].append(info)
             return response
             
         except suds.WebFault as e:
@@ -5,6 +5,8 @@
 #
 # Karagasidis Dimitris,
 # github.com/gatoni
+import re
+import unicodedata
 
 COUNTRY = {
 	"AF":"AFGHANISTAN",
@@ -252,13 +254,122 @@ COUNTRY = {
 	"EH":"WESTERN SAHARA",
 	"YE":"YEMEN",
 	"ZM":"ZAMBIA",
-	"ZW ":"ZIMBABWE"
+	"ZW":"ZIMBABWE"
 }
 
 CODE = dict(zip(COUNTRY.values(), COUNTRY.keys()))
 
+# Other names people write, beyond the official ones above
+ALIASES = {
+	"USA":"US",
+	"UNITED STATES OF AMERICA":"US",
+	"AMERICA":"US",
+	"UK":"GB",
+	"GREAT BRITAIN":"GB",
+	"BRITAIN":"GB",
+	"ENGLAND":"GB",
+	"SCOTLAND":"GB",
+	"WALES":"GB",
+	"NORTHERN IRELAND":"GB",
+	"UAE":"AE",
+	"SOUTH KOREA":"KR",
+	"NORTH KOREA":"KP",
+	"RUSSIA":"RU",
+	"VIETNAM":"VN",
+	"LAOS":"LA",
+	"SYRIA":"SY",
+	"TAIWAN":"TW",
+	"PALESTINE":"PS",
+	"VATICAN":"VA",
+	"VATICAN CITY":"VA",
+	"BURMA":"MM",
+	"BRUNEI":"BN",
+	"IVORY COAST":"CI",
+	"CZECHIA":"CZ",
+	"NORTH MACEDONIA":"MK",
+	"MACEDONIA":"MK",
+	"ESWATINI":"SZ",
+	"CABO VERDE":"CV",
+	"TURKIYE":"TR",
+	"HOLLAND":"NL",
+	"THE NETHERLANDS":"NL",
+	"DR CONGO":"CD",
+	"DRC":"CD",
+	"DEMOCRATIC REPUBLIC OF THE CONGO":"CD",
+	"REPUBLIC OF THE CONGO":"CG",
+}
+
+class CountryError(ValueError):
+    pass
+
+_DROPPED = re.compile(u"[.'\u2019]")
+_SEPARATORS = re.compile(u'[^A-Z0-9]+')
+
+def fold(country):
+    """Upper case without accents or punctuation, so u"C\xf4te d'Ivoire" and "COTE DIVOIRE" match"""
+    if isinstance(country, str):
+        country = country.decode('utf-8', 'replace')
+    text = unicodedata.normalize('NFKD', unicode(country))
+    text = u''.join(c for c in text if not unicodedata.combining(c)).upper()
+    return u' '.join(_SEPARATORS.sub(u' ', _DROPPED.sub(u'', text)).split())
+
+def _build_index():
+    index = dict()
+    def add(name, code):
+        for key in ( name, fold(name) ):
+            index.setdefault(key, code)
+
+    for code, name in COUNTRY.items():
+        add(code, code)
+        add(name, code)
+    for alias, code in ALIASES.items():
+        add(alias, code)
+
+    # "KOREA, REPUBLIC OF" is also "REPUBLIC OF KOREA", and "BOLIVIA, PLURINATIONAL
+    # STATE OF" just "BOLIVIA" where the part before the comma names only one country
+    short = dict()
+    for code, name in COUNTRY.items():
+        if ', ' in name:
+            first, rest = name.split(', ', 1)
+            add('%s %s' % (rest, first), code)
+            short.setdefault(first, set()).add(code)
+    for first, codes in short.items():
+        if len(codes) == 1 and fold(first) not in index:
+            add(first, codes.pop())
+    return index
+
+# Codes, names, aliases and their folded forms, each to its ISO code
+INDEX = _build_index()
+
+# What other spellings seen so far folded to, so each is only folded once
+_folded = dict()
+_FOLDED_MAXSIZE = 10000
+
+def country_code(country, strict=False):
+    """The ISO 3166-1 alpha-2 code for a code, name or common alias, e.g. 'usa' or u'C\xf4te d'Ivoire'.
+
+    Anything not recognised is returned as it was given, or raises CountryError if strict.
+    """
+    code = INDEX.get(country)
+    if code is None and country:
+        try:
+            code = _folded[country]
+        except KeyError:
+            code = INDEX.get(fold(country))
+            if len(_folded) < _FOLDED_MAXSIZE:
+                _folded[country] = code
+    if code is not None:
+        return code
+    if strict:
+        raise CountryError('Unknown country: %r' % (country, ))
+    return country or ''
+
 def lookup_country(code):
-    return COUNTRY.get(code.upper(), code)
+    return COUNTRY.get(country_code(code), code)
 
-def lookup_code(country):
-        return CODE.get(country.upper(), country[0:2].upper())
+def lookup_code(country, strict=False):
+    """Like country_code(), except that unless strict an unknown country is guessed to be its first two letters"""
+    code = country_code(country, strict)
+    if code in COUNTRY:
+        return code
+    return country[0:2].upper()
@@ -0,0 +1,278 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+import bisect
+import weakref
+import threading
+from suds.plugin import MessagePlugin
+
+# Counters and histograms for every carrier operation, shared by the whole
+# process and exported in the Prometheus text format with export():
+#
+#   shipping_requests_total     operations called, by carrier and operation
+#   shipping_errors_total       operations that failed, by error class and the carrier's error code
+#   shipping_request_seconds    how long operations took
+#   shipping_payload_bytes      request and reply sizes (direction="request" or "reply")
+
+LATENCY_BUCKETS = ( 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30 )
+PAYLOAD_BUCKETS = ( 1024, 4096, 16384, 65536, 262144, 1048576, 4194304 )
+
+class _Owner(object):
+    # Kept in a thread's local storage, so it goes away with the thread and takes the thread's cell with it
+    __slots__ = ( 'cell', '__weakref__' )
+
+class Series(object):
+    """The values of one metric for one set of label values.
+
+    Every thread adds to its own cell, so updates never wait on a lock and
+    never lose an increment to another thread; reading adds the cells up.
+    A finished thread's cell is folded into a base total, so short-lived
+    threads don't leave their cells behind.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._base = [ 0 ] * size
+        # weakref to each live thread's _Owner -> its cell
+        self._cells = dict()
+        self._lock = threading.Lock()
+
+    def _cell(self):
+        try:
+            return self._local.owner.cell
+        except AttributeError:
+            owner = self._local.owner = _Owner()
+            cell = owner.cell = [ 0 ] * self.size
+            with self._lock:
+                self._cells[weakref.ref(owner, self._fold)] = cell
+            return cell
+
+    def _fold(self, ref):
+        # Called once the thread that owned the cell has ended
+        with self._lock:
+            cell = self._cells.pop(ref, None)
+            if cell is not None:
+                for i, value in enumerate(cell):
+                    self._base[i] += value
+
+    def values(self):
+        with self._lock:
+            cells = self._cells.values()
+            totals = list(self._base)
+        for cell in cells:
+            for i, value in enumerate(cell):
+                totals[i] += value
+        return totals
+
+class CounterSeries(Series):
+    def __init__(self):
+        Series.__init__(self, 1)
+
+    def inc(self, amount=1):
+        self._cell()[0] += amount
+
+    def get(self):
+        return self.values()[0]
+
+class HistogramSeries(Series):
+    def __init__(self, buckets):
+        # One count per bucket and one for +Inf, then the sum and count of every value
+        Series.__init__(self, len(buckets) + 3)
+        self.buckets = buckets
+
+    def observe(self, value):
+        cell = self._cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def get(self):
+        """Returns (cumulative bucket counts, sum, count)"""
+        values = self.values()
+        cumulative = list()
+        total = 0
+        for count in values[:-2]:
+            total += count
+            cumulative.append(total)
+        return cumulative, values[-2], values[-1]
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The series for these label values, in the order the metric's labels were given"""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.label_names):
+                raise ValueError('%s has labels %s' % (self.name, ', '.join(self.label_names)))
+            with self._lock:
+                series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def clear(self):
+        with self._lock:
+            self._series = dict()
+
+    def export(self):
+        lines = [ '# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind) ]
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, s in series:
+            lines.extend(self._export_series(zip(self.label_names, values), s))
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return CounterSeries()
+
+    def _export_series(self, labels, series):
+        return [ '%s%s %s' % (self.name, _labels(labels), _number(series.get())) ]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return HistogramSeries(self.buckets)
+
+    def _export_series(self, labels, series):
+        cumulative, total, count = series.get()
+        lines = list()
+        for bound, bucket_count in zip(self.buckets + ( '+Inf', ), cumulative):
+            lines.append('%s_bucket%s %d' % (self.name, _labels(labels + [ ( 'le', _number(bound) ) ]), bucket_count))
+        lines.append('%s_sum%s %s' % (self.name, _labels(labels), _number(total)))
+        lines.append('%s_count%s %d' % (self.name, _labels(labels), count))
+        return lines
+
+def _number(value):
+    if isinstance(value, basestring):
+        return value
+    if isinstance(value, float) and value != int(value):
+        return repr(value)
+    return str(int(value))
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = list()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError('A metric named %s is already registered' % metric.name)
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def clear(self):
+        """Forgets every value recorded so far"""
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            metric.clear()
+
+    def export(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = list()
+        for metric in metrics:
+            lines.extend(metric.export())
+        return (u'\n'.join(lines) + u'\n').encode('utf-8')
+
+# Shared by every carrier in the process
+registry = Registry()
+
+REQUESTS = registry.counter('shipping_requests_total', 'Carrier operations called', ( 'carrier', 'operation' ))
+ERRORS = registry.counter('shipping_errors_total', 'Carrier operations that failed, by error and carrier error code', ( 'carrier', 'operation', 'error', 'code' ))
+LATENCY = registry.histogram('shipping_request_seconds', 'Time taken by carrier operations', ( 'carrier', 'operation' ), LATENCY_BUCKETS)
+PAYLOAD = registry.histogram('shipping_payload_bytes', 'Size of carrier requests and replies', ( 'carrier', 'operation', 'direction' ), PAYLOAD_BUCKETS)
+
+def export():
+    return registry.export()
+
+_local = threading.local()
+
+def error_code(error):
+    """The carrier's code for an error (UPSError.code, FedexError.code, HTTPError.code, ...), or ''"""
+    code = getattr(error, 'code', None)
+    return '' if code is None else unicode(code)
+
+class request(object):
+    """Counts and times one carrier operation, and the errors it raises.
+
+        with metrics.request('ups', 'rate'):
+            ...
+
+    Payload sizes and returned errors recorded inside it (see payload() and
+    error()) are labelled with its carrier and operation.
+    """
+    def __init__(self, carrier, operation):
+        self.operation = ( carrier, operation )
+
+    def __enter__(self):
+        self.outer = getattr(_local, 'operation', None)
+        _local.operation = self.operation
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        LATENCY.labels(*self.operation).observe(time.time() - self.start)
+        REQUESTS.labels(*self.operation).inc()
+        if exc_type is not None:
+            ERRORS.labels(self.operation[0], self.operation[1], exc_type.__name__, error_code(exc_value)).inc()
+        _local.operation = self.outer
+        return False
+
+def measured(carrier, operation, fn):
+    """fn wrapped in request(carrier, operation), e.g. for the call a cache only makes on a miss"""
+    def call(*args, **kwargs):
+        with request(carrier, operation):
+            return fn(*args, **kwargs)
+    return call
+
+def payload(direction, size):
+    """Records the size of a request or reply sent for the current operation"""
+    operation = getattr(_local, 'operation', None)
+    if operation is not None:
+        PAYLOAD.labels(operation[0], operation[1], direction).observe(size)
+
+def error(name, code):
+    """Records an error the current operation returns rather than raises, e.g. an Endicia Error response"""
+    operation = getattr(_local, 'operation', None)
+    if operation is not None:
+        ERRORS.labels(operation[0], operation[1], name, unicode(code)).inc()
+
+class PayloadPlugin(MessagePlugin):
+    """Records the size of every SOAP request and reply. clients.ClientCache adds it to every client."""
+    def sending(self, context):
+        payload('request', len(context.envelope))
+
+    def received(self, context):
+        payload('reply', len(context.reply))
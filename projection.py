@@ -0,0 +1,99 @@
+from xml.parsers import expat
+
+from sinks import Base64Decoder, Decoded
+
+class Node(object):
+    """Part of a projected reply; it reads the same way as the suds object it stands in for"""
+    def __repr__(self):
+        return '(%s)' % ', '.join('%s = %r' % item for item in sorted(vars(self).items()))
+
+class Projection(object):
+    """Reads only the listed fields of a reply, in one pass with expat.
+
+    fields are paths below the reply element, e.g. 'RateReplyDetails/ServiceType'.
+    Elements named in lists repeat, so (like suds) they're always lists. Fields
+    in floats are converted the way suds converts xs:decimal, and fields in
+    binary are base64-decoded as the parser reads them into a sinks.Decoded.
+    Everything else in the reply is skipped without building anything.
+    """
+    def __init__(self, fields, lists=(), floats=(), binary=()):
+        self.leaves = set( tuple(field.split('/')) for field in fields )
+        self.containers = set( leaf[:i] for leaf in self.leaves for i in range(1, len(leaf)) )
+        self.lists = set(lists)
+        self.floats = set( tuple(field.split('/')) for field in floats )
+        self.binary = set( tuple(field.split('/')) for field in binary )
+
+    def parse(self, xml):
+        return _ProjectionParser(self).parse(xml)
+
+class _ProjectionParser(object):
+    def __init__(self, projection):
+        self.projection = projection
+        self.root = Node()
+        self.names = []
+        self.nodes = { (): self.root }
+        self.text = None
+        self.decoder = None
+
+    def parse(self, xml):
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.characters
+        parser.Parse(xml, True)
+        return self.root
+
+    def _path(self):
+        # Envelope/Body/<reply element>/...
+        if len(self.names) < 3 or self.names[1] != 'Body':
+            return None
+        return tuple(self.names[3:])
+
+    def _add(self, path, value):
+        parent = self.nodes[path[:-1]]
+        name = path[-1]
+        if name in self.projection.lists:
+            if not hasattr(parent, name):
+                setattr(parent, name, list())
+            getattr(parent, name).append(value)
+        else:
+            setattr(parent, name, value)
+
+    def start(self, name, attributes):
+        self.names.append(name.rsplit(':', 1)[-1])
+        path = self._path()
+        if path is None:
+            return
+        if path in self.projection.containers:
+            node = Node()
+            self._add(path, node)
+            self.nodes[path] = node
+        elif path in self.projection.leaves:
+            if path in self.projection.binary:
+                self.decoder = Base64Decoder()
+            self.text = list()
+
+    def characters(self, data):
+        if self.text is None:
+            return
+        if self.decoder:
+            data = self.decoder.feed(data)
+            if data:
+                self.text.append(data)
+        else:
+            self.text.append(data)
+
+    def end(self, name):
+        path = self._path()
+        if self.text is not None and path in self.projection.leaves:
+            if self.decoder:
+                self.text.append(self.decoder.close())
+                value = Decoded(self.text)
+                self.decoder = None
+            else:
+                value = u''.join(self.text)
+                if path in self.projection.floats:
+                    value = float(value) if value else None
+            self._add(path, value)
+            self.text = None
+        self.names.pop()
@@ -1,4 +1,5 @@
 import re
+from iso_country_codes import country_code
 
 def debug_print_tree(elem):   
    import xml.etree.ElementTree as etree
@@ -18,6 +19,8 @@ def setLoggingLevel(level = logging.ERROR):
    logging.getLogger('suds.wsdl').setLevel(level)
 
 class Package(object):
+    __slots__ = ( 'weight', 'length', 'width', 'height', 'value', 'require_signature', 'reference' )
+
     def __init__(self, weight_in_ozs, length='', width='', height='', value=0, require_signature=False, reference=u''):
         self.weight = weight_in_ozs / 16
         self.length = length
@@ -26,7 +29,32 @@ class Package(object):
         self.value = value
         self.require_signature = require_signature
         self.reference = reference
-    
+
+    def key(self):
+        """Every field, in __slots__ order. Equal packages have equal keys."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Package):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __ne__(self, other):
+        if not isinstance(other, Package):
+            return NotImplemented
+        return self.key() != other.key()
+
+    def __hash__(self):
+        # Changing a field changes the hash, so don't change packages kept in sets or as dict keys
+        return hash(self.key())
+
+    def __getstate__(self):
+        return self.key()
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
     @property
     def weight_in_ozs(self):
         return self.weight * 16
@@ -41,7 +69,12 @@ class Product(object):
             setattr(self, key, value)
         
 
+_NOT_WORD = re.compile(r'[^\w]+')
+_NOT_DIGIT = re.compile(r'[^0-9]+')
+
 class Address(object):
+    __slots__ = ( 'company_name', 'name', 'address1', 'address2', 'city', 'state', 'zip', 'country', 'phone', 'email', 'is_residence' )
+
     def __init__(self, name, address, city, state, zip, country, address2='', phone='', email='', is_residence=True, company_name=''):
         self.company_name = company_name or ''
         self.name = name or ''
@@ -49,28 +82,70 @@ class Address(object):
         self.address2 = address2 or ''
         self.city = city or ''
         self.state = state or ''
-        self.zip = re.sub('[^\w]', '', unicode(zip).split('-')[0]) if zip else ''
+        self.zip = _NOT_WORD.sub('', unicode(zip).split('-')[0]) if zip else ''
         self.country = country or ''
-        self.phone = re.sub('[^0-9]*', '', unicode(phone)) if phone else ''
+        self.phone = _NOT_DIGIT.sub('', unicode(phone)) if phone else ''
         self.email = email or ''
         self.is_residence = is_residence or False
-    
+
+    def key(self):
+        """Every field, in __slots__ order. Equal addresses have equal keys; see address_key() for matching the same place written differently."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
     def __eq__(self, other):
-        return vars(self) == vars(other)
-    
+        if not isinstance(other, Address):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __ne__(self, other):
+        if not isinstance(other, Address):
+            return NotImplemented
+        return self.key() != other.key()
+
+    def __hash__(self):
+        # Changing a field changes the hash, so don't change addresses kept in sets or as dict keys
+        return hash(self.key())
+
+    def __getstate__(self):
+        return self.key()
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
     def __repr__(self):
         street = self.address1
         if self.address2:
             street += '\n' + self.address2
         return '%s\n%s\n%s, %s %s %s' % (self.name, street, self.city, self.state, self.zip, self.country)
 
+_PUNCTUATION = re.compile(u'[.,]')
+
+def _fold(text):
+    # Case-folded with periods and commas dropped and whitespace collapsed, so "123 Main St." matches "123 MAIN ST"
+    return u' '.join(_PUNCTUATION.sub(u'', unicode(text).lower()).split())
+
+def address_key(address):
+    """Where an address is, normalized so the same place written differently gets the same key.
+
+    Uses the street lines, city and state case-folded, the zip (5 digits for
+    the US) and the country code; names, phone and email are left out.
+    """
+    country = country_code(address.country).upper()
+    zip = address.zip.upper()
+    if country == 'US':
+        zip = zip[:5]
+    return ( _fold(address.address1), _fold(address.address2), _fold(address.city), _fold(address.state), zip, country )
+
+# Who an address is for rather than where it is, so address_key() leaves them out
+CONTACT_FIELDS = ( 'company_name', 'name', 'phone', 'email' )
+
+def readdress(result, address):
+    """Gives every candidate in an address validation result address's CONTACT_FIELDS, e.g. for a result validated for someone else at the same place"""
+    for candidate in result.get('candidates', []):
+        for name in CONTACT_FIELDS:
+            setattr(candidate, name, getattr(address, name))
+    return result
+
 def get_country_code(country):
-    lookup = {
-        'us': 'US',
-        'usa': 'US',
-        'united states': 'US',
-        'canada': 'CA',
-        'ca': 'CA'
-    }
-
-    return lookup.get(country.lower(), country)
\ No newline at end of file
+    return country_code(country)
\ No newline at end of file
@@ -0,0 +1,72 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+
+import connections
+from executor import as_completed, TimeoutError
+from executor import shared as shared_executor
+
+def _cost(info):
+    try:
+        return float(info['cost'])
+    except (TypeError, ValueError):
+        return float('inf')
+
+def _rate(api, args, deadline):
+    # Runs on an executor worker, which a slow carrier would otherwise keep busy long after rate_shop gave up on it
+    if deadline is None:
+        return api.rate(*args)
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise TimeoutError('Deadline passed before the call started')
+    with connections.deadline(remaining):
+        return api.rate(*args)
+
+def rate_shop(carriers, shipper, recipient, timeout=10, executor=None):
+    """Rates one shipment with several carriers at once.
+
+    carriers maps a name to (api, args), and api.rate(*args + (shipper, recipient))
+    is called for each, e.g.
+
+        rate_shop({
+            'ups': (ups_api, (packages, ups.PACKAGES[0][0])),
+            'fedex': (fedex_api, (fedex_packages, 'YOUR_PACKAGING')),
+            'endicia': (endicia_api, (endicia_package,)),
+        }, shipper, recipient, timeout=5)
+
+    Carriers that haven't answered within timeout seconds are reported in
+    'timed_out' and carriers that raised are reported in 'errors'. 'info' has
+    every answered quote, tagged with its carrier and sorted by cost. Requests
+    carriers send over pooled connections (see connections.deadline) are cut
+    off at the same deadline, so the executor's workers are freed with it.
+    """
+    executor = executor or shared_executor
+    deadline = None if timeout is None else time.time() + timeout
+    futures = dict()
+    for name, (api, args) in carriers.items():
+        futures[executor.submit(_rate, api, tuple(args) + (shipper, recipient), deadline)] = name
+
+    response = { 'status': 'SUCCESS', 'info': list(), 'errors': dict(), 'timed_out': list() }
+    pending = set(carriers)
+    try:
+        for future in as_completed(futures, timeout):
+            name = futures[future]
+            pending.discard(name)
+            error = future.exception()
+            if error is not None:
+                logger.info('%s rate failed: %s', name, error)
+                response['errors'][name] = error
+                continue
+            for info in future.result()['info']:
+                info = dict(info)
+                info['carrier'] = name
+                response['info'].append(info)
+    except TimeoutError:
+        pass
+
+    response['timed_out'] = sorted(pending)
+    response['info'].sort(key=_cost)
+    if response['errors'] or response['timed_out']:
+        response['status'] = 'PARTIAL' if response['info'] else 'FAILURE'
+    return response
@@ -0,0 +1,112 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import binascii
+
+CHUNK_SIZE = 64 * 1024
+
+class Base64Decoder(object):
+    """Decodes base64 text fed to it in pieces of any size"""
+    def __init__(self):
+        self.leftover = ''
+
+    def feed(self, text):
+        # Carriers sometimes wrap the base64 text, and only whole 4 character groups can be decoded
+        piece = self.leftover + ''.join(text.split())
+        cut = len(piece) - len(piece) % 4
+        self.leftover = piece[cut:]
+        return binascii.a2b_base64(piece[:cut]) if cut else ''
+
+    def close(self):
+        data = binascii.a2b_base64(self.leftover) if self.leftover else ''
+        self.leftover = ''
+        return data
+
+class Decoded(object):
+    """Image data a reply parser has already decoded, in the chunks it was decoded in"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+def decode_chunks(encoded, size=CHUNK_SIZE):
+    """Decodes base64 text a piece at a time so the whole image is never decoded in one string"""
+    if isinstance(encoded, Decoded):
+        for data in encoded.chunks:
+            yield data
+        return
+    decoder = Base64Decoder()
+    for start in xrange(0, len(encoded), size):
+        data = decoder.feed(encoded[start:start + size])
+        if data:
+            yield data
+    data = decoder.close()
+    if data:
+        yield data
+
+def decode(encoded):
+    return ''.join(decode_chunks(encoded))
+
+class LabelSink(object):
+    """Somewhere to put label images as a reply is read, instead of keeping them in the response.
+
+    label() calls write() once per image. kind is 'label' or 'international_document',
+    name is the tracking number (or the first one, for shipment-level documents)
+    and ext is the image format. encoded is the base64 text from the reply, or
+    a Decoded when the reply parser already decoded it. write() returns the reference that goes in the
+    response in place of the image; it always has the decoded size in 'bytes'.
+    """
+    def write(self, kind, name, ext, encoded):
+        raise NotImplementedError
+
+class PathSink(LabelSink):
+    """Writes each image to its own file, e.g. PathSink('/var/labels/{name}-{kind}.{ext}')"""
+    def __init__(self, template):
+        self.template = template
+
+    def write(self, kind, name, ext, encoded):
+        path = self.template.format(kind=kind, name=name, ext=ext.lower())
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        size = 0
+        with open(path, 'wb') as f:
+            for data in decode_chunks(encoded):
+                f.write(data)
+                size += len(data)
+        return { 'path': path, 'bytes': size }
+
+class FileSink(LabelSink):
+    """Appends every image to one open file and references each by offset"""
+    def __init__(self, f):
+        self.file = f
+        self.offset = f.tell() if hasattr(f, 'tell') else 0
+
+    def write(self, kind, name, ext, encoded):
+        start = self.offset
+        for data in decode_chunks(encoded):
+            self.file.write(data)
+            self.offset += len(data)
+        return { 'offset': start, 'bytes': self.offset - start }
+
+class CallbackSink(LabelSink):
+    """Calls callback(kind, name, ext, data) with each decoded image; a dict it returns is merged into the reference"""
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, kind, name, ext, encoded):
+        data = decode(encoded)
+        reference = { 'bytes': len(data) }
+        reference.update(self.callback(kind, name, ext, data) or {})
+        return reference
+
+def get_sink(sink):
+    """Accepts a LabelSink, a path template, an open file or a callback"""
+    if sink is None or isinstance(sink, LabelSink):
+        return sink
+    if isinstance(sink, basestring):
+        return PathSink(sink)
+    if hasattr(sink, 'write'):
+        return FileSink(sink)
+    if callable(sink):
+        return CallbackSink(sink)
+    raise TypeError('Unsupported label sink %r' % sink)
@@ -0,0 +1,236 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import re
+import time
+import random
+import socket
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import xml.etree.ElementTree as etree
+
+WSDL_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'wsdl')
+
+def _usps_rates(request, body):
+    """Answers a USPS rate request with the first package of the sample reply for every package asked about"""
+    query = urlparse.parse_qs(urlparse.urlsplit(request.path).query)
+    asked = etree.fromstring(query['XML'][0])
+    with open(os.path.join(WSDL_DIR, 'usps', 'RateV2Response_Domestic.txt')) as f:
+        sample = etree.fromstring(f.read()).find('Package')
+    root = etree.Element(asked.tag.replace('Request', 'Response'))
+    for package in asked.findall('Package'):
+        answer = etree.SubElement(root, 'Package')
+        answer.set('ID', package.get('ID'))
+        answer.extend(list(sample))
+    return '<?xml version="1.0"?>\n' + etree.tostring(root)
+
+# What each operation is answered with: a file under wsdl/, reply text, or
+# a function called with (request handler, request body) that returns the text
+REPLIES = {
+    'ups/Rate': 'ups/RateResponse_Shop.txt',
+    'ups/Ship': 'ups/ShipmentResponse_Domestic.txt',
+    'ups/XAV': 'ups/XAVResponse_Valid.txt',
+    'fedex/RateRequest': 'fedex/RateReply_Intra_MX_Exp_Saver.txt',
+    'fedex/ProcessShipmentRequest': 'fedex/ProcessShipmentReply_Smash_Basic.txt',
+    'endicia/CalculatePostageRates': 'endicia/CalculatePostageRatesResponse_Domestic.txt',
+    'endicia/GetPostageLabelXML': 'endicia/LabelRequestResponse_Domestic.txt',
+    'usps/RateV2': _usps_rates,
+    'usps/RateV3': _usps_rates,
+}
+
+def route(path, headers, body):
+    """Names the carrier operation a request is for, e.g. 'ups/Rate' or 'fedex/RateRequest'"""
+    parts = urlparse.urlsplit(path)
+    if parts.path.startswith('/webservices/'):
+        return 'ups/%s' % parts.path.rsplit('/', 1)[-1]
+    if 'ShippingAPI' in parts.path:
+        return 'usps/%s' % urlparse.parse_qs(parts.query).get('API', [''])[0]
+    if '.asmx/' in parts.path:
+        return 'endicia/%s' % parts.path.rsplit('/', 1)[-1]
+    if parts.path.endswith('.asmx'):
+        method = urlparse.parse_qs(parts.query).get('method')
+        if method:
+            return 'endicia/%s' % method[0]
+        return 'endicia/%s' % headers.get('SOAPAction', '').strip('"').rsplit('/', 1)[-1]
+    match = re.search(r'<(?:\w+:)?Body[^>]*>\s*<(?:\w+:)?(\w+)', body)
+    if match:
+        return 'fedex/%s' % match.group(1)
+    return None
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.standin._handle(self, '')
+
+    def do_POST(self):
+        self.standin._handle(self, self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+class _ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args):
+        BaseHTTPServer.HTTPServer.__init__(self, *args)
+        self.connections = set()
+
+    def process_request(self, request, client_address):
+        self.connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def close_connections(self, timeout=5):
+        # Kept-alive connections would otherwise hold their threads until the client hangs up
+        for request in list(self.connections):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        deadline = time.time() + timeout
+        while self.connections and time.time() < deadline:
+            time.sleep(0.01)
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-request are routine under load and when stopping
+        logger.debug('Error handling a request from %s', client_address, exc_info=True)
+
+class StandinServer(object):
+    """A local HTTP server that answers like the UPS, FedEx, Endicia and USPS endpoints.
+
+        with StandinServer(latency=(0.05, 0.2), error_rate=0.02, throttle=50) as server:
+            api = ups.UPS(credentials, base_url=server.url)
+            ...
+            print server.stats()
+
+    Point a carrier at it with base_url (UPS, Fedex and Endicia) or by setting
+    base_url on a USPSRequest. Each request is answered from replies (see
+    REPLIES) after latency seconds, or a random time in a (low, high) range.
+    A fraction error_rate of requests get error_status instead, and above
+    throttle requests per second the rest get 503 with a Retry-After header.
+    seed makes the random choices repeatable.
+    """
+    def __init__(self, host='127.0.0.1', port=0, replies=None, latency=0, error_rate=0, error_status=503, throttle=None, seed=None):
+        self.replies = dict(REPLIES)
+        self.replies.update(replies or {})
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.throttle = throttle
+        self.random = random.Random(seed)
+        self._texts = dict()
+        self._lock = threading.Lock()
+        self._tokens = throttle
+        self._refilled = time.time()
+        self.reset()
+
+        class Handler(_Handler):
+            standin = self
+        self.server = _ThreadingServer((host, port), Handler)
+        self.url = 'http://%s:%d' % self.server.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.close_connections()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.throttled = 0
+            self.in_flight = 0
+            self.peak_in_flight = 0
+            self.operations = dict()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'peak_in_flight': self.peak_in_flight,
+                'operations': dict(self.operations),
+            }
+
+    def _reply(self, operation, request, body):
+        reply = self.replies.get(operation)
+        if callable(reply):
+            return reply(request, body)
+        if reply is None or reply.lstrip().startswith('<'):
+            return reply
+        if reply not in self._texts:
+            with open(os.path.join(WSDL_DIR, reply)) as f:
+                self._texts[reply] = f.read()
+        return self._texts[reply]
+
+    def _allow(self):
+        # A token bucket holding a second's worth of requests
+        now = time.time()
+        self._tokens = min(self.throttle, self._tokens + (now - self._refilled) * self.throttle)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _handle(self, request, body):
+        operation = route(request.path, request.headers, body)
+        with self._lock:
+            self.requests += 1
+            self.operations[operation] = self.operations.get(operation, 0) + 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            allowed = self.throttle is None or self._allow()
+            failed = allowed and self.random.random() < self.error_rate
+            latency = self.random.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+            if not allowed:
+                self.throttled += 1
+            elif failed:
+                self.errors += 1
+
+        try:
+            if allowed and latency:
+                time.sleep(latency)
+            if not allowed:
+                self._send(request, 503, 'Slow down', { 'Retry-After': '1' })
+            elif failed:
+                self._send(request, self.error_status, '')
+            else:
+                reply = self._reply(operation, request, body)
+                if reply is None:
+                    self._send(request, 404, 'No reply for %s' % operation)
+                else:
+                    self._send(request, 200, reply)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _send(self, request, status, body, headers={}):
+        request.send_response(status)
+        request.send_header('Content-Type', 'text/xml; charset=utf-8' if status == 200 else 'text/plain')
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
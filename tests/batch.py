@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import threading
+import socket
+import errno
+import time
+from urllib2 import URLError
+import sys
+sys.path.append('../')
+
+from shipping import Address
+import batch
+import connections
+import standin
+import ups
+
+class FakeCarrier(object):
+    def __init__(self, failures=0, error=None, failure=None):
+        self.failures = failures
+        self.error = error
+        self.failure = failure or connections.NotSent(socket.error(errno.ECONNREFUSED, 'Connection refused'))
+        self.running = 0
+        self.most_running = 0
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def label(self, reference):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            fail = self.failures > 0
+            self.failures -= 1
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        if fail:
+            raise self.failure
+        if self.error:
+            raise self.error
+        return { 'status': 'SUCCESS', 'tracking': reference }
+
+    rate = label
+
+class TestLabelBatch(unittest.TestCase):
+    def test_concurrency_per_carrier(self):
+        ups, fedex = FakeCarrier(), FakeCarrier()
+        jobs = [ batch.Job('ups', ups, (i,), reference=i) for i in range(20) ] + [ batch.Job('fedex', fedex, (i,)) for i in range(10) ]
+        results = list(batch.LabelBatch(concurrency={ 'ups': 5, 'fedex': 2 }).run(iter(jobs)))
+        self.assertEqual(len(results), 30)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(sorted(r.response['tracking'] for r in results if r.job.carrier == 'ups'), range(20))
+        self.assertEqual(ups.most_running, 5)
+        self.assertEqual(fedex.most_running, 2)
+
+    def test_retries_transient_errors_only(self):
+        flaky, broken = FakeCarrier(failures=2), FakeCarrier(error=ValueError('bad address'))
+        progress = []
+        runner = batch.LabelBatch(retries=2, backoff=0, progress=progress.append)
+        results = dict( (r.job.carrier, r) for r in runner.run([ batch.Job('ups', flaky, (1,)), batch.Job('fedex', broken, (2,)) ]) )
+        self.assertTrue(results['ups'].ok)
+        self.assertEqual(results['ups'].attempts, 3)
+        self.assertEqual(str(results['fedex'].error), 'bad address')
+        self.assertEqual(broken.calls, 1)
+        stats = runner.stats()
+        self.assertEqual((stats['succeeded'], stats['failed'], stats['retried'], stats['pending']), (1, 1, 2, 0))
+        self.assertEqual(len(progress), 2)
+
+    def test_gives_up_after_retries(self):
+        down = FakeCarrier(failures=10)
+        result = list(batch.LabelBatch(retries=1, backoff=0).run([ batch.Job('endicia', down, (1,)) ]))[0]
+        self.assertFalse(result.ok)
+        self.assertEqual(result.attempts, 2)
+
+    def test_labels_retry_only_unsent_requests(self):
+        # A timed out label request may have bought the label, so it's only retried where that's safe
+        timeout = URLError(socket.timeout('timed out'))
+        label, rate = FakeCarrier(failures=1, failure=timeout), FakeCarrier(failures=1, failure=timeout)
+        results = list(batch.LabelBatch(backoff=0).run([ batch.Job('ups', label, (1,)), batch.Job('fedex', rate, (2,), operation='rate') ]))
+        results = dict( (r.job.carrier, r) for r in results )
+        self.assertTrue(results['ups'].error is timeout)
+        self.assertEqual(label.calls, 1)
+        self.assertTrue(results['fedex'].ok)
+        self.assertEqual(rate.calls, 2)
+
+        label = FakeCarrier(failures=1, failure=timeout)
+        result = list(batch.LabelBatch(backoff=0, retryable=( 'label', )).run([ batch.Job('ups', label, (1,)) ]))[0]
+        self.assertTrue(result.ok)
+        self.assertEqual(label.calls, 2)
+
+    def test_stops_when_the_caller_does(self):
+        carrier = FakeCarrier()
+        read = []
+        def jobs():
+            for i in range(1000):
+                read.append(i)
+                yield batch.Job('ups', carrier, (i,))
+        results = batch.LabelBatch(concurrency={ 'ups': 2 }).run(jobs())
+        next(results)
+        results.close()
+        time.sleep(0.3)
+        stopped = len(read), carrier.calls
+        time.sleep(0.2)
+        self.assertEqual(( len(read), carrier.calls ), stopped)
+        self.assertTrue(len(read) < 20)
+
+class FakeValidator(FakeCarrier):
+    def validate(self, address):
+        if address.zip == '00000':
+            self.error = ValueError('no such zip')
+        try:
+            return { 'valid': True, 'candidates': [ address ], 'zip': self.label(address.zip)['tracking'] }
+        finally:
+            self.error = None
+
+class TestValidateAddresses(unittest.TestCase):
+    def test_deduplicates(self):
+        validator = FakeValidator()
+        addresses = [ Address('Order %d' % i, '%d Main St' % (i % 5), 'San Jose', 'CA', 95110, 'US') for i in range(20) ]
+        addresses.append(Address('Order 20', '1 MAIN ST.', 'san jose', 'ca', '95110-1234', 'USA'))
+        results = batch.validate_addresses(validator, addresses, concurrency=3)
+        self.assertEqual(validator.calls, 5)
+        self.assertEqual(validator.most_running, 3)
+        self.assertEqual([ r.job.reference for r in results ], range(21))
+        self.assertTrue(all(r.job.args[0] is a for r, a in zip(results, addresses)))
+        self.assertEqual(results[20].response['zip'], results[1].response['zip'])
+        self.assertFalse(results[20].response is results[1].response)
+
+    def test_names_are_each_callers(self):
+        validator = FakeValidator()
+        addresses = [ Address('Alice', '1 Main St', 'San Jose', 'CA', 95110, 'US', phone='4085551212'),
+            Address('Bob', '1 MAIN ST', 'San Jose', 'CA', 95110, 'US', email='bob@example.com', company_name='Bob Co') ]
+        results = batch.validate_addresses(validator, addresses)
+        self.assertEqual(validator.calls, 1)
+        alice, bob = [ r.response['candidates'][0] for r in results ]
+        self.assertEqual(( alice.name, alice.phone, alice.email, alice.company_name ), ( 'Alice', '4085551212', '', '' ))
+        self.assertEqual(( bob.name, bob.phone, bob.email, bob.company_name ), ( 'Bob', '', 'bob@example.com', 'Bob Co' ))
+        self.assertEqual(bob.address1, alice.address1)
+
+    def test_partial_failures(self):
+        validator = FakeValidator(failures=1)
+        addresses = [ Address('', '1 Main St', 'Nowhere', 'CA', zip, 'US') for zip in ( '95110', '00000', '95014', '00000' ) ]
+        results = batch.validate_addresses(validator, addresses, concurrency=1, backoff=0)
+        self.assertEqual([ r.ok for r in results ], [ True, False, True, False ])
+        self.assertEqual(str(results[3].error), 'no such zip')
+        self.assertTrue(results[1].error is results[3].error)
+        self.assertEqual(sum(r.attempts for r in results if r.ok), 3)
+
+    def test_ups(self):
+        addresses = [ Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014 + i % 4, 'US') for i in range(12) ]
+        with standin.StandinServer(latency=0.05) as server:
+            api = ups.UPS({ 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }, base_url=server.url)
+            results = batch.validate_addresses(api, addresses, concurrency=2)
+            stats = server.stats()
+        self.assertTrue(all(r.ok and r.response['valid'] for r in results))
+        self.assertEqual(stats['operations'], { 'ups/XAV': 4 })
+        self.assertEqual(stats['peak_in_flight'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
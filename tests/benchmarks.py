@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import sys
+sys.path.append('../')
+
+from benchmarks import suite, models
+import benchmarks.__main__ as runner
+
+class TestSuite(unittest.TestCase):
+    def test_every_case_runs(self):
+        names = set()
+        for name, operations, fn in suite.cases():
+            fn()
+            self.assertTrue(operations > 0)
+            names.add(name.split('/')[0])
+        self.assertEqual(names, set( stage for stage, make in suite.STAGES ))
+
+    def test_samples_are_read(self):
+        # Every carrier has sample replies and images for the parse and decode stages
+        for carrier, pattern in ( ('ups', '*Response_*.txt'), ('fedex', '*Reply_*.txt'), ('endicia', '*Response_*.txt'), ('usps', '*Response_*.txt') ):
+            self.assertTrue(suite.fixtures(carrier, pattern), carrier)
+        names = [ name for name, operations, fn in suite.cases(['decode']) ]
+        self.assertEqual(len(names), 6)
+
+    def test_json_output(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'results.json')
+            runner.main([ '--stage', 'decode', '--match', 'ups', '--min-time', '0', '--output', path ])
+            with open(path) as f:
+                results = json.load(f)['results']
+            self.assertEqual(sorted(results), [ 'decode/ups/b64decode', 'decode/ups/sinks' ])
+            self.assertTrue(results['decode/ups/sinks']['ops_per_sec'] > 0)
+            self.assertTrue('peak_kb' in results['decode/ups/sinks'])
+
+            # A later run can be compared against it
+            runner.main([ '--stage', 'decode', '--match', 'ups/sinks', '--min-time', '0', '--compare', path ])
+        finally:
+            shutil.rmtree(directory)
+
+class TestModels(unittest.TestCase):
+    def test_run(self):
+        results = models.run(1000, min_time=0)
+        self.assertTrue(results['Address/construct'] > 0)
+        self.assertTrue(results['Address/dedup_200'] > 0)
+        # Slotted models have no attribute dict
+        self.assertTrue(results['Address/bytes'] < 200)
+        self.assertTrue('Package/import_kb_per_1000' in results)
+
+if __name__ == '__main__':
+    unittest.main()
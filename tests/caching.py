@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+sys.path.append('../')
+
+from shipping import Package, Address, address_key
+import caching
+import fedex
+import standin
+import ups
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = caching.TTLCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expiry(self):
+        cache = caching.TTLCache(ttl=0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+class TestRateCache(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US')
+        self.recipient = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'USA')
+
+    def _rate(self, packages, packaging_type, shipper, recipient):
+        self.calls += 1
+        return { 'status': 'SUCCESS', 'info': [ { 'service': 'FEDEX_GROUND', 'package': packaging_type, 'delivery_day': '', 'cost': 10.0 } ] }
+
+    def test_same_lane_hits(self):
+        cache = caching.RateCache(ttls={ 'fedex': 60 })
+        first = cache.fetch('fedex', self._rate, [ fedex.Package(16, 10, 10, 10) ], 'YOUR_PACKAGING', self.shipper, self.recipient)
+        first['info'][0]['cost'] = 0
+        other_names = Address('Someone', 'Elsewhere', 'Cupertino', 'CA', '95014-2083', 'United States')
+        second = cache.fetch('fedex', self._rate, [ fedex.Package(16, 10, 10, 10) ], 'YOUR_PACKAGING', self.shipper, other_names)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second['info'][0]['cost'], 10.0)
+        self.assertEqual(cache.stats()['carriers']['fedex'], { 'hits': 1, 'misses': 1 })
+
+    def test_different_packages_miss(self):
+        cache = caching.RateCache()
+        cache.fetch('ups', self._rate, [ Package(16, 10, 10, 10) ], '02', self.shipper, self.recipient)
+        cache.fetch('ups', self._rate, [ Package(32, 10, 10, 10) ], '02', self.shipper, self.recipient)
+        self.recipient.is_residence = False
+        cache.fetch('ups', self._rate, [ Package(32, 10, 10, 10) ], '02', self.shipper, self.recipient)
+        self.assertEqual(self.calls, 3)
+
+    def test_packages_by_key(self):
+        self.assertEqual(caching.canonical(fedex.Package(16, 10, 10, 10)), caching.canonical(fedex.Package(16, '10', 10.0, 10)))
+        self.assertNotEqual(caching.canonical(fedex.Package(16, 10, 10, 10)), caching.canonical(fedex.Package(16, 10, 10, 10, require_signature=True)))
+        self.assertEqual(caching.canonical(Package(16, 10, 10, 10, reference='R1')), tuple( caching._number(v) for v in Package(16, 10, 10, 10, reference='R1').key() ))
+
+    def test_accounts_do_not_share(self):
+        cache = caching.RateCache()
+        cache.fetch('ups', self._rate, [ Package(16, 10, 10, 10) ], '02', self.shipper, self.recipient, account='111111')
+        cache.fetch('ups', self._rate, [ Package(16, 10, 10, 10) ], '02', self.shipper, self.recipient, account='222222')
+        cache.fetch('ups', self._rate, [ Package(16, 10, 10, 10) ], '02', self.shipper, self.recipient, account='111111')
+        self.assertEqual(self.calls, 2)
+
+        credentials = { 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': '111111' }
+        first = ups.UPS(credentials, rate_cache=cache)
+        second = ups.UPS(dict(credentials, shipper_number='222222'), rate_cache=cache)
+        production = ups.UPS(credentials, debug=False, rate_cache=cache)
+        for api in ( first, second, production, first ):
+            api._rate = self._rate
+            api.rate([ Package(32, 10, 10, 10) ], '02', self.shipper, self.recipient)
+        self.assertEqual(self.calls, 5)
+
+class TestAddressCache(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+        self.address = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _validate(self, address):
+        self.calls += 1
+        candidate = Address('', '1 INFINITE LOOP', 'CUPERTINO', 'CA', '95014', 'US', address2='BLDG 4')
+        return { 'candidates': [ candidate ], 'valid': True, 'ambiguous': False, 'class_code': '1', 'class_description': 'Commercial' }
+
+    def test_address_key(self):
+        same = Address('Someone Else', '1 infinite  loop.', 'CUPERTINO', 'ca', '95014-2083', 'United States', phone='4085551212')
+        self.assertEqual(address_key(same), address_key(self.address))
+        self.assertEqual(address_key(self.address), ( u'1 infinite loop', u'', u'cupertino', u'ca', u'95014', 'US' ))
+        self.assertNotEqual(address_key(Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US', address2='Suite 2')), address_key(self.address))
+        self.assertEqual(address_key(Address('', '24 Sussex Dr', 'Ottawa', 'ON', 'K1M 1M4', 'CA'))[4], u'K1M1M4')
+
+    def test_memory(self):
+        cache = caching.AddressCache(maxsize=1)
+        first = cache.fetch(self._validate, self.address)
+        first['candidates'][0].city = 'Nowhere'
+        second = cache.fetch(self._validate, Address('Apple', '1 INFINITE LOOP', 'cupertino', 'CA', '950140000', 'USA'))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second['candidates'][0].city, 'CUPERTINO')
+
+        cache.fetch(self._validate, Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US'))
+        cache.fetch(self._validate, self.address)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_expiry(self):
+        cache = caching.AddressCache(ttl=0, path=os.path.join(self.directory, 'addresses.db'))
+        cache.fetch(self._validate, self.address)
+        cache.fetch(self._validate, self.address)
+        self.assertEqual(self.calls, 2)
+
+    def test_persistent(self):
+        path = os.path.join(self.directory, 'addresses.db')
+        cache = caching.AddressCache(path=path)
+        expected = cache.fetch(self._validate, self.address)
+        cache.close()
+
+        cache = caching.AddressCache(path=path)
+        result = cache.fetch(self._validate, self.address)
+        cache.fetch(self._validate, self.address)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(result, expected)
+        self.assertEqual(result['candidates'][0].address2, 'BLDG 4')
+        self.assertEqual(cache.stats()['persistent_hits'], 1)
+        self.assertEqual(cache.stats()['persistent_size'], 1)
+
+    def test_persistent_maxsize(self):
+        cache = caching.AddressCache(path=os.path.join(self.directory, 'addresses.db'), persistent_maxsize=2)
+        for zip in range(95001, 95006):
+            cache.put(Address('', '1 Main St', 'San Jose', 'CA', zip, 'US'), self._validate(None))
+        cache._trim()
+        self.assertEqual(cache.stats()['persistent_size'], 2)
+
+    def test_ups_validate(self):
+        cache = caching.AddressCache(path=os.path.join(self.directory, 'addresses.db'))
+        with standin.StandinServer() as server:
+            api = ups.UPS({ 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }, base_url=server.url, address_cache=cache)
+            first = api.validate(self.address)
+            second = api.validate(Address('Apple Inc', '1 infinite loop', 'Cupertino', 'CA', '95014-2083', 'US'))
+            self.assertEqual(server.stats()['operations'], { 'ups/XAV': 1 })
+        self.assertEqual([ address_key(c) for c in first['candidates'] ], [ address_key(c) for c in second['candidates'] ])
+        self.assertEqual([ c.name for c in first['candidates'] ], [ 'Apple' ] * len(first['candidates']))
+        self.assertEqual([ c.name for c in second['candidates'] ], [ 'Apple Inc' ] * len(second['candidates']))
+        self.assertTrue(second['valid'])
+
+    def test_contact_details_are_the_requesters(self):
+        def validate(address):
+            self.calls += 1
+            return { 'candidates': [ Address(address.name, '1 INFINITE LOOP', 'CUPERTINO', 'CA', '95014', 'US') ], 'valid': True }
+        path = os.path.join(self.directory, 'addresses.db')
+        cache = caching.AddressCache(path=path)
+        first = cache.fetch(validate, Address('Tim', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US', phone='4085551212'))
+        second = cache.fetch(validate, Address('Jony', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US', email='jony@example.com'))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(( first['candidates'][0].name, first['candidates'][0].phone ), ( 'Tim', '4085551212' ))
+        self.assertEqual(( second['candidates'][0].name, second['candidates'][0].phone, second['candidates'][0].email ), ( 'Jony', '', 'jony@example.com' ))
+        cache.close()
+
+        cache = caching.AddressCache(path=path)
+        third = cache.fetch(validate, Address('Craig', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US'))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(( third['candidates'][0].name, third['candidates'][0].phone ), ( 'Craig', '' ))
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
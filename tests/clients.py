@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import time
+import threading
+import BaseHTTPServer
+import shutil
+import tempfile
+import os
+import sys
+sys.path.append('../')
+
+from shipping import Address
+from suds.plugin import InitPlugin
+import clients
+import connections
+import endicia
+import fedex
+import ups
+
+class BlockingPlugin(InitPlugin):
+    # Holds up parsing until released
+    def __init__(self, started, release):
+        self.started = started
+        self.release = release
+
+    def initialized(self, context):
+        self.started.set()
+        self.release.wait(5)
+
+class TestClientCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = clients.ClientCache()
+        self.api = fedex.Fedex({}, debug=True)
+        self.wsdl_url = 'file://' + self.api.wsdl_dir + '/RateService_v9.wsdl'
+
+    def test_parses_once(self):
+        first = self.cache.get(self.wsdl_url)
+        second = self.cache.get(self.wsdl_url)
+        self.assertIs(first.wsdl, second.wsdl)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.cache.stats(), { 'hits': 1, 'misses': 1, 'size': 1 })
+
+    def test_keyed_by_location(self):
+        self.cache.get(self.wsdl_url)
+        client = self.cache.get(self.wsdl_url, 'https://gateway.fedex.com:443/web-services')
+        self.assertEqual(client.options.location, 'https://gateway.fedex.com:443/web-services')
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def test_keyed_by_options(self):
+        self.cache.get(self.wsdl_url)
+        self.cache.get(self.wsdl_url, plugins=[ ups.FixRequestNamespacePlug() ])
+        self.cache.get(self.wsdl_url, plugins=[ ups.FixRequestNamespacePlug() ])
+        self.assertEqual(self.cache.stats(), { 'hits': 1, 'misses': 2, 'size': 2 })
+
+    def test_parsing_does_not_block_other_wsdls(self):
+        self.cache.get(self.wsdl_url)
+        started, release = threading.Event(), threading.Event()
+        ship_url = 'file://' + self.api.wsdl_dir + '/ShipService_v9.wsdl'
+        parsing = threading.Thread(target=self.cache.get, args=(ship_url,), kwargs={ 'plugins': [ BlockingPlugin(started, release) ] })
+        parsing.start()
+        try:
+            self.assertTrue(started.wait(30))
+            # Answered from the cache while the other parse is still held up
+            start = time.time()
+            self.assertTrue(self.cache.get(self.wsdl_url).factory.create('RequestedPackageLineItem'))
+            self.assertLess(time.time() - start, 2)
+        finally:
+            release.set()
+            parsing.join()
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def test_fedex_uses_shared_cache(self):
+        clients.cache.clear()
+        self.api.create_client('RateService_v9.wsdl')
+        fedex.Fedex({}, debug=True).create_client('RateService_v9.wsdl')
+        self.assertEqual(clients.cache.stats()['misses'], 1)
+
+    def test_disk_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            clients.ClientCache(cache_dir).get(self.wsdl_url)
+            version_dir = os.path.join(cache_dir, 'v%d' % clients.CACHE_VERSION)
+            digest = clients.wsdl_digest(os.path.join(self.api.wsdl_dir, 'RateService_v9.wsdl'))
+            self.assertEqual(os.listdir(version_dir), [ digest ])
+            self.assertTrue([ n for n in os.listdir(os.path.join(version_dir, digest)) if n.endswith('.px') ])
+
+            client = clients.ClientCache(cache_dir).get(self.wsdl_url)
+            self.assertTrue(client.factory.create('RequestedPackageLineItem'))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_warmup(self):
+        timings = clients.warmup(self.api)
+        self.assertEqual(sorted(timings['Fedex'].keys()), sorted(fedex.WSDLS))
+
+    def test_endicia_client_is_lazy(self):
+        api = endicia.Endicia({}, debug=False)
+        self.assertIsNone(api._client)
+        self.assertEqual(api.client.options.location, 'https://LabelServer.Endicia.com/LabelService/EwsLabelService.asmx')
+        self.assertTrue(api.client.factory.create('PostageRatesRequest'))
+
+class TestClientPool(unittest.TestCase):
+    def test_reuses_checked_in_clients(self):
+        pool = clients.ClientPool(object, maxsize=2)
+        with pool.client() as first:
+            pass
+        with pool.client() as second:
+            self.assertIs(first, second)
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_bounded(self):
+        pool = clients.ClientPool(object, maxsize=1, timeout=0.01)
+        client = pool.checkout()
+        self.assertRaises(clients.ClientPoolTimeout, pool.checkout)
+        pool.checkin(client)
+        self.assertIs(pool.checkout(), client)
+
+    def test_bounded_pools(self):
+        pools = clients.ClientPools(maxpools=2)
+        first = pools.get('a', object)
+        second = pools.get('b', object)
+        self.assertIs(pools.get('a', object), first)
+        # b is the least recently used, so c replaces it
+        pools.get('c', object)
+        self.assertEqual(len(pools), 2)
+        self.assertIs(pools.get('a', object), first)
+        self.assertIsNot(pools.get('b', object), second)
+
+    def test_ups_transports_over_the_same_connections_share_clients(self):
+        clients.pools.clear()
+        credentials = { 'username': 'one', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }
+        for i in range(3):
+            with ups.UPS(credentials, transport=clients.PooledTransport())._client('XAV.wsdl'):
+                pass
+        self.assertEqual(len(clients.pools), 1)
+        with ups.UPS(credentials, transport=clients.PooledTransport(connections.ConnectionPools()))._client('XAV.wsdl'):
+            pass
+        self.assertEqual(len(clients.pools), 2)
+
+    def test_ups_credentials_do_not_share_clients(self):
+        credentials = { 'username': 'one', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }
+        other_credentials = dict(credentials, username='two')
+        with ups.UPS(credentials)._client('XAV.wsdl') as client:
+            with ups.UPS(other_credentials)._client('XAV.wsdl') as other_client:
+                username = client.options.soapheaders.getChild('UsernameToken').getChild('Username')
+                other_username = other_client.options.soapheaders.getChild('UsernameToken').getChild('Username')
+                self.assertEqual(username.getText(), 'one')
+                self.assertEqual(other_username.getText(), 'two')
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fixture = None
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with open(self.fixture) as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestPooledTransport(unittest.TestCase):
+    def setUp(self):
+        FixtureHandler.fixture = os.path.join(os.path.dirname(__file__), '..', 'wsdl', 'fedex', 'RateReply_Intra_MX_Exp_Saver.txt')
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FixtureHandler)
+        threading.Thread(target=self.server.serve_forever).start()
+        self.pools = connections.ConnectionPools()
+
+    def tearDown(self):
+        self.pools.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fedex_rate(self):
+        credentials = { 'key': 'k', 'password': 'p', 'account_number': 'a', 'meter_number': 'm' }
+        api = fedex.Fedex(credentials, transport=clients.PooledTransport(self.pools))
+        location = 'http://127.0.0.1:%d/web-services' % self.server.server_address[1]
+        create_client = api.create_client
+        def local_client(wsdl_name):
+            client = create_client(wsdl_name)
+            client.set_options(location=location)
+            return client
+        api.create_client = local_client
+
+        shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US')
+        packages = [ fedex.Package(20.0 * 16, 12, 12, 12) ]
+        for i in range(2):
+            response = api.rate(packages, fedex.PACKAGES[-1], shipper, shipper)
+            self.assertEqual(response['info'][0]['service'], 'FEDEX_EXPRESS_SAVER')
+
+        stats = self.pools.stats()[location.rsplit('/', 1)[0]]
+        self.assertEqual((stats['connections'], stats['reused']), (1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import time
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+from urllib2 import HTTPError, URLError
+import sys
+sys.path.append('../')
+
+import connections
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._reply(404 if self.path == '/missing' else 200, self.path)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.posts.append(body)
+        if self.path == '/slow':
+            time.sleep(0.5)
+        self._reply(200, body)
+        if self.path == '/hangup':
+            # Closed without saying so, like a server dropping an idle keep-alive connection
+            self.close_connection = 1
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    posts = None
+
+class TestConnectionPools(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.posts = list()
+        threading.Thread(target=self.server.serve_forever).start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.pools = connections.ConnectionPools(maxsize=2)
+
+    def tearDown(self):
+        self.pools.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connections(self):
+        self.assertEqual(self.pools.request(self.url + '/a?XML=1'), '/a?XML=1')
+        self.assertEqual(self.pools.request(self.url + '/b', 'labelRequestXML=x'), 'labelRequestXML=x')
+        stats = self.pools.stats()[self.url]
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 1)
+
+    def test_error_status(self):
+        self.assertRaises(HTTPError, self.pools.request, self.url + '/missing')
+
+    def test_reconnects_after_server_closes(self):
+        self.pools.request(self.url + '/a')
+        for conn in list(self.pools.get('http', '127.0.0.1', self.server.server_address[1])._idle.queue):
+            conn.sock.close()
+        self.assertEqual(self.pools.request(self.url + '/b'), '/b')
+
+    def test_resends_when_idle_connection_was_dropped(self):
+        self.pools.request(self.url + '/hangup', 'label=1')
+        time.sleep(0.1)
+        self.assertEqual(self.pools.request(self.url + '/b', 'label=2'), 'label=2')
+        self.assertEqual(self.server.posts, [ 'label=1', 'label=2' ])
+        self.assertEqual(self.pools.stats()[self.url]['connections'], 2)
+
+    def test_timed_out_post_is_sent_once(self):
+        pools = connections.ConnectionPools(read_timeout=0.2)
+        try:
+            pools.request(self.url + '/a', 'label=1')
+            self.assertRaises(URLError, pools.request, self.url + '/slow', 'label=2')
+            time.sleep(0.6)
+            self.assertEqual(self.server.posts, [ 'label=1', 'label=2' ])
+            self.assertEqual(pools.stats()[self.url]['errors'], 1)
+        finally:
+            pools.close()
+
+    def test_deadline(self):
+        self.pools.request(self.url + '/a', 'label=1')
+        start = time.time()
+        with connections.deadline(0.2):
+            self.assertRaises(URLError, self.pools.request, self.url + '/slow', 'label=2')
+            self.assertLess(time.time() - start, 0.4)
+            time.sleep(0.2)
+            self.assertRaises(connections.NotSent, self.pools.request, self.url + '/a', 'label=3')
+        self.assertEqual(self.pools.request(self.url + '/a', 'label=4'), 'label=4')
+        time.sleep(0.4)
+        self.assertEqual(self.server.posts, [ 'label=1', 'label=2', 'label=4' ])
+
+    def test_refused_connection_is_not_sent(self):
+        # A port nothing is listening on
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        port = closed.getsockname()[1]
+        closed.close()
+        self.assertRaises(connections.NotSent, self.pools.request, 'http://127.0.0.1:%d/a' % port, 'label=1')
+
+if __name__ == '__main__':
+    unittest.main()
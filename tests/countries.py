@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import sys
+sys.path.append('../')
+
+import iso_country_codes
+from iso_country_codes import country_code, lookup_code, lookup_country, CountryError, COUNTRY
+from shipping import get_country_code
+import ups
+import fedex
+
+class TestCountryCode(unittest.TestCase):
+    def test_codes_and_names(self):
+        for code, name in COUNTRY.items():
+            self.assertEqual(len(code), 2)
+            self.assertEqual(country_code(code), code)
+            self.assertEqual(country_code(code.lower()), code)
+            self.assertEqual(country_code(name), code)
+            self.assertEqual(country_code(name.title()), code)
+
+    def test_aliases(self):
+        for country in ( 'usa', 'U.S.A.', 'United States of America', ' united  states ' ):
+            self.assertEqual(country_code(country), 'US')
+        self.assertEqual(country_code('UK'), 'GB')
+        self.assertEqual(country_code('South Korea'), 'KR')
+        self.assertEqual(country_code('Republic of Korea'), 'KR')
+        self.assertEqual(country_code('Bolivia'), 'BO')
+        # Ambiguous on its own
+        self.assertEqual(country_code('Korea'), 'Korea')
+
+    def test_folding(self):
+        self.assertEqual(country_code(u'Côte d’Ivoire'), 'CI')
+        self.assertEqual(country_code('Côte d\'Ivoire'), 'CI')
+        self.assertEqual(country_code(u'Saint Barthélemy'), 'BL')
+        self.assertEqual(country_code(u'RÉUNION'), 'RE')
+        self.assertEqual(country_code('Zimbabwe'), 'ZW')
+
+    def test_unknown(self):
+        self.assertEqual(country_code('Atlantis'), 'Atlantis')
+        self.assertEqual(country_code(''), '')
+        self.assertRaises(CountryError, country_code, 'Atlantis', strict=True)
+        self.assertRaises(ValueError, country_code, '', strict=True)
+        self.assertEqual(country_code('Atlantis'), 'Atlantis')
+
+    def test_legacy_lookups(self):
+        self.assertEqual(lookup_code('usa'), 'US')
+        self.assertEqual(lookup_code('Atlantis'), 'AT')
+        self.assertRaises(CountryError, lookup_code, 'Atlantis', strict=True)
+        self.assertEqual(lookup_country('usa'), 'UNITED STATES')
+        self.assertEqual(lookup_country('zz'), 'zz')
+
+    def test_carriers(self):
+        self.assertEqual(get_country_code('Canada'), 'CA')
+        self.assertEqual(ups.UPS({})._normalized_country_code('United Kingdom'), 'GB')
+        self.assertEqual(fedex.Fedex({})._normalized_country_code('usa'), 'US')
+
+if __name__ == '__main__':
+    unittest.main()
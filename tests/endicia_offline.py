@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import os
+import sys
+sys.path.append('../')
+
+from shipping import Address
+from tests.ups_offline import ReplyTransport
+import endicia
+
+ENDICIA_DIR = os.path.join(os.path.dirname(__file__), '..', 'wsdl', 'endicia')
+
+def fixture(name):
+    with open(os.path.join(ENDICIA_DIR, name)) as f:
+        return f.read()
+
+CREDENTIALS = { 'partner_id': 'p', 'account_id': '123456', 'passphrase': 'secret' }
+
+FAULT = '''<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><soap:Fault><faultcode>soap:Client</faultcode><faultstring>Bad request</faultstring></soap:Fault></soap:Body></soap:Envelope>'''
+
+ERROR = '''<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><CalculatePostageRatesResponse xmlns="www.envmgr.com/LabelService"><PostageRatesResponse><Status>12503</Status><ErrorMessage>Unable to find the account.</ErrorMessage><NewField>1</NewField></PostageRatesResponse></CalculatePostageRatesResponse></soap:Body></soap:Envelope>'''
+
+class TestRate(unittest.TestCase):
+    def setUp(self):
+        self.package = endicia.Package(endicia.Package.shipment_types[0], 20, endicia.Package.shapes[1], 12, 12, 12)
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US')
+        self.recipient = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US')
+
+    def rate(self, reply, status=200):
+        api = endicia.Endicia(CREDENTIALS, transport=ReplyTransport(reply, status))
+        return api.rate(self.package, self.shipper, self.recipient)
+
+    def test_reply(self):
+        response = self.rate(fixture('CalculatePostageRatesResponse_Domestic.txt'))
+        self.assertEqual(response['status'], 0)
+        self.assertEqual(len(response['info']), 7)
+        self.assertEqual(response['info'][0], { 'service': 'Priority Mail', 'package': 'Priority', 'delivery_day': '', 'cost': 6.95 })
+
+    def test_fields_the_wsdl_does_not_describe(self):
+        # A reply as Endicia sends it today, with elements the bundled WSDL leaves out
+        response = self.rate(fixture('CalculatePostageRatesResponse_Full.txt'))
+        self.assertEqual(response['info'], [
+            { 'service': 'Priority Mail', 'package': 'Priority', 'delivery_day': '', 'cost': 7.35 },
+            { 'service': 'Express Mail', 'package': 'Express', 'delivery_day': '', 'cost': 27.5 },
+        ])
+
+    def test_errors(self):
+        try:
+            self.rate(ERROR)
+            self.fail('No EndiciaError')
+        except endicia.EndiciaError as e:
+            self.assertEqual(e.code, 12503)
+            self.assertEqual(str(e), 'Unable to find the account.')
+        self.assertRaises(endicia.EndiciaWebError, self.rate, FAULT, 500)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+sys.path.append('../')
+
+from shipping import Address, Package
+import fedex
+import endicia
+import estimate
+import zones
+import shop
+
+class TestEstimator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        estimate.write_rates(os.path.join(self.directory, 'ups.rates'), 'ups', {
+            '03': [ [ 8.5, 9.25, 12 ], [ 10, 11, 15.5 ], [ 20, 22, None ] ],
+            '01': [ [ 30, 35, 60 ], [ 40, 45, 80 ], [ None, None, None ] ],
+        }, breaks=[ 16, 80, 1120 ], zones=[ 2, 8, 51 ], countries={ 'CA': 51 }, dim_divisor=139)
+        zones.write(os.path.join(self.directory, 'ups.zones'), {
+            '951': [ (0, 899, 8), (900, 961, 2) ],
+        })
+        self.estimator = estimate.Estimator(self.directory)
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US')
+        self.recipient = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US')
+
+    def tearDown(self):
+        self.estimator.close()
+        shutil.rmtree(self.directory)
+
+    def test_domestic(self):
+        response = self.estimator.rate('ups', [ Package(32, 4, 4, 4) ], self.shipper, self.recipient, '02')
+        self.assertEqual(response['status'], 'ESTIMATE')
+        self.assertTrue(response['estimate'])
+        self.assertEqual(response['info'], [
+            { 'service': 'UPS Ground', 'package': '02', 'delivery_day': '', 'cost': '10.00', 'estimate': True },
+            { 'service': 'UPS Next Day', 'package': '02', 'delivery_day': '', 'cost': '40.00', 'estimate': True },
+        ])
+
+        far = Address('Someone', '1 Main St', 'New York', 'NY', '10001-1234', 'USA')
+        response = self.estimator.rate('ups', [ Package(16, 4, 4, 4), Package(16, 4, 4, 4) ], self.shipper, far)
+        self.assertEqual([ i['cost'] for i in response['info'] ], [ '18.50', '70.00' ])
+
+    def test_weight_breaks_and_dimensions(self):
+        # Too heavy for next day air, and too heavy for anything past the last break
+        response = self.estimator.rate('ups', [ Package(50 * 16, 4, 4, 4) ], self.shipper, self.recipient)
+        self.assertEqual([ (i['service'], i['cost']) for i in response['info'] ], [ ('UPS Ground', '20.00') ])
+        response = self.estimator.rate('ups', [ Package(71 * 16 + 16, 4, 4, 4) ], self.shipper, self.recipient)
+        self.assertEqual(response['info'], [])
+
+        # A light but large box is priced by its dimensional weight of 5 lbs
+        response = self.estimator.rate('ups', [ Package(16, 10, 10, 6) ], self.shipper, self.recipient)
+        self.assertEqual(response['info'][0]['cost'], '10.00')
+        response = self.estimator.rate('ups', [ fedex.Package(24, 1, 1, 1) ], self.shipper, self.recipient)
+        self.assertEqual(response['info'][0]['cost'], '10.00')
+
+    def test_international_and_missing_zones(self):
+        canada = Address('Someone', '1 Main St', 'Ottawa', 'ON', 'K1A 0B1', 'Canada')
+        response = self.estimator.rate('ups', [ Package(16) ], self.shipper, canada)
+        self.assertEqual([ i['cost'] for i in response['info'] ], [ '12.00', '60.00' ])
+
+        elsewhere = Address('Someone', '1 Main St', 'Juneau', 'AK', 99801, 'US')
+        self.assertRaises(estimate.EstimateError, self.estimator.rate, 'ups', [ Package(16) ], self.shipper, elsewhere)
+        self.assertRaises(estimate.EstimateError, self.estimator.rate, 'ups', [ Package(16) ], canada, self.recipient)
+        try:
+            self.estimator.rate('fedex', [ Package(16) ], self.shipper, self.recipient)
+            self.fail('Estimated without a fedex table')
+        except estimate.EstimateError, e:
+            self.assertTrue('fedex.rates' in str(e))
+
+    def test_rate_shop(self):
+        response = shop.rate_shop({ 'ups': (self.estimator.api('ups'), ([ Package(16) ], '02')) }, self.shipper, self.recipient)
+        self.assertEqual(response['status'], 'SUCCESS')
+        self.assertEqual([ (i['carrier'], i['cost'], i['estimate']) for i in response['info'] ], [ ('ups', '8.50', True), ('ups', '30.00', True) ])
+
+    def test_compile_rates(self):
+        csv_path = os.path.join(self.directory, 'endicia.csv')
+        with open(csv_path, 'w') as f:
+            f.write('service,ounces,1,2\nPriority,16,5.80,6.10\nPriority,32,7.00,7.40\nMediaMail,16,2.80,\n')
+        estimate.compile_rates(csv_path, os.path.join(self.directory, 'endicia.rates'), 'endicia')
+        zones.write(os.path.join(self.directory, 'endicia.zones'), { '951': [ (950, 950, 2), (951, 999, 1) ] })
+
+        package = endicia.Package('Priority', 20, endicia.Package.shapes[1], 12, 12, 12)
+        response = self.estimator.api('endicia').rate(package, self.shipper, self.recipient)
+        self.assertEqual(response['info'], [
+            { 'service': 'Priority Mail', 'package': 'Priority', 'delivery_day': '', 'cost': '7.40', 'estimate': True },
+        ])
+        response = self.estimator.rate('endicia', package, self.shipper, self.shipper)
+        self.assertEqual([ i['package'] for i in response['info'] ], [ 'Priority' ])
+
+    def test_bad_tables(self):
+        path = os.path.join(self.directory, 'fedex.rates')
+        self.assertRaises(ValueError, estimate.write_rates, path, 'fedex', { 'UPS_GROUND': [ [ 1 ] ] }, [ 16 ], [ 2 ])
+        self.assertRaises(ValueError, estimate.write_rates, path, 'fedex', { 'FEDEX_GROUND': [ [ 1, 2 ] ] }, [ 16 ], [ 2 ])
+        self.assertFalse(os.path.exists(path))
+        with open(path, 'w') as f:
+            f.write('not a table')
+        self.assertRaises(estimate.EstimateError, estimate.RateTable, path)
+
+    def test_file_mode(self):
+        self.assertEqual(os.stat(os.path.join(self.directory, 'ups.rates')).st_mode & 0777, 0666 & ~zones._umask())
+
+    def test_rewritten_tables(self):
+        rates, matrix = self.estimator.tables('ups')
+        zones.write(os.path.join(self.directory, 'ups.zones'), { '951': [ (0, 999, 2) ] })
+        # What's mapped already is unchanged, and a new estimator reads the new table
+        self.assertEqual(matrix.zone('95110', '10001'), 8)
+        refreshed = estimate.Estimator(self.directory)
+        self.assertEqual(refreshed.tables('ups')[1].zone('95110', '10001'), 2)
+        refreshed.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import threading
+import time
+import sys
+sys.path.append('../')
+
+import executor
+
+class FakeCarrier(object):
+    def __init__(self):
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+
+    def rate(self, zip):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        if zip == 'bad':
+            raise ValueError('bad zip')
+        return { 'status': 'SUCCESS', 'info': [ { 'service': 'Ground', 'package': '02', 'delivery_day': '', 'cost': zip } ] }
+
+class TestExecutor(unittest.TestCase):
+    def test_results_and_errors(self):
+        api = executor.AsyncCarrier(FakeCarrier(), executor.Executor(workers=4))
+        good = api.rate('95014')
+        bad = api.rate('bad')
+        self.assertEqual(good.result(1)['info'][0]['cost'], '95014')
+        self.assertRaises(ValueError, bad.result, 1)
+        self.assertEqual(str(bad.exception()), 'bad zip')
+
+    def test_bounded_concurrency(self):
+        carrier = FakeCarrier()
+        api = executor.AsyncCarrier(carrier, executor.Executor(workers=3))
+        futures = [ api.rate(str(zip)) for zip in range(12) ]
+        finished = list(executor.as_completed(futures, timeout=5))
+        self.assertEqual(len(finished), 12)
+        self.assertEqual(carrier.most_running, 3)
+
+    def test_system_exit_does_not_kill_workers(self):
+        one = executor.Executor(workers=1)
+        exiting = one.submit(sys.exit, 3)
+        self.assertRaises(SystemExit, exiting.result, 1)
+        self.assertEqual(one.submit(len, 'ups').result(1), 3)
+
+    def test_as_completed_timeout(self):
+        slow = executor.Executor(workers=2).submit(time.sleep, 1)
+        self.assertRaises(executor.TimeoutError, list, executor.as_completed([ slow ], timeout=0.05))
+        self.assertRaises(executor.TimeoutError, slow.result, 0.01)
+
+if __name__ == '__main__':
+    unittest.main()
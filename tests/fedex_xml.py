@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import datetime
+import glob
+import os
+import sys
+sys.path.append('../')
+
+from xml.etree import ElementTree
+from suds.transport import Transport, Reply
+
+from shipping import Address
+import fedex
+import fedex_xml
+
+FEDEX_DIR = os.path.join(os.path.dirname(__file__), '..', 'wsdl', 'fedex')
+NOW = datetime.datetime(2012, 5, 1, 9, 30, 47, 123)
+
+class FixedDatetime(datetime.datetime):
+    @classmethod
+    def now(cls):
+        return NOW
+
+def fixture(name):
+    with open(os.path.join(FEDEX_DIR, name)) as f:
+        return f.read()
+
+class CaptureTransport(Transport):
+    """Records what would have been sent and answers with a recorded reply"""
+    def __init__(self, reply, sent=None):
+        Transport.__init__(self)
+        self.reply = reply
+        self.sent = [] if sent is None else sent
+
+    def send(self, request):
+        self.sent.append((request.message, request.headers))
+        return Reply(200, {}, self.reply)
+
+    def __deepcopy__(self, memo):
+        return CaptureTransport(self.reply, self.sent)
+
+def children(xml, parent):
+    """The distinct child element names of the first parent element, in document order"""
+    root = ElementTree.fromstring(xml)
+    node = [ e for e in root.iter() if e.tag.endswith('}' + parent) ][0]
+    names = []
+    for child in node:
+        name = child.tag.split('}')[-1]
+        if not names or names[-1] != name:
+            names.append(name)
+    return names
+
+class TestFedexRequests(unittest.TestCase):
+    def setUp(self):
+        self.real_datetime = fedex.datetime
+        fedex.datetime = FixedDatetime
+        self.credentials = { 'key': 'k&y', 'password': 'p<w>', 'account_number': '510087020', 'meter_number': '118511895' }
+        self.shipper = Address(u'José & Sons', '345 Park Avenue', 'San Jose', 'CA', 95110, 'USA', address2='Suite "1"', phone='555-123-4567', email='ship@example.com', is_residence=False)
+        self.recipient = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', '95014', 'US')
+        self.packages = [ fedex.Package(320, 12, 12, 12, value=5, require_signature=True, dry_ice_weight_in_ozs=10), fedex.Package(15, '', 2, 3), fedex.Package(16, 1, 1, 1, dry_ice_weight_in_ozs=3) ]
+
+    def tearDown(self):
+        fedex.datetime = self.real_datetime
+
+    def both(self, reply, call):
+        """Runs call with the suds serializer and with fedex_xml, returning what each sent and got back"""
+        results = []
+        for fast in (False, True):
+            transport = CaptureTransport(fixture(reply))
+            api = fedex.Fedex(self.credentials, debug=False, transport=transport, fast_requests=fast)
+            response = call(api)
+            results.append((transport.sent[0], response))
+        return results
+
+    def test_rate_matches_suds(self):
+        (slow_sent, slow), (fast_sent, fast) = self.both('RateReply_Intra_MX_Exp_Saver.txt', lambda api: api.rate(self.packages, 'YOUR_PACKAGING', self.shipper, self.recipient))
+        self.assertEqual(fast_sent, slow_sent)
+        self.assertEqual(fast, slow)
+
+    def test_label_matches_suds(self):
+        for options in [ {}, { 'email_alert': True, 'evening': True, 'delivery_instructions': 'Back <door>' }, { 'payment': { 'type': 'RECIPIENT', 'account': '123' }, 'delivery_instructions': None } ]:
+            (slow_sent, slow), (fast_sent, fast) = self.both('ProcessShipmentReply_Smash_Basic.txt', lambda api: api.label(self.packages[:1], 'YOUR_PACKAGING', 'SMART_POST', self.shipper, self.recipient, **options))
+            self.assertEqual(fast_sent, slow_sent)
+            self.assertEqual(fast, slow)
+
+    def outcome(self, api, call):
+        try:
+            return call(api)
+        except fedex.FedexError, e:
+            return (type(e), str(e))
+
+    def test_replies_match_suds(self):
+        checked = 0
+        calls = {
+            'RateReply': lambda api: api.rate(self.packages[:1], 'YOUR_PACKAGING', self.shipper, self.recipient),
+            'ProcessShipmentReply': lambda api: api.label(self.packages[:1], 'YOUR_PACKAGING', 'SMART_POST', self.shipper, self.recipient),
+        }
+        for name, call in calls.items():
+            for path in glob.glob(os.path.join(FEDEX_DIR, '%s*.txt' % name)):
+                outcomes = []
+                for fast in (False, True):
+                    api = fedex.Fedex(self.credentials, debug=False, transport=CaptureTransport(fixture(os.path.basename(path))), fast_requests=fast)
+                    outcomes.append(self.outcome(api, call))
+                self.assertEqual(outcomes[0], outcomes[1], os.path.basename(path))
+                checked += 1
+        self.assertGreater(checked, 20)
+
+    def test_service_unavailable_warning(self):
+        reply = fixture('RateReply_Intra_MX_Exp_Saver.txt').replace('<v9:HighestSeverity>SUCCESS</v9:HighestSeverity>', '<v9:HighestSeverity>WARNING</v9:HighestSeverity>'
+            '<v9:Notifications><v9:Severity>WARNING</v9:Severity><v9:Source>crs</v9:Source><v9:Code>556</v9:Code>'
+            '<v9:Message>There are no valid services available.</v9:Message></v9:Notifications>')
+        for fast in (False, True):
+            api = fedex.Fedex(self.credentials, debug=False, transport=CaptureTransport(reply), fast_requests=fast)
+            outcome = self.outcome(api, lambda api: api.rate(self.packages, 'YOUR_PACKAGING', self.shipper, self.recipient))
+            self.assertEqual(outcome, (fedex.FedexError, 'There are no valid services available.'))
+
+    def test_element_order_matches_samples(self):
+        rendered = {
+            'RateRequest': fedex_xml.rate_request(self.credentials, self.packages, 'YOUR_PACKAGING', self.shipper, self.recipient, lambda c: c, NOW),
+            'ProcessShipmentRequest': fedex_xml.ship_request(self.credentials, self.packages, 'YOUR_PACKAGING', 'SMART_POST', self.shipper, self.recipient, lambda c: c, 'PNG', email_alert=True, evening=True, timestamp=NOW),
+        }
+        checked = 0
+        for name, xml in rendered.items():
+            for sample in glob.glob(os.path.join(FEDEX_DIR, '%s_*.txt' % name)):
+                with open(sample) as f:
+                    expected = children(f.read(), 'RequestedShipment')
+                ours = [ tag for tag in children(xml, 'RequestedShipment') if tag in expected ]
+                self.assertEqual(ours, [ tag for tag in expected if tag in ours ], os.path.basename(sample))
+                checked += 1
+        self.assertGreater(checked, 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import time
+import threading
+import sys
+sys.path.append('../')
+
+from urllib2 import HTTPError
+
+from shipping import Address, Package
+import caching
+import metrics
+import standin
+import ups
+import endicia
+import USPS
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('calls_total', 'Calls', ( 'carrier', ))
+        counter.labels('ups').inc()
+        counter.labels('ups').inc(2)
+        self.assertEqual(counter.labels('ups').get(), 3)
+        self.assertEqual(counter.labels('fedex').get(), 0)
+        self.assertRaises(ValueError, counter.labels, 'ups', 'rate')
+        self.assertRaises(ValueError, self.registry.counter, 'calls_total', 'Again')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('size_bytes', 'Sizes', buckets=( 10, 100 ))
+        for value in ( 5, 10, 50, 500 ):
+            histogram.labels().observe(value)
+        self.assertEqual(histogram.labels().get(), ( [ 2, 3, 4 ], 565, 4 ))
+
+    def test_threads(self):
+        counter = self.registry.counter('calls_total', 'Calls')
+        histogram = self.registry.histogram('seconds', 'Seconds', buckets=( 1, ))
+        def work():
+            for i in range(10000):
+                counter.labels().inc()
+                histogram.labels().observe(0.5)
+        threads = [ threading.Thread(target=work) for i in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.labels().get(), 80000)
+        self.assertEqual(histogram.labels().get(), ( [ 80000, 80000 ], 40000, 80000 ))
+
+    def test_finished_threads_are_folded(self):
+        counter = self.registry.counter('calls_total', 'Calls')
+        counter.labels().inc()
+        for i in range(50):
+            thread = threading.Thread(target=counter.labels().inc, args=(2,))
+            thread.start()
+            thread.join()
+        self.assertEqual(counter.labels().get(), 101)
+        # Only this thread's cell is left, once the last thread has been torn down after join() returned
+        for i in range(100):
+            if len(counter.labels()._cells) == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(counter.labels()._cells), 1)
+        self.assertEqual(counter.labels().get(), 101)
+
+    def test_export(self):
+        counter = self.registry.counter('errors_total', 'Errors', ( 'carrier', 'code' ))
+        histogram = self.registry.histogram('request_seconds', 'Latency', ( 'carrier', ), buckets=( 0.5, 1 ))
+        counter.labels('ups', 'Bad "zip"\n').inc()
+        histogram.labels('ups').observe(0.25)
+        histogram.labels('ups').observe(2)
+        self.assertEqual(self.registry.export(), '\n'.join([
+            '# HELP errors_total Errors',
+            '# TYPE errors_total counter',
+            'errors_total{carrier="ups",code="Bad \\"zip\\"\\n"} 1',
+            '# HELP request_seconds Latency',
+            '# TYPE request_seconds histogram',
+            'request_seconds_bucket{carrier="ups",le="0.5"} 1',
+            'request_seconds_bucket{carrier="ups",le="1"} 1',
+            'request_seconds_bucket{carrier="ups",le="+Inf"} 2',
+            'request_seconds_sum{carrier="ups"} 2.25',
+            'request_seconds_count{carrier="ups"} 2',
+        ]) + '\n')
+
+    def test_request(self):
+        metrics.registry.clear()
+        class CarrierError(Exception):
+            code = 120802
+        try:
+            with metrics.request('test', 'rate'):
+                metrics.payload('request', 100)
+                raise CarrierError()
+        except CarrierError:
+            pass
+        self.assertEqual(metrics.REQUESTS.labels('test', 'rate').get(), 1)
+        self.assertEqual(metrics.ERRORS.labels('test', 'rate', 'CarrierError', '120802').get(), 1)
+        self.assertEqual(metrics.LATENCY.labels('test', 'rate').get()[2], 1)
+        self.assertEqual(metrics.PAYLOAD.labels('test', 'rate', 'request').get()[1:], ( 100, 1 ))
+        # Outside an operation there's nothing to label sizes with
+        metrics.payload('request', 100)
+        self.assertEqual(metrics.PAYLOAD.labels('test', 'rate', 'request').get()[2], 1)
+
+class TestCarrierMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='4085366000', email='a@example.com')
+        self.recipient = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US', phone='4089961010', email='b@example.com')
+
+    def test_ups(self):
+        with standin.StandinServer() as server:
+            api = ups.UPS({ 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }, base_url=server.url)
+            for i in range(2):
+                api.rate([ Package(10, 10, 10, 10) ], ups.PACKAGES[0][0], self.shipper, self.recipient)
+        self.assertEqual(metrics.REQUESTS.labels('ups', 'rate').get(), 2)
+        self.assertEqual(metrics.LATENCY.labels('ups', 'rate').get()[2], 2)
+        buckets, total, count = metrics.PAYLOAD.labels('ups', 'rate', 'reply').get()
+        self.assertEqual(count, 2)
+        self.assertEqual(total, 2 * len(server._texts['ups/RateResponse_Shop.txt']))
+        self.assertEqual(metrics.PAYLOAD.labels('ups', 'rate', 'request').get()[2], 2)
+
+        text = metrics.export()
+        self.assertTrue('shipping_requests_total{carrier="ups",operation="rate"} 2\n' in text)
+        self.assertTrue('shipping_request_seconds_count{carrier="ups",operation="rate"} 2\n' in text)
+
+    def test_cache_hits_are_not_carrier_calls(self):
+        with standin.StandinServer() as server:
+            api = ups.UPS({ 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }, base_url=server.url,
+                rate_cache=caching.RateCache(), address_cache=caching.AddressCache())
+            for i in range(3):
+                api.rate([ Package(10, 10, 10, 10) ], ups.PACKAGES[0][0], self.shipper, self.recipient)
+                api.validate(self.recipient)
+        self.assertEqual(metrics.REQUESTS.labels('ups', 'rate').get(), 1)
+        self.assertEqual(metrics.LATENCY.labels('ups', 'rate').get()[2], 1)
+        self.assertEqual(metrics.REQUESTS.labels('ups', 'validate').get(), 1)
+
+    def test_errors(self):
+        package = endicia.Package(endicia.Package.shipment_types[0], 20, endicia.Package.shapes[1], 12, 12, 12)
+        with standin.StandinServer(error_rate=1) as server:
+            self.assertRaises(HTTPError, endicia.Endicia({ 'partner_id': 'p', 'account_id': '123456', 'passphrase': 'secret' }, base_url=server.url).label, package, self.shipper, self.recipient)
+        self.assertEqual(metrics.ERRORS.labels('endicia', 'GetPostageLabelXML', 'HTTPError', '503').get(), 1)
+        self.assertEqual(metrics.PAYLOAD.labels('endicia', 'GetPostageLabelXML', 'reply').get()[2], 0)
+
+        with standin.StandinServer(replies={ 'usps/RateV2': 'usps/Error_InvalidZip.txt' }) as server:
+            request = USPS.RateRequest('user', [ USPS.Package(self.shipper, self.recipient, 5, 8, 12, 12, 12) ])
+            request.base_url = server.url
+            self.assertTrue(isinstance(request.Send(), USPS.USPS.Error))
+        self.assertEqual(metrics.REQUESTS.labels('usps', 'RateRequest').get(), 1)
+        self.assertEqual(metrics.ERRORS.labels('usps', 'RateRequest', 'USPSError', '-2147219498').get(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
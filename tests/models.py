@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import copy
+import pickle
+import sys
+sys.path.append('../')
+
+from shipping import Address, Package, address_key
+import fedex
+import endicia
+
+class TestAddress(unittest.TestCase):
+    def address(self, **kwargs):
+        return Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', kwargs.pop('zip', '95014-2083'), 'US', **kwargs)
+
+    def test_normalization(self):
+        a = self.address(phone='(408) 996-1010')
+        self.assertEqual(a.zip, '95014')
+        self.assertEqual(a.phone, '4089961010')
+        self.assertEqual(self.address(zip='K1A 0B1').zip, 'K1A0B1')
+        self.assertEqual(self.address(zip=95014).zip, '95014')
+        self.assertEqual(self.address(zip=None, phone=None).zip, '')
+
+    def test_equality_and_hashing(self):
+        a, b = self.address(), self.address()
+        self.assertEqual(a, b)
+        self.assertFalse(a != b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len(set([ a, b ])), 1)
+        self.assertEqual({ a: 1 }[b], 1)
+
+        b.address2 = 'Bldg 4'
+        self.assertNotEqual(a, b)
+        self.assertNotEqual(a.key(), b.key())
+        self.assertNotEqual(a, None)
+        self.assertNotEqual(a, a.key())
+
+    def test_key_is_every_field(self):
+        a = self.address(email='orders@example.com')
+        self.assertEqual(dict(zip(Address.__slots__, a.key()))['email'], 'orders@example.com')
+        self.assertEqual(len(a.key()), len(Address.__slots__))
+        # Unlike address_key, the key tells apart names and case
+        self.assertNotEqual(a.key(), Address('Someone Else', '1 INFINITE LOOP', 'Cupertino', 'CA', '95014', 'US').key())
+        self.assertEqual(address_key(a), address_key(Address('Someone Else', '1 INFINITE LOOP', 'Cupertino', 'CA', '95014', 'US')))
+
+    def test_copy_and_pickle(self):
+        a = self.address(address2='Bldg 4', is_residence=False)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(a, protocol)), a)
+        self.assertEqual(copy.deepcopy(a), a)
+        self.assertEqual(copy.copy(a).key(), a.key())
+
+    def test_slots(self):
+        for obj in ( self.address(), Package(320, 12, 12, 12), fedex.Package(320, 12, 12, 12) ):
+            self.assertFalse(hasattr(obj, '__dict__'))
+            self.assertRaises(AttributeError, setattr, obj, 'colour', 'brown')
+
+class TestPackage(unittest.TestCase):
+    def test_weights(self):
+        p = Package(320, 12, 12, 12, reference='R1')
+        self.assertEqual(p.weight_in_lbs, 20)
+        self.assertEqual(p.weight_in_ozs, 320)
+        self.assertEqual(p.reference, 'R1')
+        self.assertAlmostEqual(fedex.Package(24, 1, 1, 1, dry_ice_weight_in_ozs=35.27397).dry_ice_weight, 1.0)
+
+    def test_equality_and_hashing(self):
+        for make in ( lambda **kwargs: Package(320, 12, 12, 12, **kwargs), lambda **kwargs: fedex.Package(320, 12, 12, 12, **kwargs),
+                lambda **kwargs: endicia.Package('Priority', 320, 'Parcel', 12, 12, 12, **kwargs) ):
+            a, b = make(), make()
+            self.assertEqual(a, b)
+            self.assertFalse(a != b)
+            self.assertEqual(hash(a), hash(b))
+            self.assertEqual(len(set([ a, b ])), 1)
+            self.assertNotEqual(a, make(value=100))
+            self.assertNotEqual(a, a.key())
+        self.assertNotEqual(Package(320, 12, 12, 12), fedex.Package(320, 12, 12, 12))
+
+    def test_copy_and_pickle(self):
+        for p in ( Package(320, 12, 12, 12, reference='R1'), fedex.Package(320, 12, 12, 12, dry_ice_weight_in_ozs=10) ):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                self.assertEqual(pickle.loads(pickle.dumps(p, protocol)), p)
+            self.assertEqual(copy.deepcopy(p), p)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import time
+import sys
+sys.path.append('../')
+
+from shipping import Address, Package
+from executor import Executor
+import shop
+import standin
+import ups
+
+class FakeCarrier(object):
+    def __init__(self, costs, delay=0, error=None):
+        self.costs = costs
+        self.delay = delay
+        self.error = error
+
+    def rate(self, packages, packaging_type, shipper, recipient):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        info = [ { 'service': 'Service %s' % cost, 'package': packaging_type, 'delivery_day': '', 'cost': cost } for cost in self.costs ]
+        return { 'status': 'SUCCESS', 'info': info }
+
+class TestRateShop(unittest.TestCase):
+    def setUp(self):
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US')
+        self.recipient = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US')
+
+    def test_merges_sorted_by_cost(self):
+        response = shop.rate_shop({
+            'ups': (FakeCarrier([ '12.50', '30.00' ]), ([], '02')),
+            'fedex': (FakeCarrier([ 9.75 ]), ([], 'YOUR_PACKAGING')),
+        }, self.shipper, self.recipient)
+        self.assertEqual(response['status'], 'SUCCESS')
+        self.assertEqual([ (i['carrier'], i['cost']) for i in response['info'] ], [ ('fedex', 9.75), ('ups', '12.50'), ('ups', '30.00') ])
+
+    def test_deadline_and_errors(self):
+        start = time.time()
+        response = shop.rate_shop({
+            'ups': (FakeCarrier([ 12 ]), ([], '02')),
+            'fedex': (FakeCarrier([ 9 ], delay=5), ([], 'YOUR_PACKAGING')),
+            'endicia': (FakeCarrier([], error=ValueError('bad zip')), ([], None)),
+        }, self.shipper, self.recipient, timeout=0.2)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(response['status'], 'PARTIAL')
+        self.assertEqual(response['timed_out'], [ 'fedex' ])
+        self.assertEqual(str(response['errors']['endicia']), 'bad zip')
+        self.assertEqual([ i['carrier'] for i in response['info'] ], [ 'ups' ])
+
+    def test_deadline_frees_workers(self):
+        executor = Executor(workers=1)
+        with standin.StandinServer(latency=2) as server:
+            api = ups.UPS({ 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }, base_url=server.url)
+            api.warmup()
+            response = shop.rate_shop({ 'ups': (api, ([ Package(16, 10, 10, 10) ], ups.PACKAGES[0][0])) }, self.shipper, self.recipient, timeout=0.3, executor=executor)
+            # The call's own read timeout can beat rate_shop's, so it's reported either way
+            self.assertEqual(response['status'], 'FAILURE')
+            self.assertEqual(response['timed_out'] + response['errors'].keys(), [ 'ups' ])
+            # The carrier call gave up at the deadline too, instead of keeping the only worker for the reply
+            start = time.time()
+            executor.submit(lambda: None).result(1)
+            self.assertLess(time.time() - start, 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
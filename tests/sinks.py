@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import BaseHTTPServer
+import threading
+import tempfile
+import shutil
+import base64
+import os
+import sys
+sys.path.append('../')
+
+from shipping import Address
+import clients
+import connections
+import fedex
+import sinks
+from tests.clients import FixtureHandler
+
+class TestSinks(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(10000)
+        # Wrapped the way some carriers send it
+        self.encoded = base64.encodestring(self.data)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_decode_chunks(self):
+        chunks = list(sinks.decode_chunks(self.encoded, size=1001))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), self.data)
+
+    def test_path_sink(self):
+        sink = sinks.get_sink(os.path.join(self.directory, 'labels', '{name}-{kind}.{ext}'))
+        reference = sink.write('label', '1Z999', 'GIF', self.encoded)
+        self.assertEqual(reference, { 'path': os.path.join(self.directory, 'labels', '1Z999-label.gif'), 'bytes': 10000 })
+        with open(reference['path'], 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_file_and_callback_sinks(self):
+        with tempfile.TemporaryFile() as f:
+            sink = sinks.get_sink(f)
+            self.assertEqual(sink.write('label', 'a', 'PNG', self.encoded), { 'offset': 0, 'bytes': 10000 })
+            self.assertEqual(sink.write('label', 'b', 'PNG', self.encoded), { 'offset': 10000, 'bytes': 10000 })
+        received = []
+        sink = sinks.get_sink(lambda kind, name, ext, data: received.append(data) or { 'id': len(received) })
+        self.assertEqual(sink.write('label', 'a', 'PNG', self.encoded), { 'bytes': 10000, 'id': 1 })
+        self.assertEqual(received, [ self.data ])
+
+class TestFedexLabelSink(unittest.TestCase):
+    def setUp(self):
+        FixtureHandler.fixture = os.path.join(os.path.dirname(__file__), '..', 'wsdl', 'fedex', 'ProcessShipmentReply_Smash_Basic.txt')
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FixtureHandler)
+        threading.Thread(target=self.server.serve_forever).start()
+        self.pools = connections.ConnectionPools()
+
+    def tearDown(self):
+        self.pools.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_label_streams_to_sink(self):
+        credentials = { 'key': 'k', 'password': 'p', 'account_number': 'a', 'meter_number': 'm' }
+        api = fedex.Fedex(credentials, debug=False, transport=clients.PooledTransport(self.pools))
+        location = 'http://127.0.0.1:%d/web-services' % self.server.server_address[1]
+        create_client = api.create_client
+        def local_client(wsdl_name):
+            client = create_client(wsdl_name)
+            client.set_options(location=location)
+            return client
+        api.create_client = local_client
+
+        address = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='5555555555', email='a@example.com')
+        packages = [ fedex.Package(16, 12, 12, 12) ]
+        plain = api.label(packages, 'YOUR_PACKAGING', 'SMART_POST', address, address)
+        received = []
+        streamed = api.label(packages, 'YOUR_PACKAGING', 'SMART_POST', address, address, label_sink=lambda kind, name, ext, data: received.append((kind, name, ext, data)))
+
+        shipment = plain['shipments'][0]
+        self.assertEqual(streamed['shipments'][0], { 'tracking_number': shipment['tracking_number'], 'cost': shipment['cost'], 'label': { 'bytes': len(shipment['label']) } })
+        self.assertEqual(received, [ ('label', shipment['tracking_number'], 'PNG', shipment['label']) ])
+        self.assertIsNone(api.reply.CompletedShipmentDetail.CompletedPackageDetails[0].Label.Parts[0].Image)
+
+if __name__ == '__main__':
+    unittest.main()
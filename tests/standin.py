@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import time
+import sys
+sys.path.append('../')
+
+from urllib2 import HTTPError
+
+from shipping import Address, Package
+from executor import Executor, as_completed
+import connections
+import standin
+import ups
+import fedex
+import endicia
+import USPS
+
+class TestStandinServer(unittest.TestCase):
+    def setUp(self):
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='4085366000', email='a@example.com')
+        self.recipient = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US', phone='4089961010', email='b@example.com')
+        self.endicia_package = endicia.Package(endicia.Package.shipment_types[0], 20, endicia.Package.shapes[1], 12, 12, 12)
+
+    def endicia_api(self, server):
+        return endicia.Endicia({ 'partner_id': 'p', 'account_id': '123456', 'passphrase': 'secret' }, base_url=server.url)
+
+    def test_carriers(self):
+        with standin.StandinServer() as server:
+            api = ups.UPS({ 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }, base_url=server.url)
+            self.assertEqual(api.rate([ Package(10, 10, 10, 10) ], ups.PACKAGES[0][0], self.shipper, self.recipient)['info'][0]['cost'], '10.98')
+            self.assertTrue(api.validate(self.recipient)['valid'])
+
+            api = fedex.Fedex({ 'key': 'k', 'password': 'p', 'account_number': 'a', 'meter_number': 'm' }, debug=False, base_url=server.url)
+            self.assertEqual(api.rate([ fedex.Package(100, 10, 10, 10) ], 'YOUR_PACKAGING', self.shipper, self.recipient)['info'][0]['cost'], 46.45)
+
+            api = self.endicia_api(server)
+            self.assertEqual(api.label(self.endicia_package, self.shipper, self.recipient).tracking, '9400110200881234567890')
+            self.assertEqual(api.rate(self.endicia_package, self.shipper, self.recipient)['info'][0]['cost'], 6.95)
+
+            packages = [ USPS.Package(self.shipper, self.recipient, 5, 8, 12, 12, 12) for i in range(2) ]
+            request = USPS.RateRequest('user', packages)
+            request.base_url = server.url
+            request.Send()
+            self.assertEqual(packages[1].postages['Priority Mail'], '6.95')
+
+            self.assertEqual(server.stats()['operations'], {
+                'ups/Rate': 1, 'ups/XAV': 1, 'fedex/RateRequest': 1,
+                'endicia/GetPostageLabelXML': 1, 'endicia/CalculatePostageRates': 1, 'usps/RateV2': 1,
+            })
+
+    def test_errors(self):
+        with standin.StandinServer(error_rate=0.5, seed=1) as server:
+            api = self.endicia_api(server)
+            failures = 0
+            for i in range(20):
+                try:
+                    api.label(self.endicia_package, self.shipper, self.recipient)
+                except HTTPError, e:
+                    self.assertEqual(e.code, 503)
+                    failures += 1
+            self.assertEqual(server.stats()['errors'], failures)
+            self.assertTrue(0 < failures < 20)
+
+    def test_throttle(self):
+        with standin.StandinServer(throttle=5) as server:
+            api = self.endicia_api(server)
+            codes = []
+            for i in range(8):
+                try:
+                    api.label(self.endicia_package, self.shipper, self.recipient)
+                    codes.append(200)
+                except HTTPError, e:
+                    self.assertEqual(e.hdrs.get('Retry-After'), '1')
+                    codes.append(e.code)
+            self.assertEqual(codes[:5], [ 200 ] * 5)
+            self.assertTrue(503 in codes[5:])
+            self.assertEqual(server.stats()['throttled'], codes.count(503))
+
+    def test_latency_and_concurrency(self):
+        with standin.StandinServer(latency=0.2) as server:
+            pools = connections.ConnectionPools(maxsize=8)
+            executor = Executor(workers=8)
+            start = time.time()
+            futures = [ executor.submit(pools.request, server.url + '/LabelService/EwsLabelService.asmx/GetPostageLabelXML', 'labelRequestXML=x') for i in range(8) ]
+            for future in as_completed(futures, timeout=5):
+                self.assertTrue('<TrackingNumber>' in future.result())
+            elapsed = time.time() - start
+            pools.close()
+            self.assertTrue(0.2 <= elapsed < 1.0, elapsed)
+            self.assertEqual(server.stats()['peak_in_flight'], 8)
+
+    def test_replies(self):
+        with standin.StandinServer(replies={ 'ups/XAV': 'ups/XAVResponse_Ambiguous.txt' }) as server:
+            api = ups.UPS({ 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }, base_url=server.url)
+            self.assertTrue(api.validate(self.recipient)['ambiguous'])
+
+class TestRebase(unittest.TestCase):
+    def test_rebase(self):
+        self.assertEqual(connections.rebase('https://onlinetools.ups.com/webservices/Rate', 'http://127.0.0.1:8080'), 'http://127.0.0.1:8080/webservices/Rate')
+        self.assertEqual(connections.rebase('http://testing.shippingapis.com/ShippingAPITest.dll?API=RateV2&XML=', 'http://localhost:1'),
+            'http://localhost:1/ShippingAPITest.dll?API=RateV2&XML=')
+        self.assertEqual(connections.rebase('https://gateway.fedex.com:443/web-services', None), 'https://gateway.fedex.com:443/web-services')
+
+if __name__ == '__main__':
+    unittest.main()
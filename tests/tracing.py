@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import logging
+import sys
+sys.path.append('../')
+
+from urllib2 import HTTPError
+
+from shipping import Address, Package
+import tracing
+import standin
+import ups
+import fedex
+import endicia
+import USPS
+
+UPS_CREDENTIALS = { 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }
+FEDEX_CREDENTIALS = { 'key': 'k', 'password': 'p', 'account_number': 'a', 'meter_number': 'm' }
+ENDICIA_CREDENTIALS = { 'partner_id': 'p', 'account_id': '123456', 'passphrase': 'secret' }
+
+class TestNoTracer(unittest.TestCase):
+    def test_noop(self):
+        self.assertFalse(tracing.tracer.enabled)
+        with tracing.span('ups.rate', carrier='ups') as span:
+            span.set(packages=1)
+        self.assertTrue(span is tracing.NOOP_SPAN)
+        self.assertEqual(tracing.call(lambda a, b=0: a + b, 1, b=2), 3)
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tracer = tracing.RecordingTracer()
+        tracing.set_tracer(self.tracer)
+        self.server = standin.StandinServer().start()
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='4085366000', email='a@example.com')
+        self.recipient = Address('Apple', '1 Infinite Loop', 'Cupertino', 'CA', 95014, 'US', phone='4089961010', email='b@example.com')
+
+    def tearDown(self):
+        tracing.set_tracer(None)
+        self.server.stop()
+
+    def phases(self, name):
+        """The names of the spans under the one called name, in the order they finished"""
+        top = [ s for s in self.tracer.spans if s.name == name ]
+        self.assertEqual(len(top), 1, self.tracer.spans)
+        return [ s.name for s in self.tracer.spans if s.parent is top[0] ]
+
+    def span(self, name):
+        return [ s for s in self.tracer.spans if s.name == name ][-1]
+
+    def test_ups(self):
+        api = ups.UPS(UPS_CREDENTIALS, base_url=self.server.url)
+        api.rate([ Package(10, 10, 10, 10), Package(5, 5, 5, 5) ], ups.PACKAGES[0][0], self.shipper, self.recipient)
+        self.assertEqual(self.phases('ups.rate'), [ 'client', 'build', 'marshal', 'network', 'unmarshal' ])
+        self.assertEqual(self.span('ups.rate').attributes, { 'carrier': 'ups', 'operation': 'rate', 'packages': 2 })
+        network = self.span('network').attributes
+        self.assertTrue(network['request_bytes'] > 1000)
+        self.assertEqual(network['reply_bytes'], len(self.server._texts['ups/RateResponse_Shop.txt']))
+
+        self.tracer.clear()
+        api.validate(self.recipient)
+        self.assertEqual(self.phases('ups.validate'), [ 'client', 'build', 'marshal', 'network', 'unmarshal' ])
+
+    def test_ups_label(self):
+        api = ups.UPS(UPS_CREDENTIALS, fast_replies=True, base_url=self.server.url)
+        api.label([ Package(10, 10, 10, 10, reference='R1') ], self.shipper, self.recipient, ups.SERVICES[0][0], ups.PACKAGES[0][0], False)
+        # retxml leaves reading the reply to the projection
+        self.assertEqual(self.phases('ups.label'), [ 'client', 'build', 'marshal', 'network', 'unmarshal', 'decode' ])
+        self.assertEqual(self.span('unmarshal').attributes, { 'reader': 'projection' })
+        self.assertEqual(self.span('decode').attributes, { 'labels': 3 })
+
+    def test_fedex(self):
+        for fast_requests, phases in ( ( False, [ 'client', 'build', 'marshal', 'network', 'unmarshal' ] ), ( True, [ 'client', 'marshal', 'network', 'unmarshal' ] ) ):
+            self.tracer.clear()
+            api = fedex.Fedex(FEDEX_CREDENTIALS, debug=False, fast_requests=fast_requests, base_url=self.server.url)
+            api.rate([ fedex.Package(100, 10, 10, 10) ], 'YOUR_PACKAGING', self.shipper, self.recipient)
+            self.assertEqual(self.phases('fedex.rate'), phases)
+            self.assertTrue(self.span('network').attributes['reply_bytes'] > 0)
+
+    def test_endicia(self):
+        package = endicia.Package(endicia.Package.shipment_types[0], 20, endicia.Package.shapes[1], 12, 12, 12)
+        api = endicia.Endicia(ENDICIA_CREDENTIALS, base_url=self.server.url)
+        api.rate(package, self.shipper, self.recipient)
+        self.assertEqual(self.phases('endicia.rate'), [ 'client', 'build', 'marshal', 'network', 'unmarshal' ])
+
+        api.label(package, self.shipper, self.recipient)
+        self.assertEqual(self.phases('endicia.GetPostageLabelXML'), [ 'marshal', 'network', 'unmarshal' ])
+        self.assertEqual(self.span('decode').parent.name, 'unmarshal')
+
+    def test_usps(self):
+        request = USPS.RateRequest('user', [ USPS.Package(self.shipper, self.recipient, 5, 8, 12, 12, 12) for i in range(3) ])
+        request.base_url = self.server.url
+        request.Send()
+        self.assertEqual(self.phases('usps.RateRequest'), [ 'marshal', 'network', 'unmarshal' ])
+        self.assertEqual(self.span('usps.RateRequest').attributes['packages'], 3)
+
+    def test_error(self):
+        self.server.error_rate = 1
+        package = endicia.Package(endicia.Package.shipment_types[0], 20, endicia.Package.shapes[1], 12, 12, 12)
+        self.assertRaises(HTTPError, endicia.Endicia(ENDICIA_CREDENTIALS, base_url=self.server.url).label, package, self.shipper, self.recipient)
+        self.assertEqual(self.span('network').error, 'HTTPError')
+        self.assertEqual(self.span('endicia.GetPostageLabelXML').error, 'HTTPError')
+        self.assertEqual(self.phases('endicia.GetPostageLabelXML'), [ 'marshal', 'network' ])
+
+class TestLoggingTracer(unittest.TestCase):
+    def test_logging(self):
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        tracing.logger.addHandler(handler)
+        tracing.set_tracer(tracing.LoggingTracer())
+        try:
+            with tracing.span('ups.rate', carrier='ups'):
+                with tracing.span('network', request_bytes=10):
+                    pass
+        finally:
+            tracing.set_tracer(None)
+            tracing.logger.removeHandler(handler)
+        self.assertTrue(messages[0].startswith('  network '))
+        self.assertTrue(messages[0].endswith('request_bytes=10'))
+        self.assertTrue(messages[1].startswith('ups.rate '))
+
+if __name__ == '__main__':
+    unittest.main()
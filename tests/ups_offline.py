@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import os
+import sys
+from StringIO import StringIO
+sys.path.append('../')
+
+from xml.etree import ElementTree
+from suds.transport import Transport, TransportError, Reply
+
+from shipping import Address, Package, Product
+import sinks
+import ups
+
+UPS_DIR = os.path.join(os.path.dirname(__file__), '..', 'wsdl', 'ups')
+
+def fixture(name):
+    with open(os.path.join(UPS_DIR, name)) as f:
+        return f.read()
+
+class Sent(Exception):
+    pass
+
+class CaptureTransport(Transport):
+    """Records the envelope and stops the call before anything goes out"""
+    def __init__(self, sent=None):
+        Transport.__init__(self)
+        self.sent = [] if sent is None else sent
+
+    def send(self, request):
+        self.sent.append(request.message)
+        raise Sent()
+
+    def __deepcopy__(self, memo):
+        return CaptureTransport(self.sent)
+
+class ReplyTransport(Transport):
+    """Answers every request with a recorded reply, the way UPS would with the given HTTP status"""
+    def __init__(self, reply, status=200):
+        Transport.__init__(self)
+        self.reply = reply
+        self.status = status
+
+    def send(self, request):
+        if self.status != 200:
+            raise TransportError('Internal Server Error', self.status, StringIO(self.reply))
+        return Reply(200, {}, self.reply)
+
+    def __deepcopy__(self, memo):
+        return ReplyTransport(self.reply, self.status)
+
+CREDENTIALS = { 'username': 'u', 'password': 'p', 'access_license': 'l', 'shipper_number': 's' }
+
+class TestRequestNamespace(unittest.TestCase):
+    def setUp(self):
+        self.transport = CaptureTransport()
+        self.api = ups.UPS(CREDENTIALS, transport=self.transport)
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='5555555555', email='a@example.com')
+        self.recipient = Address('Someone', '1 Rue de Rivoli', 'Paris', '', '75001', 'FR', phone='5555555555', email='b@example.com')
+        self.packages = [ Package(32, 10, 10, 10, value=10, require_signature=2, reference='R1') for i in range(3) ]
+
+    def sent(self, call):
+        self.assertRaises(Sent, call)
+        body = ElementTree.fromstring(self.transport.sent[-1]).find('{http://schemas.xmlsoap.org/soap/envelope/}Body')
+        return list(body)[0]
+
+    def assertCommonRequest(self, operation):
+        tags = [ child.tag for child in operation ]
+        self.assertEqual(tags[0], '{%s}Request' % ups.COMMON_NS)
+        self.assertEqual(operation[0][0].tag, '{%s}RequestOption' % ups.COMMON_NS)
+        # Nothing but Request is moved out of the operation's namespace
+        namespace = operation.tag.split('}')[0]
+        self.assertTrue(all(tag.startswith(namespace) for tag in tags[1:]))
+
+    def test_rate(self):
+        self.assertCommonRequest(self.sent(lambda: self.api.rate(self.packages, ups.PACKAGES[0][0], self.shipper, self.shipper)))
+
+    def test_validate(self):
+        self.assertCommonRequest(self.sent(lambda: self.api.validate(self.shipper)))
+
+    def test_label(self):
+        customs = [ Product(value=5, quantity=1, description='Widget', country='US') for i in range(3) ]
+        operation = self.sent(lambda: self.api.label(self.packages, self.shipper, self.recipient, '65', ups.PACKAGES[0][0], False,
+            email_notifications=[ 'a@example.com' ], create_commercial_invoice=True, customs_info=customs))
+        self.assertCommonRequest(operation)
+        products = [ e for e in operation.iter() if e.tag.endswith('}Product') ]
+        self.assertEqual(len(products), 3)
+        self.assertTrue(products[0].tag.startswith('{http://www.ups.com/XMLSchema/XOLTWS/IF/v1.0}'))
+
+class TestFastReplies(unittest.TestCase):
+    def setUp(self):
+        self.shipper = Address('Adobe', '345 Park Avenue', 'San Jose', 'CA', 95110, 'US', phone='5555555555', email='a@example.com')
+        self.recipient = Address('Someone', '100 Main St', 'Springfield', 'IL', '62701', 'US', phone='5555555555', email='b@example.com')
+        self.packages = [ Package(6, 10, 10, 10, value=10, reference='R1') for i in range(3) ]
+
+    def both(self, reply, call, status=200):
+        """Runs call against the same reply with suds and with the projection"""
+        results = []
+        for fast in ( False, True ):
+            api = ups.UPS(CREDENTIALS, transport=ReplyTransport(fixture(reply) if '<' not in reply else reply, status), fast_replies=fast)
+            results.append(call(api))
+        return results
+
+    def test_rate(self):
+        for reply in ( 'RateResponse_Shop.txt', 'RateResponse_International.txt' ):
+            slow, fast = self.both(reply, lambda api: api.rate(self.packages, ups.PACKAGES[0][0], self.shipper, self.recipient))
+            self.assertEqual(slow, fast)
+        self.assertEqual(fast['info'][-1]['service'], 'Unknown Service: 72')
+        self.assertEqual(fast['info'][0]['cost'], '24.05')
+
+    def test_negotiated_rates(self):
+        slow, fast = self.both('RateResponse_Shop.txt', lambda api: api.rate(self.packages, ups.PACKAGES[0][0], self.shipper, self.recipient))
+        self.assertEqual(fast['info'][0], { 'service': 'UPS Ground', 'package': '', 'delivery_day': '', 'cost': '10.98' })
+        self.assertEqual(slow, fast)
+
+    def test_validate(self):
+        for reply in ( 'XAVResponse_Valid.txt', 'XAVResponse_Ambiguous.txt', 'XAVResponse_NoCandidates.txt' ):
+            slow, fast = self.both(reply, lambda api: api.validate(self.recipient))
+            self.assertEqual(slow, fast)
+        self.assertFalse(fast['valid'] or fast['ambiguous'] or fast['candidates'])
+
+        slow, fast = self.both('XAVResponse_Ambiguous.txt', lambda api: api.validate(self.recipient))
+        self.assertTrue(fast['ambiguous'])
+        # The repeated candidate is dropped and second address lines are kept
+        self.assertEqual(len(fast['candidates']), 4)
+        self.assertEqual(fast['candidates'][1].address2, 'STE 200-210')
+
+    def test_label(self):
+        for reply in ( 'ShipmentResponse_Domestic.txt', 'ShipmentResponse_International.txt' ):
+            slow, fast = self.both(reply, lambda api: api.label(self.packages, self.shipper, self.recipient, '03', ups.PACKAGES[0][0], False))
+            self.assertEqual(slow, fast)
+        self.assertTrue(fast['shipments'][0]['label'].startswith('GIF87a'))
+        self.assertTrue(fast['international_document']['pdf'].startswith('%PDF'))
+
+    def test_label_sink(self):
+        written = []
+        def write(kind, name, ext, data):
+            written.append((kind, name, ext, data))
+        slow, fast = self.both('ShipmentResponse_International.txt', lambda api: api.label(self.packages, self.shipper, self.recipient, '65', ups.PACKAGES[0][0], False, label_sink=write))
+        self.assertEqual(slow, fast)
+        self.assertEqual(written[:2], written[2:])
+        self.assertEqual([ w[0] for w in written[2:] ], [ 'label', 'international_document' ])
+
+    def test_fault(self):
+        # Faults come back as HTTP 500 and never reach the projection
+        errors = []
+        for fast in ( False, True ):
+            api = ups.UPS(CREDENTIALS, transport=ReplyTransport(fixture('Fault_InvalidPostalCode.txt'), 500), fast_replies=fast)
+            try:
+                api.rate(self.packages, ups.PACKAGES[0][0], self.shipper, self.recipient)
+            except Exception, e:
+                errors.append((type(e), str(e)))
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(errors[0], errors[1])
+
+    def test_unexpected_reply(self):
+        # A reply without a status isn't what the projection expects, so suds reads it instead
+        reply = fixture('RateResponse_Shop.txt')
+        start, end = reply.index('<common:Response>'), reply.index('</common:Response>') + len('</common:Response>')
+        reply = reply[:start] + reply[end:]
+        for fast in ( False, True ):
+            api = ups.UPS(CREDENTIALS, transport=ReplyTransport(reply), fast_replies=fast)
+            self.assertRaises(AttributeError, api.rate, self.packages, ups.PACKAGES[0][0], self.shipper, self.recipient)
+
+    def test_unexpected_shape(self):
+        # A candidate without an address line fails the same way on both paths
+        reply = fixture('XAVResponse_Valid.txt').replace('<xav:AddressLine>345 PARK AVE</xav:AddressLine>', '')
+        self.both(reply, lambda api: self.assertRaises(AttributeError, api.validate, self.recipient))
+
+if __name__ == '__main__':
+    unittest.main()
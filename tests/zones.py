@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+sys.path.append('../')
+
+import zones
+
+UPS_CHART = '''UPS Zone Chart for shipments from ZIP codes 951-00 to 951-99
+Dest. ZIP,Ground,3 Day Select,2nd Day Air,2nd Day Air A.M.,Next Day Air Saver,Next Day Air
+004-005,8,308,208,228,138,108
+006-009,[1],-,-,-,-,-
+010-089,8,308,208,228,138,108
+"900-935",5,305,205,225,135,105
+950,2,302,202,222,132,102
+951-961,2,302,202,222,132,102
+'''
+
+class TestZones(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ups.zones')
+
+    def tearDown(self):
+        zones.clear()
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        zones.write(self.path, { '951': [ (0, 899, 8), (900, 961, 2) ], '100': [ (951, 951, 8) ] })
+        matrix = zones.ZoneMatrix(self.path)
+        self.assertEqual(matrix.zone('95110', '10001'), 8)
+        self.assertEqual(matrix.zone('95110', '95014'), 2)
+        self.assertEqual(matrix.zone('10001', '95110'), 8)
+        self.assertEqual(matrix.zone('95110', '99801'), None)
+        self.assertEqual(matrix.zone('95110', 'K1A0B1'), None)
+        self.assertEqual(matrix.zone('95110', ''), None)
+        matrix.close()
+
+    def test_bulk(self):
+        zones.write(self.path, { '951': [ (0, 899, 8), (900, 961, 2) ], '100': [ (951, 951, 8) ] })
+        matrix = zones.ZoneMatrix(self.path)
+        origins = [ '95110', '95110', '10001', '95014', '95110' ]
+        destinations = [ '10001', '95014', '95110', '95110', 'K1A0B1' ]
+        self.assertEqual(matrix.zones(origins, destinations), [ 8, 2, 8, None, None ])
+        self.assertEqual(matrix.zones(origins, destinations), [ matrix.zone(o, d) for o, d in zip(origins, destinations) ])
+        self.assertEqual(matrix.zones([], []), [])
+        matrix.close()
+
+    def test_published_charts(self):
+        ranges = zones.read_chart(UPS_CHART.splitlines())
+        self.assertEqual(ranges, [ (4, 5, 8), (10, 89, 8), (900, 935, 5), (950, 950, 2), (951, 961, 2) ])
+        self.assertEqual(zones.read_chart(UPS_CHART.splitlines(), column=6)[0], (4, 5, 108))
+
+        charts = os.path.join(self.directory, 'charts')
+        os.mkdir(charts)
+        with open(os.path.join(charts, '951.csv'), 'w') as f:
+            f.write(UPS_CHART)
+        with open(os.path.join(charts, 'README.txt'), 'w') as f:
+            f.write('Not a chart')
+        self.assertEqual(zones.load_charts(charts, self.path), 1)
+        self.assertEqual(zones.matrix('ups', self.directory).zone('95110', '93001'), 5)
+        self.assertEqual(zones.matrix('ups', self.directory).zone('95110', '00601'), None)
+
+        # Air zones don't fit in a byte
+        self.assertRaises(ValueError, zones.load_charts, charts, self.path, column=2)
+        self.assertRaises(zones.ZoneError, zones.load_charts, self.directory, self.path)
+
+    def test_refresh(self):
+        zones.write(self.path, { '951': [ (0, 999, 2) ] })
+        matrix = zones.matrix('ups', self.directory)
+        self.assertTrue(zones.matrix('ups', self.directory) is matrix)
+        zones.write(self.path, { '951': [ (0, 999, 3) ] })
+        self.assertEqual(matrix.zone('95110', '10001'), 2)
+        zones.clear()
+        self.assertEqual(zones.matrix('ups', self.directory).zone('95110', '10001'), 3)
+
+    def test_file_mode(self):
+        umask = os.umask(022)
+        try:
+            zones.write(self.path, { '951': [ (0, 999, 2) ] })
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0644)
+
+    def test_bad_files(self):
+        with open(self.path, 'w') as f:
+            f.write(zones.MAGIC + 'short')
+        self.assertRaises(zones.ZoneError, zones.ZoneMatrix, self.path)
+        self.assertRaises(IOError, zones.matrix, 'fedex', self.directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import sys
+import time
+import threading
+from suds.plugin import MessagePlugin
+
+# Every carrier operation is traced as a span named '<carrier>.<operation>'
+# (e.g. 'ups.rate') with carrier, operation and, where there are any, packages
+# attributes. Inside it each phase gets a child span:
+#
+#   client     checking out or building the SOAP client
+#   build      filling in the request objects
+#   marshal    turning the request into the bytes that are sent
+#   network    sending them and waiting for the reply (request_bytes, reply_bytes)
+#   unmarshal  reading the reply
+#   decode     decoding label images (labels)
+#
+# Nothing is recorded until set_tracer() is given a tracer; until then every
+# span is the same do-nothing object.
+
+class Span(object):
+    """A timed phase of a carrier operation. This one records nothing."""
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NOOP_SPAN = Span()
+
+class Tracer(object):
+    """Hands out spans. Subclass it and override span() to pass spans on to another tracing system."""
+    enabled = False
+
+    def span(self, name, **attributes):
+        return NOOP_SPAN
+
+class RecordedSpan(Span):
+    def __init__(self, tracer, name, attributes, parent):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start = None
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.tracer._stack().append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.time() - self.start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer._stack().pop()
+        self.tracer.finish(self)
+        return False
+
+    def __repr__(self):
+        return '<span %s %.1fms %r>' % (self.name, (self.duration or 0) * 1000, self.attributes)
+
+class RecordingTracer(Tracer):
+    """Keeps every finished span in spans. Spans started inside another span on the same thread are its children."""
+    enabled = True
+
+    def __init__(self):
+        self.spans = list()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        stack = self._stack()
+        return RecordedSpan(self, name, attributes, stack[-1] if stack else None)
+
+    def finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans = list()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = list()
+            return self._local.stack
+
+class LoggingTracer(RecordingTracer):
+    """Logs every finished span instead of keeping it"""
+    def __init__(self, level=logging.INFO):
+        RecordingTracer.__init__(self)
+        self.level = level
+
+    def finish(self, span):
+        depth = 0
+        parent = span.parent
+        while parent is not None:
+            depth += 1
+            parent = parent.parent
+        logger.log(self.level, '%s%s %.1fms %s%s', '  ' * depth, span.name, span.duration * 1000,
+            ' '.join('%s=%s' % item for item in sorted(span.attributes.items())), ' error=%s' % span.error if span.error else '')
+
+tracer = Tracer()
+
+def set_tracer(new_tracer):
+    """Sends every carrier's spans to new_tracer. None goes back to not tracing."""
+    global tracer
+    tracer = new_tracer or Tracer()
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+class _Phases(object):
+    """One span after another: each next() ends the current phase and starts the next"""
+    def __init__(self, name, **attributes):
+        self.current = span(name, **attributes).__enter__()
+
+    def next(self, name, **attributes):
+        self.current.__exit__(None, None, None)
+        self.current = span(name, **attributes).__enter__()
+
+    def end(self, *exc_info):
+        self.current.__exit__(*exc_info)
+
+_local = threading.local()
+
+class PhasePlugin(MessagePlugin):
+    """Moves a traced suds call (see call()) from marshal to network to unmarshal.
+
+    clients.ClientCache adds it to every client. Outside call() it does nothing.
+    """
+    def sending(self, context):
+        phases = getattr(_local, 'phases', None)
+        if phases is not None:
+            phases.next('network', request_bytes=len(context.envelope))
+
+    def received(self, context):
+        phases = getattr(_local, 'phases', None)
+        if phases is not None:
+            phases.current.set(reply_bytes=len(context.reply))
+            # With retxml suds hands back the raw reply, and the caller reads it in its own span
+            if not phases.retxml:
+                phases.next('unmarshal')
+
+def call(method, *args, **kwargs):
+    """Calls a suds service method (e.g. client.service.ProcessRate), tracing its marshal, network and unmarshal phases"""
+    if not tracer.enabled:
+        return method(*args, **kwargs)
+
+    phases = _local.phases = _Phases('marshal')
+    phases.retxml = method.client.options.retxml
+    try:
+        result = method(*args, **kwargs)
+    except:
+        phases.end(*sys.exc_info())
+        raise
+    finally:
+        _local.phases = None
+    phases.end(None, None, None)
+    return result
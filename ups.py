@@ -3,13 +3,15 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 import os
+import copy
 import suds
 from suds.client import Client
 from suds.sax.element import Element
 import urllib
 import urlparse
-import base64
+import time
 from datetime import date
+from xml.parsers.expat import ExpatError
 
 try:
    from pysimplesoap.client import SoapClient
@@ -19,6 +21,13 @@ except:
       pass
 
 from shipping import Address
+from iso_country_codes import country_code
+import clients
+import connections
+import metrics
+import sinks
+import tracing
+from projection import Projection
 
 SERVICES = [
     ('03', 'UPS Ground'),
@@ -47,46 +56,101 @@ PACKAGES = [
     ('2c', 'Large Express Box'),
 ]
 
+# Production endpoints for each WSDL; the WSDLs themselves point at the test servers
+COMMON_NS = 'http://www.ups.com/XMLSchema/XOLTWS/Common/v1.0'
+
+ENDPOINTS = {
+    'RateWS.wsdl': 'https://onlinetools.ups.com/webservices/Rate',
+    'Ship.wsdl': 'https://onlinetools.ups.com/webservices/Ship',
+    'XAV.wsdl': 'https://onlinetools.ups.com/webservices/XAV',
+}
+
 LABEL_TYPE = [
 	('GIF', 'GIF Format'),
 	('ZPL','Zebra Label Printer Format')
 ]
 
+RESPONSE_FIELDS = [ 'Response/ResponseStatus/Code', 'Response/ResponseStatus/Description' ]
+
+# The parts of a RateResponse UPS.rate reads
+RATE_REPLY = Projection(RESPONSE_FIELDS + [
+        'RatedShipment/Service/Code',
+        'RatedShipment/TotalCharges/MonetaryValue',
+        'RatedShipment/NegotiatedRateCharges/TotalCharge/MonetaryValue',
+    ],
+    lists=( 'RatedShipment', ),
+)
+
+# The parts of a ShipmentResponse UPS.label reads
+SHIP_REPLY = Projection(RESPONSE_FIELDS + [
+        'ShipmentResults/ShipmentCharges/TotalCharges/MonetaryValue',
+        'ShipmentResults/NegotiatedRateCharges/TotalCharge/MonetaryValue',
+        'ShipmentResults/PackageResults/TrackingNumber',
+        'ShipmentResults/PackageResults/ShippingLabel/GraphicImage',
+        'ShipmentResults/Form/Description',
+        'ShipmentResults/Form/Image/GraphicImage',
+    ],
+    lists=( 'PackageResults', ),
+    binary=( 'ShipmentResults/PackageResults/ShippingLabel/GraphicImage', 'ShipmentResults/Form/Image/GraphicImage' ),
+)
+
+# The parts of an XAVResponse UPS.validate reads
+XAV_REPLY = Projection(RESPONSE_FIELDS + [
+        'ValidAddressIndicator',
+        'AmbiguousAddressIndicator',
+        'AddressClassification/Code',
+        'AddressClassification/Description',
+        'Candidate/AddressKeyFormat/ConsigneeName',
+        'Candidate/AddressKeyFormat/AddressLine',
+        'Candidate/AddressKeyFormat/PoliticalDivision2',
+        'Candidate/AddressKeyFormat/PoliticalDivision1',
+        'Candidate/AddressKeyFormat/PostcodePrimaryLow',
+        'Candidate/AddressKeyFormat/CountryCode',
+    ],
+    lists=( 'Candidate', 'AddressLine' ),
+)
+
 class UPSError(Exception):
     def __init__(self, fault, document):
         self.fault = fault
         self.document = document
 
-        code = self.document.childAtPath('/detail/Errors/ErrorDetail/PrimaryErrorCode/Code').getText()
+        self.code = self.document.childAtPath('/detail/Errors/ErrorDetail/PrimaryErrorCode/Code').getText()
         text = self.document.childAtPath('/detail/Errors/ErrorDetail/PrimaryErrorCode/Description').getText()
-        error_text = 'UPS Error %s: %s' % (code, text)
+        error_text = 'UPS Error %s: %s' % (self.code, text)
 
         super(UPSError, self).__init__(error_text)
         
-def recurseElement(element, search, replace):
-	if search == element.qname():
-		element.rename(replace)
-	if element.isempty != True:
-		for x in element.getChildren():
-			recurseElement(x,search,replace)
-	return 
-
 from suds.plugin import MessagePlugin
 class FixRequestNamespacePlug(MessagePlugin):
-	#marshalled seems to actually replace properly here, wheras sending does not seem to actually replace properly (bug?)
+    """suds puts each operation's Request element in the operation's namespace, but UPS wants it in Common.
+
+    Request is always a direct child of the operation element, so only that one
+    element is renamed and the cost doesn't grow with the number of packages or
+    customs products.
+    """
+    #marshalled seems to actually replace properly here, wheras sending does not seem to actually replace properly (bug?)
     def marshalled(self, context):
-    	element = context.envelope.getChild('Body')
-        #context.envelope = context.envelope.replace('ns1:Request>', 'ns0:Request>').replace('ns2:Request>', 'ns1:Request>')
-        recurseElement(element,'ns1:Request','ns0:Request')
-        recurseElement(element,'ns2:Request','ns1:Request')
+        for operation in context.envelope.getChild('Body').getChildren():
+            request = operation.getChild('Request')
+            if request is not None:
+                request.setPrefix(request.findPrefix(COMMON_NS))
         return context
 
 class UPS(object):
-    def __init__(self, credentials, debug=True):
+    def __init__(self, credentials, debug=True, transport=None, rate_cache=None, fast_replies=False, base_url=None, address_cache=None):
         this_dir = os.path.dirname(os.path.realpath(__file__))
         self.wsdl_dir = os.path.join(this_dir, 'wsdl', 'ups')
         self.credentials = credentials
         self.debug = debug
+        self.transport = transport or clients.transport
+        self.rate_cache = rate_cache
+        # A caching.AddressCache; repeat addresses are answered from it instead of XAV
+        self.address_cache = address_cache
+        # Read rate, ship and XAV replies with a projection instead of having suds unmarshal all of them
+        self.fast_replies = fast_replies
+        # Sends every request to this server instead (e.g. a standin.StandinServer), keeping the UPS paths
+        self.base_url = base_url
     
     def _add_security_header(self, client):
         security_ns = ('security', 'http://www.ups.com/XMLSchema/XOLTWS/UPSS/v1.0')
@@ -108,12 +172,7 @@ class UPS(object):
         client.set_options(soapheaders=security)
     
     def _normalized_country_code(self, country):
-        country_lookup = {
-            'usa': 'US',
-            'united states': 'US',
-            'canada': 'CA',
-        }
-        return country_lookup.get(country.lower(), country)
+        return country_code(country)
         
     def wsdlURL(self, wsdl_name):
         wsdl_file_path = os.path.join(self.wsdl_dir, wsdl_name)
@@ -122,16 +181,73 @@ class UPS(object):
         wsdl_url = urlparse.urljoin('file://', wsdl_file_url)
         return wsdl_url
     
-    def _get_client(self, wsdl):
+    def _get_client(self, wsdl, location=None):
         wsdl_url = self.wsdlURL(wsdl)
         # Setting prefixes=False does not help
-        return Client(wsdl_url, plugins=[FixRequestNamespacePlug()])
+        client = clients.cache.get(wsdl_url, location, plugins=[FixRequestNamespacePlug()])
+        client.set_options(transport=copy.deepcopy(self.transport))
+        self._add_security_header(client)
+        return client
         #Loading with ship.wsdl gives this:
         #ns0 = "http://www.ups.com/XMLSchema/XOLTWS/Common/v1.0"
       	#ns1 = "http://www.ups.com/XMLSchema/XOLTWS/Error/v1.1"
      	#ns2 = "http://www.ups.com/XMLSchema/XOLTWS/IF/v1.0"
       	#ns3 = "http://www.ups.com/XMLSchema/XOLTWS/Ship/v1.0"
         
+    def _client(self, wsdl):
+        """Checks out a warmed, authenticated client from the pool for these credentials"""
+        if self.base_url:
+            location = connections.rebase(ENDPOINTS[wsdl], self.base_url)
+        else:
+            location = None if self.debug else ENDPOINTS[wsdl]
+        credentials = tuple(sorted(self.credentials.items()))
+        # Transports sending over the same connection pools are interchangeable, so they share clients
+        transport = self.transport
+        if isinstance(transport, clients.PooledTransport):
+            transport = transport.pools or connections.pools
+        key = (self.wsdlURL(wsdl), location, credentials, transport)
+        return clients.pools.get(key, lambda: self._get_client(wsdl, location)).client()
+
+    def warmup(self):
+        """Parses every UPS WSDL and authenticates one pooled client for each"""
+        timings = dict()
+        for wsdl in ENDPOINTS:
+            start = time.time()
+            with self._client(wsdl):
+                pass
+            timings[wsdl] = time.time() - start
+        return timings
+
+    def _call(self, client, operation, projection, read, *args, **kwargs):
+        """Calls operation and returns (reply, read(reply)).
+
+        With fast_replies the raw reply is read with projection. If that doesn't
+        have the shape read() expects, the same reply is handed to suds instead,
+        so an unexpected reply costs a second parse rather than a wrong answer.
+        """
+        service = getattr(client.service, operation)
+        if not self.fast_replies:
+            reply = tracing.call(service, *args, **kwargs)
+            return reply, read(reply)
+
+        client.set_options(retxml=True)
+        try:
+            raw = tracing.call(service, *args, **kwargs)
+        finally:
+            client.set_options(retxml=False)
+        try:
+            with tracing.span('unmarshal', reader='projection'):
+                reply = projection.parse(raw)
+                # Every reply has a status, so a projection without one wasn't the reply we expected
+                reply.Response.ResponseStatus.Code
+            return reply, read(reply)
+        except (AttributeError, IndexError, ExpatError), e:
+            logger.info('Reading %s reply with suds: %r', operation, e)
+        kwargs['__inject'] = { 'reply': raw }
+        with tracing.span('unmarshal', reader='suds'):
+            reply = service(*args, **kwargs)
+        return reply, read(reply)
+
     def soapClient(self, wsdl):
         wsdl_url = self.wsdlURL(wsdl)
         return SoapClient(wsdl=wsdl_url, trace=True)
@@ -219,244 +335,279 @@ class UPS(object):
         return shipment
 
     def rate(self, packages, packaging_type, shipper, recipient):
-        client = self._get_client('RateWS.wsdl')
-        self._add_security_header(client)
-        if not self.debug:
-            client.set_options(location='https://onlinetools.ups.com/webservices/Rate')
+        # Only calls that reach UPS are counted and timed, not cache hits
+        rate = metrics.measured('ups', 'rate', self._rate)
+        with tracing.span('ups.rate', carrier='ups', operation='rate', packages=len(packages)):
+            if self.rate_cache is not None:
+                return self.rate_cache.fetch('ups', rate, packages, packaging_type, shipper, recipient, account=self._rate_account())
+            return rate(packages, packaging_type, shipper, recipient)
 
-        request = client.factory.create('ns0:RequestType')
-        request.RequestOption = 'Shop'
+    def _rate_account(self):
+        # What a cached rate was quoted for: the account, the credentials and the server
+        return ( self.credentials['shipper_number'], self.credentials['username'], self.credentials['access_license'], self.debug, self.base_url )
 
-        classification = client.factory.create('ns2:CodeDescriptionType')
-        classification.Code = '00' # Get rates for the shipper account
+    def _rate(self, packages, packaging_type, shipper, recipient):
+        with self._client('RateWS.wsdl') as client:
+            with tracing.span('build'):
+                request = client.factory.create('ns0:RequestType')
+                request.RequestOption = 'Shop'
 
-        shipment = self._create_shipment(client, packages, shipper, recipient, packaging_type, namespace='ns2', create_reference_number=False)
-        shipment.ShipmentRatingOptions.NegotiatedRatesIndicator = ''
+                classification = client.factory.create('ns2:CodeDescriptionType')
+                classification.Code = '00' # Get rates for the shipper account
 
-        try:
-            logger.debug(shipment)
-            self.reply = client.service.ProcessRate(request, CustomerClassification=classification, Shipment=shipment)
-            logger.debug(self.reply)
-            
-            service_lookup = dict(SERVICES)
+                shipment = self._create_shipment(client, packages, shipper, recipient, packaging_type, namespace='ns2', create_reference_number=False)
+                shipment.ShipmentRatingOptions.NegotiatedRatesIndicator = ''
 
-            info = list()
-            for r in self.reply.RatedShipment:
-                unknown_service = 'Unknown Service: {0}'.format(r.Service.Code)
-                try:
-                    cost = r.NegotiatedRateCharges.TotalCharge.MonetaryValue
-                except AttributeError:
-                    cost = r.TotalCharges.MonetaryValue
-                info.append({
-                    'service': service_lookup.get(r.Service.Code, unknown_service),
-                    'package': '',
-                    'delivery_day': '',
-                    'cost': cost
-                })
-
-            response = { 'status': self.reply.Response.ResponseStatus.Description, 'info': info }
-            return response
-        except suds.WebFault as e:
-            raise UPSError(e.fault, e.document)
+            try:
+                logger.debug(shipment)
+                self.reply, response = self._call(client, 'ProcessRate', RATE_REPLY, self._rate_response, request, CustomerClassification=classification, Shipment=shipment)
+                logger.debug(self.reply)
+                return response
+            except suds.WebFault as e:
+                raise UPSError(e.fault, e.document)
+
+    def _rate_response(self, reply):
+        service_lookup = dict(SERVICES)
+
+        info = list()
+        for r in reply.RatedShipment:
+            unknown_service = 'Unknown Service: {0}'.format(r.Service.Code)
+            try:
+                cost = r.NegotiatedRateCharges.TotalCharge.MonetaryValue
+            except AttributeError:
+                cost = r.TotalCharges.MonetaryValue
+            info.append({
+                'service': service_lookup.get(r.Service.Code, unknown_service),
+                'package': '',
+                'delivery_day': '',
+                'cost': cost
+            })
+
+        return { 'status': reply.Response.ResponseStatus.Description, 'info': info }
     
     def validate(self, recipient):
-        client = self._get_client('XAV.wsdl')
-        #client = self.soapClient('XAV.wsdl')
-        #wsdl_url = self.wsdlURL('XAV.wsdl')
-        #client = SoapClient(wsdl = wsdl_url, trace=True)
-        #return client
+        validate = metrics.measured('ups', 'validate', self._validate)
+        with tracing.span('ups.validate', carrier='ups', operation='validate'):
+            if self.address_cache is not None:
+                return self.address_cache.fetch(validate, recipient)
+            return validate(recipient)
+
+    def _validate(self, recipient):
+        with self._client('XAV.wsdl') as client:
+            #client = self.soapClient('XAV.wsdl')
+            #wsdl_url = self.wsdlURL('XAV.wsdl')
+            #client = SoapClient(wsdl = wsdl_url, trace=True)
+            #return client
         
-        self._add_security_header(client)
-        if not self.debug:
-            client.set_options(location='https://onlinetools.ups.com/webservices/XAV')
+            with tracing.span('build'):
+                request = client.factory.create('ns0:RequestType')
+                request.RequestOption = 3 # Address Validation w/ Classification
+
+                address = client.factory.create('ns2:AddressKeyFormatType')
+                address.ConsigneeName = recipient.name
+                address.AddressLine = [ recipient.address1, recipient.address2 ]
+                address.PoliticalDivision2 = recipient.city
+                address.PoliticalDivision1 = recipient.state
+                address.PostcodePrimaryLow = recipient.zip
+                address.CountryCode = self._normalized_country_code(recipient.country)
         
-        request = client.factory.create('ns0:RequestType')
-        request.RequestOption = 3 # Address Validation w/ Classification
-        
-        address = client.factory.create('ns2:AddressKeyFormatType')
-        address.ConsigneeName = recipient.name
-        address.AddressLine = [ recipient.address1, recipient.address2 ]
-        address.PoliticalDivision2 = recipient.city
-        address.PoliticalDivision1 = recipient.state
-        address.PostcodePrimaryLow = recipient.zip
-        address.CountryCode = self._normalized_country_code(recipient.country)
-        
-        try:
-            reply = client.service.ProcessXAV(request, AddressKeyFormat=address)
-            
-            result = {}
-            
-            result['candidates'] = list()
-            if hasattr(reply, 'Candidate'):
-                for c in reply.Candidate:
-                    name = c.AddressKeyFormat.ConsigneeName if hasattr(c.AddressKeyFormat, 'ConsigneeName') else ''
-                    a = Address(
-                        name,
-                        c.AddressKeyFormat.AddressLine[0],
-                        c.AddressKeyFormat.PoliticalDivision2,
-                        c.AddressKeyFormat.PoliticalDivision1,
-                        c.AddressKeyFormat.PostcodePrimaryLow,
-                        c.AddressKeyFormat.CountryCode)
-                    if len(c.AddressKeyFormat.AddressLine) > 1:
-                        a.address2 = c.AddressKeyFormat.AddressLine[1]
-
-                    if a not in result['candidates']:
-                        result['candidates'].append(a)
-                        
-            if hasattr(reply, 'AddressClassification'):
-               # Need some better names maybe
-               result['class_code'] = reply.AddressClassification.Code
-               result['class_description'] = reply.AddressClassification.Description
-            
-            result['valid'] = hasattr(reply, 'ValidAddressIndicator')
-            result['ambiguous'] =  hasattr(reply, 'AmbiguousAddressIndicator')
-            return result
-        except suds.WebFault as e:
-            raise UPSError(e.fault, e.document)
+            try:
+                reply, result = self._call(client, 'ProcessXAV', XAV_REPLY, self._validate_response, request, AddressKeyFormat=address)
+                return result
+            except suds.WebFault as e:
+                raise UPSError(e.fault, e.document)
+
+    def _validate_response(self, reply):
+        result = {}
+
+        result['candidates'] = list()
+        seen = set()
+        if hasattr(reply, 'Candidate'):
+            for c in reply.Candidate:
+                name = c.AddressKeyFormat.ConsigneeName if hasattr(c.AddressKeyFormat, 'ConsigneeName') else ''
+                a = Address(
+                    name,
+                    c.AddressKeyFormat.AddressLine[0],
+                    c.AddressKeyFormat.PoliticalDivision2,
+                    c.AddressKeyFormat.PoliticalDivision1,
+                    c.AddressKeyFormat.PostcodePrimaryLow,
+                    c.AddressKeyFormat.CountryCode)
+                if len(c.AddressKeyFormat.AddressLine) > 1:
+                    a.address2 = c.AddressKeyFormat.AddressLine[1]
+
+                if a not in seen:
+                    seen.add(a)
+                    result['candidates'].append(a)
+
+        if hasattr(reply, 'AddressClassification'):
+           # Need some better names maybe
+           result['class_code'] = reply.AddressClassification.Code
+           result['class_description'] = reply.AddressClassification.Description
+
+        result['valid'] = hasattr(reply, 'ValidAddressIndicator')
+        result['ambiguous'] =  hasattr(reply, 'AmbiguousAddressIndicator')
+        return result
     
-    def label(self, packages, shipper_address, recipient_address, service, box_shape, validate_address, email_notifications=list(), create_commercial_invoice=False, customs_info=[], label_type=LABEL_TYPE[0][0]):
-        client = self._get_client('Ship.wsdl')
-        self._add_security_header(client)
-        if not self.debug:
-            client.set_options(location='https://onlinetools.ups.com/webservices/Ship')
-
-        request = client.factory.create('ns0:RequestType')
-        request.RequestOption = 'validate' if validate_address else 'nonvalidate'
+    def label(self, packages, shipper_address, recipient_address, service, box_shape, validate_address, email_notifications=list(), create_commercial_invoice=False, customs_info=[], label_type=LABEL_TYPE[0][0], label_sink=None):
+        """label_sink, if given, receives the label images (see sinks.get_sink) and the response only references them"""
+        label_sink = sinks.get_sink(label_sink)
+        with metrics.request('ups', 'label'), tracing.span('ups.label', carrier='ups', operation='label', packages=len(packages)), self._client('Ship.wsdl') as client:
+            with tracing.span('build'):
+                request = client.factory.create('ns0:RequestType')
+                request.RequestOption = 'validate' if validate_address else 'nonvalidate'
         
-        create_reference_number = recipient_address.country in ( 'US', 'CA', 'PR' ) and shipper_address.country == recipient_address.country
-        delivery_confirmation = create_reference_number
-        shipment = self._create_shipment(client, packages, shipper_address, recipient_address, box_shape, create_reference_number=create_reference_number, can_add_delivery_confirmation=delivery_confirmation)
-        #apparently setting this to '' does not include it in SUDS output, so a space seems to do the trick
-       	shipment.ShipmentRatingOptions.NegotiatedRatesIndicator = ' '
-
-        if not create_reference_number:
-            reference_number = client.factory.create('ns3:ReferenceNumberType')
-            reference_number.Value = packages[0].reference
-            shipment.ReferenceNumber.append(reference_number)
-
-        # Kinda bad hack for supporting delivery confirmation at the shipment level (as opposed
-        # to the package level)
-        package = packages[0]
-        if not delivery_confirmation and package.require_signature:
-            # delivery confirmation must be at least 2 (signature required) if we're going international
-            package.require_signature = package.require_signature if package.require_signature > 1 else 2
-            shipment.ShipmentServiceOptions.DeliveryConfirmation.DCISType = unicode(package.require_signature)
-
-        charge = client.factory.create('ns3:ShipmentChargeType')
-        charge2 = client.factory.create('ns3:ShipmentChargeType')
-        charge.Type = '01'
-        charge2.Type = '02'
-        charge.BillShipper.AccountNumber = self.credentials['shipper_number']
-        charge2.BillShipper.AccountNumber = self.credentials['shipper_number']
+                create_reference_number = recipient_address.country in ( 'US', 'CA', 'PR' ) and shipper_address.country == recipient_address.country
+                delivery_confirmation = create_reference_number
+                shipment = self._create_shipment(client, packages, shipper_address, recipient_address, box_shape, create_reference_number=create_reference_number, can_add_delivery_confirmation=delivery_confirmation)
+                #apparently setting this to '' does not include it in SUDS output, so a space seems to do the trick
+                shipment.ShipmentRatingOptions.NegotiatedRatesIndicator = ' '
+
+                if not create_reference_number:
+                    reference_number = client.factory.create('ns3:ReferenceNumberType')
+                    reference_number.Value = packages[0].reference
+                    shipment.ReferenceNumber.append(reference_number)
+
+                # Kinda bad hack for supporting delivery confirmation at the shipment level (as opposed
+                # to the package level)
+                package = packages[0]
+                if not delivery_confirmation and package.require_signature:
+                    # delivery confirmation must be at least 2 (signature required) if we're going international
+                    package.require_signature = package.require_signature if package.require_signature > 1 else 2
+                    shipment.ShipmentServiceOptions.DeliveryConfirmation.DCISType = unicode(package.require_signature)
+
+                charge = client.factory.create('ns3:ShipmentChargeType')
+                charge2 = client.factory.create('ns3:ShipmentChargeType')
+                charge.Type = '01'
+                charge2.Type = '02'
+                charge.BillShipper.AccountNumber = self.credentials['shipper_number']
+                charge2.BillShipper.AccountNumber = self.credentials['shipper_number']
         
-        #Bill duties to shipper if this is an international shipment
-        if shipment.Shipper.Address.CountryCode != shipment.ShipTo.Address.CountryCode:
-        	shipment.PaymentInformation.ShipmentCharge = [charge,charge2]
-        else:
-        	shipment.PaymentInformation.ShipmentCharge = charge
-
-        shipment.Description = 'Shipment from %s to %s' % (shipper_address.name, recipient_address.name)
-        shipment.Description = shipment.Description[:50]
-        shipment.Service.Code = service
-
-        shipment.Shipper.AttentionName = shipper_address.name[:35] or shipper_address.company_name[:35]
-        shipment.Shipper.Phone.Number = shipper_address.phone
-        shipment.Shipper.EMailAddress = shipper_address.email
-        shipment.ShipTo.AttentionName = recipient_address.name[:35] or recipient_address.company_name[:35] or ''
-        shipment.ShipTo.Phone.Number = recipient_address.phone
-        shipment.ShipTo.EMailAddress = recipient_address.email
-
-        # Set the value of the shipment by adding up the value of the individual packages. If the packages don't
-        # have a value, set it to $100. UPS doesn't charge for insurance up to $100, so this gives maximum benefit
-        # without costing more.
-        if shipment.Shipper.Address.CountryCode == 'US' and shipment.ShipTo.Address.CountryCode in ( 'PR', 'CA' ):
-            shipment.InvoiceLineTotal.CurrencyCode = 'USD'
-            shipment.InvoiceLineTotal.MonetaryValue = sum([ p.value or 0 for p in packages]) or 100
-
-        for i, p in enumerate(shipment.Package):
-            p.Description = 'Package %d' % i
-
-        if email_notifications:
-            notification = client.factory.create('ns3:NotificationType')
-            notification.NotificationCode = 6 # Ship Notification
-            notification.EMail.EMailAddress = email_notifications
-            shipment.ShipmentServiceOptions.Notification.append(notification)
-
-        if create_commercial_invoice:
-            shipment.ShipmentServiceOptions.InternationalForms.FormType = '01'
-            shipment.ShipmentServiceOptions.InternationalForms.InvoiceNumber = packages[0].reference
-            shipment.ShipmentServiceOptions.InternationalForms.InvoiceDate = date.today().strftime('%Y%m%d')
-            shipment.ShipmentServiceOptions.InternationalForms.ReasonForExport = 'SALE'
-            shipment.ShipmentServiceOptions.InternationalForms.CurrencyCode = 'USD'
-
-            shipto_name = recipient_address.name[:35]
-            shipto_company = recipient_address.company_name[:35]
-            shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Name = shipto_company or shipto_name
-            shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.AttentionName = shipto_name or shipto_company
-            shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.AddressLine = [ recipient_address.address1, recipient_address.address2 ]
-            shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.City = recipient_address.city
-            shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.PostalCode = recipient_address.zip
-            recipient_country = self._normalized_country_code(recipient_address.country)
-            shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.CountryCode = recipient_country
-            shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Phone.Number = recipient_address.phone
-
-            # Only add states if we're shipping to/from US, CA, or Ireland
-            if recipient_country in ( 'US', 'CA', 'IE' ):
-                shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.StateProvinceCode = recipient_address.state
-
-            for p in customs_info:
-                product = client.factory.create('ns2:ProductType')
-                product.Unit.UnitOfMeasurement.Code = 'PCS'
-                product.Unit.Value = p.value
-                product.Unit.Number = p.quantity
-                product.Description = p.description[:35]
-                product.OriginCountryCode = self._normalized_country_code(p.country)
-                ''' check for optional commodity code '''
-                try:
-                    product.CommodityCode = p.commoditycode
-                except:
-                    pass
-                shipment.ShipmentServiceOptions.InternationalForms.Product.append(product)
-
-        label = client.factory.create('ns3:LabelSpecificationType')
-        label.LabelImageFormat.Code = label_type
-        if label_type == LABEL_TYPE[1][0]:
-        	label.LabelStockSize.Height = '6'
-       		label.LabelStockSize.Width = '4'
-        label.HTTPUserAgent = 'Mozilla/4.5'
-        try:
-            self.reply = client.service.ProcessShipment(request, shipment, label)
-            results = self.reply.ShipmentResults
-            logger.debug(results)
-
-            response = {
-                'status': self.reply.Response.ResponseStatus.Description,
-                'shipments': list(),
-                'international_document': {
-                    'description': None,
-                    'pdf': None
-                }
-            }
-
+                #Bill duties to shipper if this is an international shipment
+                if shipment.Shipper.Address.CountryCode != shipment.ShipTo.Address.CountryCode:
+                        shipment.PaymentInformation.ShipmentCharge = [charge,charge2]
+                else:
+                        shipment.PaymentInformation.ShipmentCharge = charge
+
+                shipment.Description = 'Shipment from %s to %s' % (shipper_address.name, recipient_address.name)
+                shipment.Description = shipment.Description[:50]
+                shipment.Service.Code = service
+
+                shipment.Shipper.AttentionName = shipper_address.name[:35] or shipper_address.company_name[:35]
+                shipment.Shipper.Phone.Number = shipper_address.phone
+                shipment.Shipper.EMailAddress = shipper_address.email
+                shipment.ShipTo.AttentionName = recipient_address.name[:35] or recipient_address.company_name[:35] or ''
+                shipment.ShipTo.Phone.Number = recipient_address.phone
+                shipment.ShipTo.EMailAddress = recipient_address.email
+
+                # Set the value of the shipment by adding up the value of the individual packages. If the packages don't
+                # have a value, set it to $100. UPS doesn't charge for insurance up to $100, so this gives maximum benefit
+                # without costing more.
+                if shipment.Shipper.Address.CountryCode == 'US' and shipment.ShipTo.Address.CountryCode in ( 'PR', 'CA' ):
+                    shipment.InvoiceLineTotal.CurrencyCode = 'USD'
+                    shipment.InvoiceLineTotal.MonetaryValue = sum([ p.value or 0 for p in packages]) or 100
+
+                for i, p in enumerate(shipment.Package):
+                    p.Description = 'Package %d' % i
+
+                if email_notifications:
+                    notification = client.factory.create('ns3:NotificationType')
+                    notification.NotificationCode = 6 # Ship Notification
+                    notification.EMail.EMailAddress = email_notifications
+                    shipment.ShipmentServiceOptions.Notification.append(notification)
+
+                if create_commercial_invoice:
+                    shipment.ShipmentServiceOptions.InternationalForms.FormType = '01'
+                    shipment.ShipmentServiceOptions.InternationalForms.InvoiceNumber = packages[0].reference
+                    shipment.ShipmentServiceOptions.InternationalForms.InvoiceDate = date.today().strftime('%Y%m%d')
+                    shipment.ShipmentServiceOptions.InternationalForms.ReasonForExport = 'SALE'
+                    shipment.ShipmentServiceOptions.InternationalForms.CurrencyCode = 'USD'
+
+                    shipto_name = recipient_address.name[:35]
+                    shipto_company = recipient_address.company_name[:35]
+                    shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Name = shipto_company or shipto_name
+                    shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.AttentionName = shipto_name or shipto_company
+                    shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.AddressLine = [ recipient_address.address1, recipient_address.address2 ]
+                    shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.City = recipient_address.city
+                    shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.PostalCode = recipient_address.zip
+                    recipient_country = self._normalized_country_code(recipient_address.country)
+                    shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.CountryCode = recipient_country
+                    shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Phone.Number = recipient_address.phone
+
+                    # Only add states if we're shipping to/from US, CA, or Ireland
+                    if recipient_country in ( 'US', 'CA', 'IE' ):
+                        shipment.ShipmentServiceOptions.InternationalForms.Contacts.SoldTo.Address.StateProvinceCode = recipient_address.state
+
+                    for p in customs_info:
+                        product = client.factory.create('ns2:ProductType')
+                        product.Unit.UnitOfMeasurement.Code = 'PCS'
+                        product.Unit.Value = p.value
+                        product.Unit.Number = p.quantity
+                        product.Description = p.description[:35]
+                        product.OriginCountryCode = self._normalized_country_code(p.country)
+                        ''' check for optional commodity code '''
+                        try:
+                            product.CommodityCode = p.commoditycode
+                        except:
+                            pass
+                        shipment.ShipmentServiceOptions.InternationalForms.Product.append(product)
+
+                label = client.factory.create('ns3:LabelSpecificationType')
+                label.LabelImageFormat.Code = label_type
+                if label_type == LABEL_TYPE[1][0]:
+                        label.LabelStockSize.Height = '6'
+                        label.LabelStockSize.Width = '4'
+                label.HTTPUserAgent = 'Mozilla/4.5'
             try:
-                cost = results.NegotiatedRateCharges.TotalCharge.MonetaryValue
-            except AttributeError:
-                cost = results.ShipmentCharges.TotalCharges.MonetaryValue
+                read = lambda reply: self._label_response(reply, label_type, label_sink)
+                self.reply, response = self._call(client, 'ProcessShipment', SHIP_REPLY, read, request, shipment, label)
+                logger.debug(self.reply.ShipmentResults)
+                return response
+            except suds.WebFault as e:
+                print client.last_sent()
+                raise UPSError(e.fault, e.document)
+
+    def _label_response(self, reply, label_type, label_sink):
+        results = reply.ShipmentResults
+
+        response = {
+            'status': reply.Response.ResponseStatus.Description,
+            'shipments': list(),
+            'international_document': {
+                'description': None,
+                'pdf': None
+            }
+        }
 
-            for p in results.PackageResults:
+        try:
+            cost = results.NegotiatedRateCharges.TotalCharge.MonetaryValue
+        except AttributeError:
+            cost = results.ShipmentCharges.TotalCharges.MonetaryValue
+
+        # Read every image before writing any, so a reply that has to be read again doesn't write some twice
+        images = [ (p, p.TrackingNumber, p.ShippingLabel.GraphicImage) for p in results.PackageResults ]
+        with tracing.span('decode', labels=len(images)):
+            for p, tracking_number, image in images:
+                if label_sink:
+                    label = label_sink.write('label', tracking_number, label_type, image)
+                    # Drop the base64 text so self.reply doesn't keep every image alive either
+                    p.ShippingLabel.GraphicImage = None
+                else:
+                    label = sinks.decode(image)
                 response['shipments'].append({
-                    'tracking_number': p.TrackingNumber,
+                    'tracking_number': tracking_number,
                     'cost': cost,
-                    'label': base64.b64decode(p.ShippingLabel.GraphicImage),
+                    'label': label,
                 })
-            
+
             try:
                 response['international_document']['description'] = results.Form.Description
-                response['international_document']['pdf'] = base64.b64decode(results.Form.Image.GraphicImage)
+                if label_sink:
+                    name = response['shipments'][0]['tracking_number'] if response['shipments'] else 'shipment'
+                    response['international_document']['pdf'] = label_sink.write('international_document', name, 'PDF', results.Form.Image.GraphicImage)
+                    results.Form.Image.GraphicImage = None
+                else:
+                    response['international_document']['pdf'] = sinks.decode(results.Form.Image.GraphicImage)
             except AttributeError as e:
                 pass
 
-            return response
-        except suds.WebFault as e:
-            print client.last_sent()
-            raise UPSError(e.fault, e.document)
+        return response
@@ -0,0 +1,163 @@
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import re
+import mmap
+import tempfile
+import threading
+
+# Shipping zones between US ZIP codes, by their first three digits (ZIP3).
+# Each carrier's zones are a 1000 x 1000 matrix of one-byte zones, origin
+# ZIP3 by destination ZIP3, kept in <carrier>.zones in the tables directory
+# and memory-mapped read-only so every process shares one copy. Zone 0
+# means there's no zone between them.
+#
+# load_charts() makes the file from the zone charts carriers publish, one
+# per origin ZIP3.
+
+TABLES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'tables')
+
+MAGIC = 'SHIPZN01'
+SIZE = 1000 * 1000
+
+class ZoneError(Exception):
+    pass
+
+def _zip3(zip):
+    zip = zip[:3]
+    if len(zip) == 3 and zip.isdigit():
+        return int(zip)
+    return None
+
+def write(path, chart):
+    """Writes a zones file. chart maps each origin ZIP3 to a list of (lowest, highest destination ZIP3, zone)."""
+    matrix = bytearray(SIZE)
+    for origin, ranges in chart.items():
+        start = int(origin) * 1000
+        for low, high, zone in ranges:
+            if not 0 < zone < 256:
+                raise ValueError('Zone %r from %s to %s-%s is not between 1 and 255' % (zone, origin, low, high))
+            matrix[start + int(low):start + int(high) + 1] = chr(zone) * (int(high) - int(low) + 1)
+    _write(path, [ MAGIC, str(matrix) ])
+
+def _umask():
+    # Only readable by setting it, so it's set straight back
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def _write(path, parts):
+    # Written beside the old file and renamed over it, so processes with the old one mapped keep reading it
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for part in parts:
+                f.write(part)
+        # mkstemp makes the file readable only by its owner, but every worker process needs to read it
+        os.chmod(temp, 0666 & ~_umask())
+        os.rename(temp, path)
+    except:
+        os.unlink(temp)
+        raise
+
+# "004-005", "004", "00401-00599" or "004---005", then the zone columns
+_CHART_ROW = re.compile(r'^\s*"?(\d{3})\d*(?:\s*-+\s*(\d{3})\d*)?"?\s*$')
+
+def read_chart(lines, column=1):
+    """Reads a published zone chart for one origin, e.g. UPS's or FedEx's CSV charts, as
+    [ (lowest, highest destination ZIP3, zone) ]. The destinations are the first column
+    and the zones column; header rows and services not offered ("-", "NA") are skipped."""
+    ranges = list()
+    for line in lines:
+        fields = line.strip().split(',')
+        if len(fields) <= column:
+            continue
+        match = _CHART_ROW.match(fields[0])
+        zone = fields[column].strip().strip('"')
+        if not match or not zone.isdigit():
+            continue
+        low, high = match.group(1), match.group(2) or match.group(1)
+        ranges.append(( int(low), int(high), int(zone) ))
+    return ranges
+
+def load_charts(directory, path, column=1):
+    """Writes a zones file from every chart in directory named for its origin ZIP3 (e.g. 951.csv).
+    Returns how many origins were read."""
+    chart = dict()
+    for name in sorted(os.listdir(directory)):
+        origin, extension = os.path.splitext(name)
+        if _zip3(origin) is None or len(origin) != 3:
+            continue
+        with open(os.path.join(directory, name), 'rU') as f:
+            chart[origin] = read_chart(f, column)
+        if not chart[origin]:
+            logger.warning('No zones in %s', name)
+    if not chart:
+        raise ZoneError('No zone charts in %s' % directory)
+    write(path, chart)
+    return len(chart)
+
+class ZoneMatrix(object):
+    """A memory-mapped zones file"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) != len(MAGIC) + SIZE or self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ZoneError('%s is not a zones file' % path)
+
+    def zone(self, origin_zip, destination_zip):
+        """The zone between two ZIP codes, or None where there isn't one"""
+        origin, destination = _zip3(origin_zip), _zip3(destination_zip)
+        if origin is None or destination is None:
+            return None
+        return ord(self._map[len(MAGIC) + origin * 1000 + destination]) or None
+
+    def zones(self, origin_zips, destination_zips):
+        """The zones between each origin and destination ZIP code, like zone() for each pair"""
+        # Each ZIP3 is parsed, and each origin's row read, only once
+        parsed = dict()
+        rows = dict()
+        result = list()
+        for origin_zip, destination_zip in zip(origin_zips, destination_zips):
+            origin, destination = origin_zip[:3], destination_zip[:3]
+            row = rows.get(origin)
+            if row is None:
+                o = _zip3(origin)
+                if o is None:
+                    result.append(None)
+                    continue
+                start = len(MAGIC) + o * 1000
+                row = rows[origin] = bytearray(self._map[start:start + 1000])
+            d = parsed.get(destination, -1)
+            if d == -1:
+                d = parsed[destination] = _zip3(destination)
+            result.append(None if d is None else row[d] or None)
+        return result
+
+    def close(self):
+        self._map.close()
+
+_matrices = dict()
+_lock = threading.Lock()
+
+def matrix(carrier, directory=TABLES_DIR):
+    """The carrier's ZoneMatrix from directory, mapped the first time it's asked for"""
+    key = ( carrier, directory )
+    m = _matrices.get(key)
+    if m is None:
+        with _lock:
+            m = _matrices.get(key)
+            if m is None:
+                m = _matrices[key] = ZoneMatrix(os.path.join(directory, '%s.zones' % carrier))
+    return m
+
+def zone(carrier, origin_zip, destination_zip):
+    return matrix(carrier).zone(origin_zip, destination_zip)
+
+def clear():
+    """Forgets every mapped matrix, so the next matrix() maps files load_charts() has rewritten since"""
+    with _lock:
+        _matrices.clear()